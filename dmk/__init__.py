@@ -1,4 +1,49 @@
+from typing import TYPE_CHECKING
+
 from ._constants import __version__
-from ._vault_file import DmkFile
 from ._cli import dmk_cli
-from ._vault_file_ops import set_text, get_text, set_file, get_file, DmkKeyError
+
+# The modules below import the cryptography, which takes most of the startup
+# time. They are imported on first access, so the CLI does not wait for them
+# when it does not need them.
+
+if TYPE_CHECKING:
+    from ._vault_file import DmkFile, DmkVersionError
+    from ._async_vault_file import AsyncDmkFile
+    from ._vault_segments import SegmentedDmkFile
+    from ._vault_stream import StreamedVault
+    from ._vault_memory import MemoryDmkFile
+    from ._vault_file_ops import set_text, get_text, set_file, get_file, \
+        migrate
+    from ._common import DmkKeyError
+    from ._client import DmkClient, DmkServerError
+
+_LAZY_IMPORTS = {
+    'DmkFile': '._vault_file',
+    'DmkVersionError': '._vault_file',
+    'AsyncDmkFile': '._async_vault_file',
+    'SegmentedDmkFile': '._vault_segments',
+    'StreamedVault': '._vault_stream',
+    'MemoryDmkFile': '._vault_memory',
+    'set_text': '._vault_file_ops',
+    'get_text': '._vault_file_ops',
+    'set_file': '._vault_file_ops',
+    'get_file': '._vault_file_ops',
+    'migrate': '._vault_file_ops',
+    'DmkKeyError': '._common',
+    'DmkClient': '._client',
+    'DmkServerError': '._client',
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_IMPORTS))
@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Optional, Dict, Sequence, List, Mapping, Callable, \
+    TypeVar, Any, Tuple
+
+from ._vault_file import DmkFile
+
+T = TypeVar('T')
+
+
+class AsyncDmkFile:
+    """The asyncio interface to `DmkFile`.
+
+    The key derivation and the vault I/O run in the `executor` (the default
+    executor of the loop, if not specified), so they do not block the event
+    loop. Multiple `get_bytes` coroutines run in parallel. If several
+    coroutines ask for the same name at the same time, they all wait for
+    a single lookup.
+
+    Writes are applied one after another. A `get_bytes` started after
+    a write is finished always returns the new value.
+
+    The file stays open until `close` is called.
+    """
+
+    def __init__(self, path: Path, executor: Optional[Executor] = None):
+        self.dmk_file = DmkFile(path, keep_open=True)
+        self._executor = executor
+        self._lookups: Dict[str, asyncio.Future] = dict()
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args)
+
+    async def close(self):
+        await self._run(self.dmk_file.close)
+
+    async def salt(self) -> bytes:
+        # reading the salt may involve opening the file
+        return await self._run(lambda: self.dmk_file.salt)
+
+    async def get_bytes(self, codename: str) -> Optional[bytes]:
+        lookup = self._lookups.get(codename)
+        if lookup is None:
+            lookup = asyncio.ensure_future(
+                self._run(self.dmk_file.get_bytes, codename))
+            self._lookups[codename] = lookup
+            lookup.add_done_callback(
+                lambda f: self._forget_lookup(codename, f))
+        # if one of the waiting coroutines is cancelled, the lookup
+        # continues for the others
+        return await asyncio.shield(lookup)
+
+    def _forget_lookup(self, codename: str, lookup: asyncio.Future):
+        if self._lookups.get(codename) is lookup:
+            del self._lookups[codename]
+
+    async def get_many_bytes(self, codenames: Sequence[str]) \
+            -> List[Optional[bytes]]:
+        return await self._run(self.dmk_file.get_many_bytes, codenames)
+
+    def _lock(self) -> asyncio.Lock:
+        # the lock is created lazily to bind it to the running loop
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    async def set_bytes(self, codename: str, data: bytes):
+        await self.set_many_bytes({codename: data})
+
+    async def set_many_bytes(self, items: Mapping[str, bytes]):
+        async with self._lock():
+            await self._run(self.dmk_file.set_many_bytes, items)
+            # the lookups started before the write may return old values.
+            # New callers should not join them
+            for codename in items:
+                self._lookups.pop(codename, None)
+
+    async def get_bytes_and_version(self, codename: str) \
+            -> Tuple[Optional[bytes], Optional[int]]:
+        return await self._run(self.dmk_file.get_bytes_and_version, codename)
+
+    async def set_if_version(self, codename: str, data: bytes,
+                             expected_data_version: Optional[int]):
+        async with self._lock():
+            try:
+                await self._run(self.dmk_file.set_if_version, codename,
+                                data, expected_data_version)
+            finally:
+                self._lookups.pop(codename, None)
+
+    async def get_text(self, codename: str) -> Optional[str]:
+        data = await self.get_bytes(codename)
+        return data.decode('utf-8') if data is not None else None
+
+    async def set_text(self, codename: str, text: str):
+        await self.set_bytes(codename, text.encode('utf-8'))
+
+    async def add_fakes(self, codename: str, blocks_num: int):
+        async with self._lock():
+            await self._run(self.dmk_file.add_fakes, codename, blocks_num)
@@ -0,0 +1,171 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""The `dmk batch` command: many operations in a single process.
+
+The input is JSON lines, one operation per line:
+
+    {"op": "get", "name": "secRet007"}
+    {"op": "get", "name": "secRet007", "base64": true}
+    {"op": "set", "name": "secRet007", "text": "My darling"}
+    {"op": "set", "name": "secRet007", "data": "TXkgZGFybGluZw=="}
+
+The output is JSON lines, one result per operation, in the same order:
+
+    {"op": "get", "name": "secRet007", "ok": true, "text": "My darling",
+     "ms": {"kdf": 310.2, "read": 4.1, "write": 0.0}}
+
+Operations are not run one by one. Instead:
+
+1) the keys for all the names are derived in parallel
+2) the vault is scanned once for all the gets
+3) the vault is rewritten once for all the sets
+
+A `get` that follows a `set` of the same name returns the value of that set.
+When a name is set several times, the last value is saved. If the sets
+cannot be saved, they fail along with such gets.
+
+The "ms" are the durations of the phases in which the operation took part.
+"""
+
+import json
+import time
+from typing import List, Dict, Any, Optional, Iterable
+
+from ._client import encode_data, decode_data
+from ._vault_file import DmkVersionError
+from ._vault_segments import AnyDmkFile
+from .a_base import derive_keys
+from .a_base._05_codename import CodenameAscii
+
+
+class BatchOp:
+    def __init__(self, line: str):
+        self.request: Dict[str, Any] = dict()
+        self.result: Dict[str, Any] = {'ok': False}
+        self.value: Optional[bytes] = None
+        self.reads_vault = False
+        # the get is answered with the value of a previous set
+        self.reads_set = False
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Operation must be a JSON object")
+            self.request = request
+            self.result['op'] = self.op
+            self.result['name'] = self.name
+
+            if self.op not in ('get', 'set'):
+                raise ValueError(f"Unknown op: {self.op}")
+            if not isinstance(self.name, str):
+                raise ValueError("'name' is missing")
+            CodenameAscii.to_ascii(self.name)
+
+            if self.op == 'set':
+                if isinstance(request.get('text'), str):
+                    self.value = request['text'].encode('utf-8')
+                elif isinstance(request.get('data'), str):
+                    self.value = decode_data(request['data'])
+                else:
+                    raise ValueError("'text' or 'data' is missing")
+        except ValueError as e:
+            self.fail(e)
+
+    @property
+    def op(self) -> Optional[str]:
+        return self.request.get('op')
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.request.get('name')
+
+    @property
+    def valid(self) -> bool:
+        return 'error' not in self.result
+
+    def fail(self, e: Exception):
+        self.result['ok'] = False
+        self.result['error'] = str(e) or type(e).__name__
+
+    def succeed(self, found: Optional[bytes] = None):
+        self.result['ok'] = True
+        if self.op == 'get':
+            self.result['found'] = found is not None
+            if found is not None:
+                if self.request.get('base64'):
+                    self.result['data'] = encode_data(found)
+                else:
+                    try:
+                        self.result['text'] = found.decode('utf-8')
+                    except UnicodeDecodeError as e:
+                        self.fail(e)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def run_batch(dmk_file: AnyDmkFile, lines: Iterable[str]) -> List[dict]:
+    ops = [BatchOp(line) for line in lines if line.strip()]
+    valid = [op for op in ops if op.valid]
+
+    # all the values that will be set, the last one for each name
+    new_values: Dict[str, bytes] = dict()
+    # the gets that can only be answered by reading the vault
+    vault_gets: List[BatchOp] = []
+    for op in valid:
+        assert op.name is not None
+        if op.op == 'set':
+            assert op.value is not None
+            new_values[op.name] = op.value
+        elif op.name in new_values:
+            op.value = new_values[op.name]
+            op.reads_set = True
+        else:
+            op.reads_vault = True
+            vault_gets.append(op)
+
+    phases = {'kdf': 0.0, 'read': 0.0, 'write': 0.0}
+
+    t = time.monotonic()
+    # the derived keys are cached, so DmkFile will get them instantly
+    derive_keys(list(dict.fromkeys(op.name for op in valid
+                                   if op.name is not None)),
+                dmk_file.salt)
+    phases['kdf'] = time.monotonic() - t
+
+    if vault_gets:
+        t = time.monotonic()
+        names = list(dict.fromkeys(op.name for op in vault_gets
+                                   if op.name is not None))
+        found = dict(zip(names, dmk_file.get_many_bytes(names)))
+        for op in vault_gets:
+            assert op.name is not None
+            op.value = found[op.name]
+        phases['read'] = time.monotonic() - t
+
+    write_error: Optional[Exception] = None
+    if new_values:
+        t = time.monotonic()
+        try:
+            dmk_file.set_many_bytes(new_values)
+        except (OSError, ValueError, DmkVersionError) as e:
+            write_error = e
+        phases['write'] = time.monotonic() - t
+
+    for op in valid:
+        if write_error is not None and (op.op == 'set' or op.reads_set):
+            op.fail(write_error)
+        elif op.op == 'set':
+            op.succeed()
+        else:
+            op.succeed(op.value)
+        op.result['ms'] = {
+            'kdf': _ms(phases['kdf']),
+            'read': _ms(phases['read']) if op.reads_vault else 0.0,
+            'write': _ms(phases['write']) if op.op == 'set' else 0.0,
+        }
+
+    return [op.result for op in ops]
@@ -1,20 +1,28 @@
 # SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
 # SPDX-License-Identifier: MIT
+
+# This module is imported each time the `dmk` command runs. It must not
+# import the cryptographic modules or click_shell: they are imported by the
+# commands that need them. Check with
+#
+#     python -X importtime -c "import dmk._cli"
+
 import sys
 import time
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import List, Optional
+from typing import List, Optional, TextIO, TYPE_CHECKING
 
 import click
-from click_shell import shell
 
-from dmk._common import KEY_SALT_SIZE
-from dmk._main import Main
-from dmk.a_base._10_kdf import CodenameKey
-from dmk.a_utils.randoms import get_noncrypt_random_bytes
+from dmk._client import SOCKET_FILE_ENVNAME, DEFAULT_SOCKET_FILE, \
+    default_socket_path
+from dmk.a_utils import spans
 from ._constants import __version__, __copyright__, __build_timestamp__
 
+if TYPE_CHECKING:
+    from dmk._main import Main
+
 # from ._shell import MyApp
 
 VAULT_FILE_ENVNAME = 'DMK_VAULT_FILE'
@@ -36,43 +44,77 @@ VAULT_ARG_LONG = "--vault"
 
 
 class Globals:
-    main: Optional[Main]
+    vault: Optional[Path] = None
+    main: Optional['Main'] = None
 
     @classmethod
-    def the_main(cls) -> Main:
-        # for mypy
+    def the_main(cls) -> 'Main':
         if cls.main is None:
-            raise TypeError
+            if cls.vault is None:
+                raise TypeError
+            from dmk._main import Main
+            cls.main = Main(cls.vault)
         return cls.main
-    # vault_arg: Optional[str] = None
 
+    @classmethod
+    def close(cls):
+        if cls.main is not None:
+            cls.main.close()
+        cls.main = None
 
-# there is no evident way to avoid saving the history of click_shell commands.
-# But we can save the history to temporary file
-_click_shell_history_file = NamedTemporaryFile("r")
 
+def _run_shell(ctx: click.Context):
+    from click_shell import make_click_shell
+    # there is no evident way to avoid saving the history of click_shell
+    # commands. But we can save the history to temporary file
+    with NamedTemporaryFile("r") as history_file:
+        make_click_shell(ctx,
+                         prompt='dmk> ',
+                         intro="Welcome to DMK shell",
+                         hist_file=history_file.name).cmdloop()
 
-@shell(prompt='dmk> ',
-       epilog="See https://github.com/rtmigo/dmk_py#readme",
-       intro=f"Welcome to DMK shell",
 
-       hist_file=_click_shell_history_file.name,
-       on_finished=lambda _: _click_shell_history_file.close())
+@click.group(invoke_without_command=True,
+             epilog="See https://github.com/rtmigo/dmk_py#readme")
 @click.option(VAULT_ARG_SHORT, VAULT_ARG_LONG,
               envvar=VAULT_FILE_ENVNAME,
               default=DEFAULT_STORAGE_FILE,
               type=Path)
+@click.option('--timings', 'timings', flag_value='table', default=None,
+              help=f"Print the time spent in each stage to stderr. "
+                   f"Same as ${spans.TIMINGS_ENVNAME}=table")
+@click.option('--timings-json', 'timings', flag_value='json',
+              help=f"Same as --timings, but prints JSON. "
+                   f"Same as ${spans.TIMINGS_ENVNAME}=json")
 @click.version_option(
     __version__,
     message=f"DMK: Dark Matter Keeper v{__version__}\n(c) {__copyright__} | {__build_timestamp__}")
 @click.pass_context
-def dmk_cli(ctx, vault: Path):
-    Globals.main = Main(vault)  # todo
+def dmk_cli(ctx, vault: Path, timings: Optional[str]):
+    timings = timings or spans.format_from_env()
+    if timings is not None:
+        recorder = spans.enable()
+
+        def print_timings():
+            spans.disable()
+            click.echo(recorder.format(timings), err=True)
+
+        ctx.call_on_close(print_timings)
+
+    # the vault is not opened until a command needs it
+    Globals.close()
+    Globals.vault = vault
+    ctx.call_on_close(Globals.close)
+    if ctx.invoked_subcommand is None:
+        _run_shell(ctx)
 
 
 @click.command(hidden=True)
 def bench():
     """Measures the KDF speed: the private key computation time."""
+    from dmk._common import KEY_SALT_SIZE
+    from dmk.a_base._10_kdf import CodenameKey
+    from dmk.a_utils.randoms import get_noncrypt_random_bytes
     a = []
     random_salt = get_noncrypt_random_bytes(KEY_SALT_SIZE)
     for i in range(4):
@@ -137,6 +179,102 @@ def open_cmd(codename: str):
     Globals.the_main().open(codename)
 
 
+@dmk_cli.command(name='init')
+@click.option('--cluster-size', default='4K', show_default=True,
+              help="Size of each block, from 4K to 1M, a power of two")
+@click.option('--imprint-table', is_flag=True,
+              help="Keep the imprints of all the blocks together. Faster "
+                   "lookups in large vaults that are not in the disk cache")
+@click.option('--keyed-placement', is_flag=True,
+              help="Place the blocks of each entry where it can be found "
+                   "without reading the whole vault")
+@click.option('--segments', default=1, show_default=True,
+              help="Split the vault into this number of files in a "
+                   "directory. Each write rewrites only one of them")
+@click.option('--min-size', default='0', show_default=True,
+              help="The writes add more dummy data while the vault is "
+                   "smaller. 0 means no limit")
+@click.option('--max-size', default='0', show_default=True,
+              help="The writes remove dummy data while the vault is "
+                   "larger. 0 means no limit")
+def init_cmd(cluster_size: str, imprint_table: bool, keyed_placement: bool,
+             segments: int, min_size: str, max_size: str):
+    """Create an empty vault."""
+    Globals.the_main().init(cluster_size, imprint_table, keyed_placement,
+                            segments, min_size, max_size)
+
+
+@dmk_cli.command(name='size-band')
+@click.option('--min', 'min_size', default='0', show_default=True,
+              help="Minimum size of the vault. 0 means no limit")
+@click.option('--max', 'max_size', default='0', show_default=True,
+              help="Maximum size of the vault. 0 means no limit")
+def size_band_cmd(min_size: str, max_size: str):
+    """Set the size the vault should keep.
+
+    The following writes add more dummy data, or less of it, until the
+    vault size is between MIN and MAX. The size is not changed right away.
+    The band is stored unencrypted: anyone with the file can read it."""
+    Globals.the_main().size_band(min_size, max_size)
+
+
+@dmk_cli.command(name='migrate')
+@click.argument('target', type=Path)
+@click.option('--segments', default=1, show_default=True,
+              help="Number of segment files in the new vault. "
+                   "1 means a single file")
+@click.option(CODENAME_SHORT_ARG, CODENAME_LONG_ARG, 'codenames',
+              multiple=True,
+              help="Entry to copy. If not specified, the entries will be "
+                   "prompted for interactive input")
+def migrate_cmd(target: Path, segments: int, codenames: List[str]):
+    """Copy the listed entries to a new vault with other segments."""
+    Globals.the_main().migrate(target, segments,
+                               _codenames_or_prompt(codenames))
+
+
+def _codenames_or_prompt(codenames: List[str]) -> List[str]:
+    codenames = list(codenames)
+    if not codenames:
+        # the vault does not know its names, so we ask until an empty one
+        while True:
+            name = click.prompt(f"{CODENAME_PROMT} (empty to finish)",
+                                default='', show_default=False,
+                                hide_input=True)
+            if not name:
+                break
+            codenames.append(name)
+    return codenames
+
+
+@dmk_cli.command(name='compact')
+@click.argument('size', type=str)
+@click.option(CODENAME_SHORT_ARG, CODENAME_LONG_ARG, 'codenames',
+              multiple=True,
+              help="Entry to keep. If not specified, the entries will be "
+                   "prompted for interactive input")
+def compact_cmd(size: str, codenames: List[str]):
+    """Rebuild the vault of SIZE with only the listed entries.
+
+    All the other entries and the dummy data are removed. The rest of SIZE
+    is filled with new dummy data."""
+    Globals.the_main().compact(size, _codenames_or_prompt(codenames))
+
+
+@dmk_cli.command(name='sync')
+@click.argument('directory', type=Path)
+@click.option('--prefix', default='',
+              help="Prepended to the path of each file to make the name "
+                   "of its entry")
+def sync_cmd(directory: Path, prefix: str):
+    """Write the files of DIRECTORY to the vault, one entry per file.
+
+    The entry of each file is named PREFIX followed by its path relative
+    to DIRECTORY, like 'certs/host.pem'. Only the changed files are
+    written, all at once. The entries of the deleted files are kept."""
+    Globals.the_main().sync(directory, prefix)
+
+
 @dmk_cli.command(name='dummy')
 @click.argument('size', type=str)
 def fake_cmd(size: str):
@@ -164,6 +302,48 @@ def eval(codename: str,
         exit(code)
 
 
+@dmk_cli.command(name='exec')
+@click.option('--env', 'env', multiple=True, metavar='VAR=NAME',
+              help="Set the environment variable VAR to the text of the "
+                   "entry NAME")
+@click.argument('command', nargs=-1, required=True, type=click.UNPROCESSED)
+def exec_cmd(env: List[str], command: List[str]):
+    """Run COMMAND with the entries in its environment.
+
+    All the entries are read at once, then COMMAND replaces this process,
+    without a shell:
+
+        dmk exec --env DB_PASSWORD=db -- myserver --port 8080
+
+    In the interactive dmk shell, COMMAND runs as a child process instead,
+    and the shell waits for it."""
+    Globals.the_main().exec(list(env), list(command),
+                            replace_process=not _is_running_shell())
+
+
+@dmk_cli.command(name='serve')
+@click.option('-s', '--socket', 'socket_file', type=Path, default=None,
+              help=f"Unix socket to listen on. By default it is "
+                   f"${SOCKET_FILE_ENVNAME} or {DEFAULT_SOCKET_FILE}")
+def serve_cmd(socket_file: Optional[Path]):
+    """Serve get/set requests over a Unix socket."""
+    Globals.the_main().serve(socket_file or default_socket_path())
+
+
+@dmk_cli.command(name='batch')
+@click.argument('ops', type=click.File('r'), default='-')
+def batch_cmd(ops: TextIO):
+    """Run JSON-lines operations from stdin, print results to stdout."""
+    Globals.the_main().batch(ops)
+
+
+@dmk_cli.command(name='stats')
+@click.option('--json', 'as_json', is_flag=True, help="Print as JSON")
+def stats_cmd(as_json: bool):
+    """Print the vault size, block count and operation counters."""
+    Globals.the_main().stats(as_json)
+
+
 @dmk_cli.command(name='vault')
 def vault_cmd():
     """Print the location of the vault file."""
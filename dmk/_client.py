@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Client for the `dmk serve` daemon.
+
+The daemon and the client talk over a Unix socket. Each request and each
+response is a single line of JSON:
+
+    {"id": 1, "op": "get", "name": "secRet007"}
+    {"id": 1, "ok": true, "data": "TXkgZGFybGluZw=="}
+
+    {"id": 2, "op": "set", "name": "secRet007", "data": "TXkgZGFybGluZw=="}
+    {"id": 2, "ok": true}
+
+    {"id": 3, "op": "get", "name": "unknown"}
+    {"id": 3, "ok": true, "data": null}
+
+    {"id": 4, "op": "set"}
+    {"id": 4, "ok": false, "error": "'name' is missing"}
+
+    {"id": 5, "op": "stats"}
+    {"id": 5, "ok": true, "stats": {"vault_size": 123456, "blocks": 30, ...}}
+
+The data is base64-encoded. The responses for a connection may come in
+a different order than the requests: the `id` is the only way to match them.
+
+This module does not import the heavy cryptographic modules, so the client
+starts fast.
+"""
+
+import json
+import os
+import socket
+from base64 import b64encode, b64decode
+from pathlib import Path
+from typing import Optional, Dict, Any, BinaryIO
+
+SOCKET_FILE_ENVNAME = 'DMK_SOCKET_FILE'
+DEFAULT_SOCKET_FILE = "~/.dmk.sock"
+
+
+def default_socket_path() -> Path:
+    return Path(os.path.expanduser(
+        os.environ.get(SOCKET_FILE_ENVNAME) or DEFAULT_SOCKET_FILE))
+
+
+def encode_data(data: bytes) -> str:
+    return b64encode(data).decode('ascii')
+
+
+def decode_data(data: str) -> bytes:
+    return b64decode(data.encode('ascii'), validate=True)
+
+
+class DmkServerError(Exception):
+    pass
+
+
+class DmkClient:
+    """Connection to the `dmk serve` daemon.
+
+    The object sends one request at a time and waits for the response, so
+    it must not be shared between threads. Create a client for each thread
+    instead: the daemon handles any number of connections.
+    """
+
+    def __init__(self, socket_path: Optional[Path] = None,
+                 timeout: Optional[float] = None):
+        self.socket_path = socket_path or default_socket_path()
+        self._socket = socket.socket(socket.AF_UNIX,  # type: ignore
+                                     socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(str(self.socket_path))
+        except BaseException:
+            self._socket.close()
+            raise
+        self._stream: BinaryIO = self._socket.makefile('rwb')  # type: ignore
+        self._last_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._stream.close()
+        self._socket.close()
+
+    def _request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        self._last_id += 1
+        request['id'] = self._last_id
+        self._stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._stream.flush()
+
+        line = self._stream.readline()
+        if not line:
+            raise DmkServerError("Connection closed by the server")
+        response = json.loads(line)
+        if response.get('id') != self._last_id:
+            raise DmkServerError(f"Unexpected response id: {response}")
+        if not response.get('ok'):
+            raise DmkServerError(response.get('error'))
+        return response
+
+    def ping(self):
+        self._request({'op': 'ping'})
+
+    def stats(self) -> Dict[str, Any]:
+        """The `DmkFile.stats` of the served vault, along with the number
+        of requests served."""
+        return self._request({'op': 'stats'})['stats']
+
+    def get_bytes(self, codename: str) -> Optional[bytes]:
+        data = self._request({'op': 'get', 'name': codename}).get('data')
+        return decode_data(data) if data is not None else None
+
+    def set_bytes(self, codename: str, data: bytes):
+        self._request({'op': 'set', 'name': codename,
+                       'data': encode_data(data)})
+
+    def get_text(self, codename: str) -> Optional[str]:
+        data = self.get_bytes(codename)
+        return data.decode('utf-8') if data is not None else None
+
+    def set_text(self, codename: str, text: str):
+        self.set_bytes(codename, text.encode('utf-8'))
@@ -16,6 +16,10 @@ KEY_SALT_SIZE = 38
 
 IMPRINT_SIZE = 32
 
+# the nonce and the imprint at the start of each block. To find the blocks
+# of a name, only these bytes are read
+BLOCK_PREFIX_SIZE = 12 + IMPRINT_SIZE
+
 CODENAME_LENGTH_BYTES = 40
 HEADER_SIZE = 15
 
@@ -30,6 +34,25 @@ CLUSTER_META_SIZE = 59
 MAX_CLUSTER_CONTENT_SIZE = CLUSTER_SIZE - CLUSTER_META_SIZE
 assert MAX_CLUSTER_CONTENT_SIZE <= CLUSTER_SIZE
 
+# The cluster size is chosen when the vault is created. `CLUSTER_SIZE` is
+# the default, and the only size supported by the format version 1. Larger
+# clusters mean fewer blocks to scan in vaults with large files
+MIN_CLUSTER_SIZE = CLUSTER_SIZE
+MAX_CLUSTER_SIZE = 1024 * 1024
+
+
+def check_cluster_size(cluster_size: int) -> int:
+    if not (MIN_CLUSTER_SIZE <= cluster_size <= MAX_CLUSTER_SIZE
+            and cluster_size & (cluster_size - 1) == 0):
+        raise ValueError(f"The cluster size must be a power of two from "
+                         f"{MIN_CLUSTER_SIZE} to {MAX_CLUSTER_SIZE}, "
+                         f"not {cluster_size}")
+    return cluster_size
+
+
+def max_cluster_content_size(cluster_size: int) -> int:
+    return cluster_size - CLUSTER_META_SIZE
+
 
 def read_or_fail(f: BinaryIO, n: int) -> bytes:
     result = f.read(n)
@@ -42,6 +65,11 @@ class InsufficientData(Exception):
     pass
 
 
+class DmkKeyError(KeyError):
+    """The entry does not exist."""
+    pass
+
+
 def half_n_half(salt: bytes) -> Tuple[bytes, bytes]:
     """Splits bytes array in two equal parts (if the array length is even),
     or almost equal (if it's odd)"""
@@ -2,19 +2,28 @@
 # SPDX-License-Identifier: MIT
 
 
+import json
 import os
+import socket
 import subprocess
+import sys
 from math import ceil
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import Optional, TextIO, List, Dict, TYPE_CHECKING
 
 import click.exceptions
 
-from dmk._common import CLUSTER_SIZE
-from dmk._vault_file import DmkFile
-from dmk._vault_file_ops import set_text, get_text, set_file, get_file, \
-    DmkKeyError
-from dmk.a_utils.randoms import random_codename_fullsize, random_basename
+# the modules that import the cryptography are imported by the methods
+# that need them, so the CLI starts fast
+
+if TYPE_CHECKING:
+    from dmk._vault_segments import AnyDmkFile
+    from dmk._vault_stream import StreamedVault
+    from dmk._vault_file_ops import ReadableDmkFile
+
+# the vault path that means the standard input
+STDIN_VAULT = '-'
 
 
 def _confirm(txt: str):
@@ -45,10 +54,24 @@ def parse_n_units(txt: str) -> int:
         return num * 1024
     elif suffix == "m":
         return num * 1024 * 1024
+    elif suffix == "g":
+        return num * 1024 * 1024 * 1024
     else:
         raise ValueError(f"Unknown suffix: {suffix}")
 
 
+def _size_to_blocks(size_and_units: str, cluster_size: int) -> int:
+    """The number of blocks for the size of the vault. Zero means no
+    limit."""
+    try:
+        size_bytes = parse_n_units(size_and_units)
+    except ValueError:
+        raise click.exceptions.BadParameter(size_and_units)
+    if size_bytes < 0:
+        raise click.exceptions.BadParameter(size_and_units)
+    return ceil(size_bytes / cluster_size)
+
+
 class Main:
     def __init__(self, storage_file: Path):
 
@@ -57,8 +80,186 @@ class Main:
         str_path = os.path.expandvars(str_path)
 
         self.file_path = Path(str_path)
+        self._dmk_file: Optional['AnyDmkFile'] = None
+        # the vault is read from the standard input, like a pipe
+        self.from_stdin = str_path == STDIN_VAULT
+        self._streamed: Optional['StreamedVault'] = None
+
+    @property
+    def dmk_file(self) -> 'AnyDmkFile':
+        # the same object is used for all the commands of a shell session,
+        # so repeated reads do not rescan the vault
+        if self.from_stdin:
+            raise click.exceptions.ClickException(
+                "The vault from the standard input can only be read "
+                "by the get and exec commands")
+        if self._dmk_file is None:
+            from dmk._vault_segments import open_dmk_file
+            self._dmk_file = open_dmk_file(self.file_path, keep_open=True)
+        return self._dmk_file
+
+    @property
+    def readable_vault(self) -> 'ReadableDmkFile':
+        """Same as `dmk_file`, but also the vault from the standard input,
+        that can be read only once."""
+        if not self.from_stdin:
+            return self.dmk_file
+        if self._streamed is None:
+            from dmk._common import InsufficientData
+            from dmk._vault_stream import StreamedVault
+            try:
+                self._streamed = StreamedVault(sys.stdin.buffer)
+            except (ValueError, InsufficientData) as e:
+                raise click.exceptions.ClickException(
+                    f"Cannot read the vault from the standard input. {e}")
+        return self._streamed
+
+    def close(self):
+        if self._dmk_file is not None:
+            self._dmk_file.close()
+
+    def _new_dmk_file(self, path: Path, segments: int,
+                      cluster_size: int, imprint_table: bool,
+                      keyed_placement: bool, min_blocks: int = 0,
+                      max_blocks: int = 0) -> 'AnyDmkFile':
+        from dmk._vault_file import DmkFile
+        from dmk._vault_segments import SegmentedDmkFile
+
+        if path.exists():
+            raise click.exceptions.ClickException(
+                f"The file {path} already exists")
+        if segments <= 1:
+            return DmkFile(path, cluster_size=cluster_size,
+                           imprint_table=imprint_table,
+                           keyed_placement=keyed_placement,
+                           min_blocks=min_blocks, max_blocks=max_blocks)
+        try:
+            return SegmentedDmkFile(path, segments_num=segments,
+                                    cluster_size=cluster_size,
+                                    imprint_table=imprint_table,
+                                    keyed_placement=keyed_placement,
+                                    min_blocks=min_blocks,
+                                    max_blocks=max_blocks)
+        except ValueError:
+            raise click.exceptions.BadParameter(str(segments))
+
+    def init(self, cluster_size_and_units: str, imprint_table: bool,
+             keyed_placement: bool, segments: int = 1,
+             min_size_and_units: str = '0',
+             max_size_and_units: str = '0'):
+        from dmk._common import check_cluster_size
+
+        try:
+            cluster_size = check_cluster_size(
+                parse_n_units(cluster_size_and_units))
+        except ValueError:
+            raise click.exceptions.BadParameter(cluster_size_and_units)
+
+        try:
+            self._new_dmk_file(
+                self.file_path, segments, cluster_size,
+                imprint_table, keyed_placement,
+                _size_to_blocks(min_size_and_units, cluster_size),
+                _size_to_blocks(max_size_and_units, cluster_size)).create()
+        except ValueError as e:
+            raise click.exceptions.BadParameter(str(e))
+        print(f"Created {self.file_path} with blocks "
+              f"sized {cluster_size:,} B each")
+
+    def size_band(self, min_size_and_units: str, max_size_and_units: str):
+        crd = self.dmk_file
+        cluster_size = crd.cluster_size
+        min_blocks = _size_to_blocks(min_size_and_units, cluster_size)
+        max_blocks = _size_to_blocks(max_size_and_units, cluster_size)
+        try:
+            crd.set_size_band(min_blocks, max_blocks)
+        except ValueError as e:
+            raise click.exceptions.BadParameter(str(e))
+
+        def describe(blocks: int) -> str:
+            return f"{blocks * cluster_size:,} B ({blocks:,} blocks)" \
+                if blocks else "no limit"
+
+        print(f"Minimum size: {describe(min_blocks)}")
+        print(f"Maximum size: {describe(max_blocks)}")
+        print(f"Current size: {crd.stats()['vault_size']:,} B "
+              f"({crd.blobs_len:,} blocks)")
+
+    def migrate(self, target_path: Path, segments: int,
+                codenames: List[str]):
+        from dmk._common import DmkKeyError
+        from dmk._vault_file_ops import migrate
+
+        source = self.dmk_file
+        layout = source.layout
+        target = self._new_dmk_file(target_path, segments, *layout)
+        try:
+            migrate(source, target, codenames)
+        except DmkKeyError:
+            raise ItemNotFoundExit
+        finally:
+            target.close()
+        print(f"Copied {len(codenames)} entries to {target_path}")
+
+    def compact(self, size_and_units: str, codenames: List[str]):
+        from dmk._common import DmkKeyError
+
+        try:
+            size_bytes = parse_n_units(size_and_units)
+        except ValueError:
+            raise click.exceptions.BadParameter(size_and_units)
+
+        crd = self.dmk_file
+        blocks_num = ceil(size_bytes / crd.cluster_size)
+        try:
+            result = crd.compact(codenames, blocks_num)
+        except DmkKeyError:
+            raise ItemNotFoundExit
+        except ValueError as e:
+            raise click.exceptions.BadParameter(f"{size_and_units}: {e}")
+        click.echo(f"Kept {len(set(codenames))} entries")
+        click.echo(f"Size: {result.size_before:,} B -> "
+                   f"{result.size_after:,} B")
+        click.echo(f"Blocks: {result.blocks_before:,} -> "
+                   f"{result.blocks_after:,}")
+        click.echo(f"Scan time (estimated): "
+                   f"{result.scan_seconds_before * 1000:.1f} ms -> "
+                   f"{result.scan_seconds_after * 1000:.1f} ms")
+
+    def sync(self, directory: Path, prefix: str):
+        from dmk._vault_file_ops import sync_dir
+        from dmk.a_utils import spans
+
+        if not directory.is_dir():
+            raise click.exceptions.BadParameter(
+                f"{directory} is not a directory")
+
+        # the phases are reported even without --timings
+        recorder = spans.current_recorder()
+        own_recorder = recorder is None
+        if recorder is None:
+            recorder = spans.enable()
+        start = len(recorder.spans)
+        try:
+            result = sync_dir(self.dmk_file, directory, prefix)
+        finally:
+            if own_recorder:
+                spans.disable()
+
+        # the entry names are secret, so the files are listed by the paths
+        for title, names in [('Added', result.added),
+                             ('Changed', result.changed)]:
+            for name in names:
+                click.echo(f"{title}: {name[len(prefix):]}")
+        click.echo(f"Added {len(result.added)}, "
+                   f"changed {len(result.changed)}, "
+                   f"unchanged {len(result.unchanged)} files")
+        for row in recorder.summary(start):
+            if row['depth'] == 0:
+                click.echo(f"{row['name']:<10} {row['ms']:>10.1f} ms")
 
     def fake(self, size_and_units: str):
+        from dmk.a_utils.randoms import random_codename_fullsize
 
         try:
             size_bytes = parse_n_units(size_and_units)
@@ -68,41 +269,122 @@ class Main:
         if size_bytes <= 0:
             raise click.exceptions.BadParameter(size_and_units)
 
-        crd = DmkFile(self.file_path)
-        blocks_num = ceil(size_bytes / CLUSTER_SIZE)
-        print(f"Adding {blocks_num} block(s) sized {CLUSTER_SIZE:,} B each")
-        print(f"Old file size: {crd.path.stat().st_size:,} B")
+        crd = self.dmk_file
+        cluster_size = crd.cluster_size
+        blocks_num = ceil(size_bytes / cluster_size)
+        print(f"Adding {blocks_num} block(s) sized {cluster_size:,} B each")
+        print(f"Old file size: {crd.stats()['vault_size']:,} B")
         crd.add_fakes(random_codename_fullsize(), blocks_num)
-        print(f"New file size: {crd.path.stat().st_size:,} B")
+        print(f"New file size: {crd.stats()['vault_size']:,} B")
 
     def set_text(self, name: str, value: str):
-        set_text(DmkFile(self.file_path), name, value)
+        from dmk._vault_file_ops import set_text
+        set_text(self.dmk_file, name, value)
 
     def set_file(self, name: str, file: str):
-        set_file(dmk_file=DmkFile(self.file_path),
+        from dmk._vault_file_ops import set_file
+        set_file(dmk_file=self.dmk_file,
                  codename=name,
                  source_file=Path(file))
 
     def get_text(self, name: str):
+        from dmk._common import DmkKeyError
+        from dmk._vault_file_ops import get_text
         try:
             return get_text(
-                dmk_file=DmkFile(self.file_path),
+                dmk_file=self.readable_vault,
                 codename=name)
         except DmkKeyError:
             raise ItemNotFoundExit
 
     def get_file(self, name: str, file: str):
+        from dmk._common import DmkKeyError
+        from dmk._vault_file_ops import get_file
         try:
             get_file(
-                dmk_file=DmkFile(self.file_path),
+                dmk_file=self.readable_vault,
                 codename=name,
                 target_file=Path(file))
         except DmkKeyError:
             raise ItemNotFoundExit
 
+    def exec(self, env: List[str], command: List[str],
+             replace_process: bool = True) -> int:
+        """Runs the `command` with the entries in the environment variables.
+        The `env` items are `VAR=name`.
+
+        With `replace_process`, the command runs in place of this process.
+        Otherwise, it runs as a child process, and its exit code is
+        returned: the interactive shell must keep running."""
+        from dmk._common import DmkKeyError
+        from dmk._vault_file_ops import get_env
+
+        codenames: Dict[str, str] = dict()
+        for item in env:
+            var, sep, name = item.partition('=')
+            if not sep or not var or not name:
+                raise click.exceptions.BadParameter(
+                    f"{item}. Expected VAR=name")
+            codenames[var] = name
+        try:
+            values = get_env(self.readable_vault, codenames)
+        except DmkKeyError:
+            raise ItemNotFoundExit
+        except (UnicodeDecodeError, ValueError) as e:
+            raise click.exceptions.ClickException(str(e))
+        new_env = {**os.environ, **values}
+
+        # no shell: the values are never parsed as commands
+        try:
+            if not replace_process:
+                return subprocess.call(command, env=new_env)
+            self.close()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.execvpe(command[0], command, new_env)
+        except OSError as e:
+            raise click.exceptions.ClickException(
+                f"Cannot run {command[0]}: {e.strerror}")
+        # reached only if the process was not replaced
+        return 0
+
+    def serve(self, socket_file: Path):
+        from dmk._server import run_server
+        if not hasattr(socket, 'AF_UNIX'):
+            raise click.exceptions.ClickException(
+                "Unix sockets are not supported on this platform")
+        click.echo(f"Serving {self.file_path} on {socket_file}", err=True)
+        run_server(self.dmk_file, socket_file)
+
+    def batch(self, ops: TextIO):
+        from dmk._batch import run_batch
+        for result in run_batch(self.dmk_file, ops):
+            click.echo(json.dumps(result))
+
+    def stats(self, as_json: bool):
+        stats = self.dmk_file.stats()
+        if as_json:
+            click.echo(json.dumps(stats))
+            return
+        click.echo(f"Vault: {self.file_path}")
+        click.echo(f"Size: {stats.pop('vault_size'):,} B")
+        click.echo(f"Blocks: {stats.pop('blocks'):,}")
+        click.echo(f"Tail: {stats.pop('tail_size'):,} B")
+        if 'segments' in stats:
+            click.echo(f"Segments: {stats.pop('segments')}")
+        click.echo(f"Cluster: {stats.pop('cluster_size'):,} B")
+        click.echo(f"Imprint table: {stats.pop('imprint_table')}")
+        click.echo(f"Keyed placement: {stats.pop('keyed_placement')}")
+        # the counters of this process: they are non-zero only in the shell
+        for key, value in stats.items():
+            if isinstance(value, float):
+                click.echo(f"{key}: {value:.2f}")
+            else:
+                click.echo(f"{key}: {value:,}")
+
     def eval(self, name: str) -> int:
         # todo test
-        crd = DmkFile(self.file_path)
+        crd = self.dmk_file
         decrypted_bytes = crd.get_bytes(name)
         if decrypted_bytes is None:
             raise ItemNotFoundExit
@@ -111,7 +393,8 @@ class Main:
 
     def open(self, codename: str):
         # todo how to unit test?!..
-        crd = DmkFile(self.file_path)
+        from dmk.a_utils.randoms import random_basename
+        crd = self.dmk_file
         decrypted_bytes = crd.get_bytes(codename)
         if decrypted_bytes is None:
             raise ItemNotFoundExit
@@ -0,0 +1,234 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""The `dmk serve` daemon. See `_client.py` for the protocol."""
+
+import asyncio
+import json
+import os
+import socket
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Tuple, Optional, Dict, Any
+
+from ._client import encode_data, decode_data
+from ._vault_segments import AnyDmkFile
+
+# the longest line we accept. A base64-encoded entry of maximum size
+# is about 1.4 MiB
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+class RequestError(Exception):
+    pass
+
+
+class VaultServer:
+    """Serves `get` and `set` requests for a single vault.
+
+    All the `get` requests that arrive while the previous lookup is running
+    are joined into a single batch: their keys are derived in parallel and
+    the vault is scanned once for all of them.
+
+    The `set` requests are put into a queue and run one after another,
+    because each of them rewrites the vault file.
+    """
+
+    def __init__(self, dmk_file: AnyDmkFile, max_workers: int = 4):
+        self.dmk_file = dmk_file
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending_gets: List[Tuple[str, asyncio.Future]] = []
+        self._gets_task: Optional[asyncio.Future] = None
+        self._writes: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+
+        self.ready = threading.Event()
+        self.get_batches = 0
+        self.requests = 0
+
+    async def get(self, codename: str) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_gets.append((codename, future))
+        if self._gets_task is None or self._gets_task.done():
+            self._gets_task = asyncio.ensure_future(self._run_gets())
+        return await future
+
+    async def _run_gets(self):
+        loop = asyncio.get_running_loop()
+        while self._pending_gets:
+            batch, self._pending_gets = self._pending_gets, []
+            names = [name for name, _ in batch]
+            self.get_batches += 1
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.dmk_file.get_many_bytes, names)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    async def set(self, codename: str, data: bytes):
+        assert self._writes is not None
+        future = asyncio.get_running_loop().create_future()
+        await self._writes.put((codename, data, future))
+        await future
+
+    async def _run_writes(self):
+        assert self._writes is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            codename, data, future = await self._writes.get()
+            try:
+                await loop.run_in_executor(
+                    self._executor, self.dmk_file.set_bytes, codename, data)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(None)
+
+    async def _dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get('op')
+        if op == 'ping':
+            return {}
+        if op == 'stats':
+            stats = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.dmk_file.stats)
+            stats['requests'] = self.requests
+            stats['get_batches'] = self.get_batches
+            return {'stats': stats}
+
+        name = request.get('name')
+        if not isinstance(name, str):
+            raise RequestError("'name' is missing")
+
+        if op == 'get':
+            data = await self.get(name)
+            return {'data': encode_data(data) if data is not None else None}
+        elif op == 'set':
+            encoded = request.get('data')
+            if not isinstance(encoded, str):
+                raise RequestError("'data' is missing")
+            await self.set(name, decode_data(encoded))
+            return {}
+        else:
+            raise RequestError(f"Unknown op: {op}")
+
+    async def _respond(self, line: bytes,
+                       writer: asyncio.StreamWriter,
+                       write_lock: asyncio.Lock):
+        self.requests += 1
+        response: Dict[str, Any]
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("Request must be a JSON object")
+            request_id = request.get('id')
+            response = await self._dispatch(request)
+            response['ok'] = True
+        except (RequestError, ValueError) as e:
+            response = {'ok': False, 'error': str(e)}
+        except Exception as e:
+            response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        response['id'] = request_id
+
+        async with write_lock:
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def _handle_client(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # the requests of the same client are processed concurrently,
+                # so the gets can join the same batch
+                task = asyncio.ensure_future(
+                    self._respond(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, ValueError):
+            # ValueError is raised by `readline` when the line is too long
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: Path):
+        """Serves until `stop` is called."""
+        _remove_stale_socket(socket_path)
+
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._writes = asyncio.Queue()
+        writes_task = asyncio.ensure_future(self._run_writes())
+
+        # only the current user can connect. The socket is created with
+        # these permissions: changing them after the bind would leave a
+        # moment when anyone could connect
+        old_umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(  # type: ignore
+                self._handle_client, path=str(socket_path),
+                limit=MAX_REQUEST_SIZE)
+        finally:
+            os.umask(old_umask)
+        try:
+            os.chmod(socket_path, stat.S_IRUSR | stat.S_IWUSR)
+            self.ready.set()
+            await self._stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            writes_task.cancel()
+            self._executor.shutdown(wait=True)
+            try:
+                socket_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def stop(self):
+        """Can be called from any thread."""
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+
+def _remove_stale_socket(socket_path: Path):
+    if not socket_path.exists():
+        return
+    if not stat.S_ISSOCK(socket_path.stat().st_mode):
+        raise FileExistsError(f"{socket_path} exists and it is not a socket")
+    with socket.socket(socket.AF_UNIX,  # type: ignore
+                       socket.SOCK_STREAM) as s:
+        try:
+            s.connect(str(socket_path))
+        except ConnectionRefusedError:
+            # nobody is listening
+            socket_path.unlink()
+            return
+    raise FileExistsError(f"Another server is listening on {socket_path}")
+
+
+def run_server(dmk_file: AnyDmkFile, socket_path: Path):
+    """Blocks until interrupted."""
+    server = VaultServer(dmk_file)
+    try:
+        asyncio.run(server.serve(socket_path))
+    except KeyboardInterrupt:
+        pass
@@ -2,58 +2,358 @@
 # SPDX-License-Identifier: MIT
 
 
-import io
+import os
+import threading
+from contextlib import contextmanager, ExitStack
 from io import BytesIO
 from pathlib import Path
-from typing import BinaryIO, Optional
+from typing import BinaryIO, Optional, Iterator, Tuple, Sequence, List, \
+    Mapping, Dict, Any, Callable, NamedTuple
 
 from Crypto.Random import get_random_bytes
 
-from ._common import KEY_SALT_SIZE
-from .a_base import CodenameKey
+from ._common import KEY_SALT_SIZE, CLUSTER_SIZE, check_cluster_size, \
+    DmkKeyError
+from ._vault_handle import VaultHandle, OpenedVault, VaultFingerprint, \
+    CachedNameGroup
+from .a_base import CodenameKey, derive_keys
+from .a_utils.counters import Counters, counting, count, counted
 from .a_utils.dirty_file import WritingToTempFile
-from .b_cryptoblobs import decrypt_from_dios
-from .b_storage_file import StorageFileReader, StorageFileWriter, \
-    BlocksIndexedReader
-from .c_namegroups import NameGroup, update_namegroup_b
-from .c_namegroups._update import add_fakes
+from .a_utils.file_lock import locked
+from .a_utils.randoms import random_codename_fullsize
+from .b_cryptoblobs import decrypt_from_dios, DecryptedReader
+from .b_storage_file import StorageFileWriter, BlocksIndexedReader, \
+    BlocksSequentialWriter, Layout, check_size_band
+from .c_namegroups import NameGroup, update_namegroup_b, \
+    update_namegroups_b
+from .c_namegroups._append import COMPACT_RATIO, needs_compaction, \
+    append_namegroups_b, exceeds_max_size
+from .c_namegroups._compact import compact_namegroups_b, \
+    estimate_scan_seconds
+from .c_namegroups._unchanged import same_content
+from .c_namegroups._update import add_fakes, copy_block
+
+
+class DmkVersionError(Exception):
+    """The entry was changed since the version the caller expected."""
+    pass
+
+
+# called with the version of the fresh content found before the write
+VersionCheck = Callable[[Optional[int]], None]
+
+
+def _expect_version(expected: Optional[int]) -> VersionCheck:
+    def check(found: Optional[int]):
+        if found != expected:
+            raise DmkVersionError(
+                f"Expected version {expected}, found {found}")
+
+    return check
+
+
+def _fresh_version(ng: Optional[NameGroup]) -> Optional[int]:
+    return ng.fresh_data_version if ng is not None else None
+
+
+class CompactResult(NamedTuple):
+    """The vault before and after `DmkFile.compact`. The scan times are
+    the estimates for a lookup of a name that is not cached."""
+    size_before: int
+    size_after: int
+    blocks_before: int
+    blocks_after: int
+    scan_seconds_before: float
+    scan_seconds_after: float
+
+
+class SetManyResult(NamedTuple):
+    """The names written by `DmkFile.set_many_bytes`: the ones that had no
+    content, the ones with other content, and the skipped ones."""
+    added: List[str]
+    changed: List[str]
+    unchanged: List[str]
+
+    @classmethod
+    def from_states(cls, names: Sequence[str],
+                    states: Sequence[Optional[bool]]) -> 'SetManyResult':
+        """From the results of `DmkFile._unchanged` for the `names`."""
+        return cls(
+            added=[name for name, st in zip(names, states) if st is None],
+            changed=[name for name, st in zip(names, states) if st is False],
+            unchanged=[name for name, st in zip(names, states) if st])
 
 
 class DmkFile:
-    def __init__(self, path: Path):
+    """The vault file.
+
+    Reading methods (`get_bytes`) can be called concurrently from multiple
+    threads: each call reads the blocks with `os.pread` and does not depend
+    on a shared stream position.
+
+    The object remembers which blocks belong to which names (see
+    `VaultHandle`), so it is worth keeping it for repeated calls. Inside
+    the `with` block, or with `keep_open=True`, the file also stays open
+    between the calls.
+
+    `metrics` accumulates the counters of all the calls:
+
+        lookups         names looked up (by reads and by writes)
+        scans           passes over the whole vault
+        blocks_scanned  blocks checked during these passes
+        blocks_prefetched
+                        blocks of these passes read in the background,
+                        while the keys were derived
+        imprint_hits    blocks found to belong to the names
+        bytes_set       bytes of the new entries contents
+        writes_skipped  entries not written, because they did not change
+        parts_reused    unchanged parts kept by the delta writes
+        bytes_copied    bytes of the old blocks copied to the new file
+        fakes_added     fake blocks added
+        bytes_written   bytes of the new files (or appended)
+        bytes_shredded  bytes of the old files shredded
+        appends         writes that appended to the file
+        compactions     writes that rewrote the file instead of appending
+
+    The `cluster_size`, `imprint_table` and `keyed_placement` are used only
+    if the file does not exist yet. They set the size of each block in the
+    new vault, whether the imprints of the blocks are kept in a separate
+    table (see `BlocksIndexedReader`), and whether the blocks are placed by
+    the keys (see `c_namegroups._placement`). The existing vaults keep
+    their layout. The same applies to the `salt`, which is random by
+    default.
+
+    The `min_blocks` and `max_blocks` set the size band of the new vault
+    (see `SizeBand`): the writes add fewer fakes, or more of them, to keep
+    the number of blocks inside it. Zero means no limit. The band of an
+    existing vault is changed by `set_size_band`.
+
+    With `append_writes=True`, the new content is appended to the file
+    instead of rewriting it (see `c_namegroups._append`), until a name
+    gets `compact_ratio` times more outdated blocks than the new ones.
+    Then the file is rewritten without the outdated blocks of the name.
+    Vaults with the imprint table or the keyed placement are always
+    rewritten.
+
+    With `delta_writes=True`, only the changed parts of the content are
+    encrypted, and the unchanged ones are kept (see `c_namegroups._delta`).
+    Such vaults cannot be read by the versions before 0.8.0. It is ignored
+    in the vaults with the keyed placement.
+
+    Writes of the content that is already fresh in the vault do not change
+    the file at all.
+    """
+
+    def __init__(self, path: Path, keep_open: bool = False,
+                 cluster_size: int = CLUSTER_SIZE,
+                 imprint_table: bool = False,
+                 keyed_placement: bool = False,
+                 salt: Optional[bytes] = None,
+                 append_writes: bool = False,
+                 compact_ratio: float = COMPACT_RATIO,
+                 delta_writes: bool = False,
+                 min_blocks: int = 0,
+                 max_blocks: int = 0):
         self.path = path
+        self.append_writes = append_writes
+        self.delta_writes = delta_writes
+        self.compact_ratio = compact_ratio
+        check_size_band(min_blocks, max_blocks)
+        self._new_layout = Layout(check_cluster_size(cluster_size),
+                                  imprint_table, keyed_placement,
+                                  min_blocks, max_blocks)
+        if salt is not None and len(salt) != KEY_SALT_SIZE:
+            raise ValueError(f"The salt must be {KEY_SALT_SIZE} bytes long")
+        self._new_salt = salt
+        self._handle = VaultHandle(path, keep_open=keep_open)
         self._salt: Optional[bytes] = None
+        self._salt_lock = threading.Lock()
+        self.metrics = Counters()
+
+    def __enter__(self):
+        self._handle.keep_open = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._handle.keep_open = False
+        self._handle.close()
 
     @property
     def salt(self) -> bytes:
-        if self._salt is None:
-            try:
-                with self.path.open('rb') as f:
-                    self._salt = StorageFileReader(f).salt
-            except FileNotFoundError:
-                self._salt = get_random_bytes(KEY_SALT_SIZE)
+        with self._salt_lock:
+            if self._salt is None:
+                with self._handle.opened() as vault:
+                    if vault is not None:
+                        self._salt = vault.reader.salt
+                    elif self._new_salt is not None:
+                        self._salt = self._new_salt
+                    else:
+                        self._salt = get_random_bytes(KEY_SALT_SIZE)
         assert self._salt is not None
         return self._salt
 
-    def _old_blobs(self) -> BlocksIndexedReader:
-        try:
-            storage_reader = StorageFileReader(self.path.open('rb'))
-            assert not storage_reader.blobs.close_stream
-            storage_reader.blobs.close_stream = True
-            return storage_reader.blobs
-        except FileNotFoundError:
-            reader = BlocksIndexedReader(BytesIO())
-            assert len(reader) == 0
-            return reader
+    def _key(self, codename: str) -> CodenameKey:
+        """Derives the key of the name. Meanwhile, the blocks are read in
+        the background (see `VaultHandle.prefetch`), so a cold lookup takes
+        about as long as the longest of the two."""
+        self._handle.prefetch()
+        return CodenameKey(codename, self.salt)
+
+    def _keys(self, codenames: Sequence[str]) -> List[CodenameKey]:
+        """Same as `_key`, for multiple names."""
+        self._handle.prefetch()
+        return derive_keys(codenames, self.salt)
 
     @property
     def blobs_len(self) -> int:
+        with self._handle.opened() as vault:
+            return len(vault.blobs) if vault is not None else 0
+
+    @property
+    def layout(self) -> Layout:
+        with self._handle.opened() as vault:
+            return vault.reader.layout if vault is not None \
+                else self._new_layout
+
+    @property
+    def cluster_size(self) -> int:
+        return self.layout.cluster_size
+
+    def stats(self) -> Dict[str, Any]:
+        """The vault size and structure, along with the `metrics`."""
+        result: Dict[str, Any] = dict()
+        with self._handle.opened() as vault:
+            result['vault_size'] = vault.fingerprint.size \
+                if vault is not None else 0
+            result['blocks'] = len(vault.blobs) if vault is not None else 0
+            result['tail_size'] = vault.blobs.tail_size \
+                if vault is not None else 0
+            result.update((vault.reader.layout if vault is not None
+                           else self._new_layout)._asdict())
+        result.update(metrics_stats(self.metrics))
+        return result
+
+    def _check_not_changed(self, vault: Optional[OpenedVault]):
+        """Raises `DmkVersionError` if the file is not the `vault` anymore:
+        it was changed by another writer."""
         try:
-            with self.path.open('rb') as f:
-                return len(StorageFileReader(f).blobs)
+            current: Optional[VaultFingerprint] = \
+                VaultFingerprint.from_stat(os.stat(self.path))
         except FileNotFoundError:
-            return 0
+            current = None
+        if current != (vault.fingerprint if vault is not None else None):
+            raise DmkVersionError("The vault was changed by another writer")
+
+    @contextmanager
+    def _rewriting(self, exclusive: bool = False,
+                   layout: Optional[Layout] = None) \
+            -> Iterator[Tuple[Optional[OpenedVault],
+                              BlocksIndexedReader,
+                              BlocksSequentialWriter]]:
+        """Yields the old vault (or None), the old blocks and the writer
+        for the new blocks. When the block ends without errors, the new file
+        replaces the old one.
+
+        The writers of the file take turns (see `a_utils.file_lock`), so
+        the old file is not changed by them meanwhile. With
+        `exclusive=True`, the new file is not committed if the old one was
+        changed anyway, by a writer that does not take the lock.
 
+        The new file has the `layout`, if it is set. By default, it is the
+        layout of the old file."""
+        with locked(self.path), WritingToTempFile(self.path) as wtf:
+            with self._handle.opened() as vault:
+                if layout is None:
+                    layout = vault.reader.layout if vault is not None \
+                        else self._new_layout
+                with wtf.dirty.open('wb') as new_file_io, \
+                        StorageFileWriter(new_file_io, self.salt,
+                                          *layout) as writer:
+                    old_blobs = vault.blobs if vault is not None \
+                        else BlocksIndexedReader(
+                            BytesIO(), cluster_size=layout.cluster_size)
+                    yield vault, old_blobs, writer.blobs
+                if exclusive:
+                    self._check_not_changed(vault)
+            # both files are closed now. The old file must also be
+            # closed by the handle, otherwise it cannot be replaced on Windows
+            self._handle.close()
+            wtf.commit()
+
+    def _appended(self, updates: Sequence[Tuple[CodenameKey, BinaryIO]],
+                  check: Optional[VersionCheck] = None) \
+            -> bool:
+        """Appends the new content, if it is enabled and possible.
+        Returns False if the vault must be rewritten instead.
+
+        The `check` is called for each name before writing."""
+        if not self.append_writes:
+            return False
+        # the other writers wait until the new blocks are appended
+        with locked(self.path), self._handle.opened() as vault:
+            if vault is None or vault.reader.layout.imprint_table \
+                    or vault.reader.layout.keyed_placement:
+                return False
+            blobs = vault.blobs
+            name_groups = vault.name_groups([cnk for cnk, _ in updates])
+            if check is not None:
+                for ng in name_groups:
+                    check(ng.fresh_data_version)
+                self._check_not_changed(vault)
+            if exceeds_max_size(len(blobs), [source for _, source in updates],
+                                blobs.cluster_size,
+                                vault.reader.layout.size_band) \
+                    or any(needs_compaction(ng, source, blobs.cluster_size,
+                                            self.compact_ratio)
+                           for ng, (_, source) in zip(name_groups, updates)):
+                count('compactions')
+                return False
+            old_fingerprint = vault.fingerprint
+            with self.path.open('r+b') as f:
+                # the new blocks replace the old tail. If the writing is
+                # interrupted, the incomplete blocks will look like a tail,
+                # and the incomplete content versions will be ignored
+                f.seek(blobs.tail_pos)
+                positions = append_namegroups_b(
+                    updates, name_groups,
+                    BlocksSequentialWriter(
+                        f, blobs.cluster_size,
+                        size_band=vault.reader.layout.size_band),
+                    delta=self.delta_writes,
+                    old_blocks_num=len(blobs))
+                f.truncate()
+                count('bytes_written', f.tell() - blobs.tail_pos)
+            first_new_idx = len(blobs)
+
+        self._handle.appended(
+            old_fingerprint,
+            VaultFingerprint.from_stat(os.stat(self.path)),
+            [cnk for cnk, _ in updates])
+        with self._handle.opened() as vault:
+            if vault is not None:
+                for (cnk, _), ng, new in zip(updates, name_groups, positions):
+                    indices = [item.idx for item in ng.items] \
+                              + [first_new_idx + pos for pos in new]
+                    vault.groups[cnk.as_bytes] = \
+                        CachedNameGroup.from_name_group(
+                            NameGroup(vault.blobs, cnk, indices=indices,
+                                      headers={item.idx: item.dio.header
+                                               for item in ng.items}))
+        count('appends')
+        return True
+
+    def create(self):
+        """Creates a vault without blocks: only the header and the random
+        tail. The file must not exist."""
+        if self.path.exists():
+            raise FileExistsError(self.path)
+        with self._rewriting() as (_, _, new_blobs):
+            new_blobs.write_tail()
+
+    @counted
     def add_fakes(self, codename: str, blocks_num: int):
         """Adds fake blocks.
 
@@ -61,41 +361,271 @@ class DmkFile:
         names or names that will ever be added.
         """
         ck = CodenameKey(codename, self.salt)
-        with WritingToTempFile(self.path) as wtf:
-            with self._old_blobs() as old_blobs, \
-                    wtf.dirty.open('wb') as new_file_io, \
-                    StorageFileWriter(new_file_io, self.salt) as writer:
-                add_fakes(ck,
-                          old_blobs,
-                          writer.blobs,
-                          blocks_num)
-            # both files are closed now
-            wtf.commit()
+        with self._rewriting() as (_, old_blobs, new_blobs):
+            add_fakes(ck,
+                      old_blobs,
+                      new_blobs,
+                      blocks_num)
+
+    @counted
+    def set_size_band(self, min_blocks: int, max_blocks: int):
+        """Sets the size band of the vault (see `SizeBand`). Zero means no
+        limit. The blocks are not changed: the following writes move the
+        number of blocks into the band."""
+        band = check_size_band(min_blocks, max_blocks)
+        if self.layout.size_band == band:
+            return
+        if not self.path.exists():
+            self._new_layout = self._new_layout._replace(
+                min_blocks=min_blocks, max_blocks=max_blocks)
+            return
+        with self._rewriting(
+                exclusive=True,
+                layout=self.layout._replace(
+                    min_blocks=min_blocks, max_blocks=max_blocks)) \
+                as (_, old_blobs, new_blobs):
+            for idx in range(len(old_blobs)):
+                copy_block(old_blobs, idx, new_blobs)
+            new_blobs.write_tail()
+
+    def _unchanged(self, updates: Sequence[Tuple[CodenameKey, BinaryIO]],
+                   check: Optional[VersionCheck] = None) \
+            -> List[Optional[bool]]:
+        """For each of the `updates`, whether the new content is the same
+        as the fresh one, or None if the name has no content. The `check`
+        is called for each name."""
+        with self._handle.opened() as vault:
+            if vault is None:
+                name_groups: List[Optional[NameGroup]] = [None] * len(updates)
+            else:
+                name_groups = list(vault.name_groups(
+                    [cnk for cnk, _ in updates], fresh_only=True))
+            result: List[Optional[bool]] = []
+            for ng, (_, source) in zip(name_groups, updates):
+                if check is not None:
+                    check(_fresh_version(ng))
+                if ng is None or not ng.fresh_content_dios:
+                    result.append(None)
+                else:
+                    result.append(same_content(ng, source))
+        count('writes_skipped', sum(1 for same in result if same))
+        return result
+
+    def _set(self, ck: CodenameKey, source: BinaryIO,
+             check: Optional[VersionCheck] = None):
+        if self._unchanged([(ck, source)], check)[0]:
+            return
+        if self._appended([(ck, source)], check):
+            return
+        with self._rewriting(exclusive=check is not None) \
+                as (vault, old_blobs, new_blobs):
+            name_group = vault.name_group(ck) if vault is not None else None
+            if check is not None:
+                check(_fresh_version(name_group))
+            update_namegroup_b(ck, source, old_blobs, new_blobs,
+                               name_group=name_group,
+                               drop_outdated=self.append_writes,
+                               delta=self.delta_writes)
 
+    def compact(self, codenames: Sequence[str],
+                blocks_num: int) -> CompactResult:
+        """Rewrites the vault with only the fresh content of the
+        `codenames` and `blocks_num` blocks in total (see
+        `c_namegroups._compact`). Everything else is lost.
+
+        Raises `DmkKeyError` without changing the vault if any of the names
+        has no content, and `ValueError` if the `blocks_num` is too small
+        for them."""
+        # the dummy blocks get a random key, derived along with the others
+        keys = self._keys(list(dict.fromkeys(codenames))
+                          + [random_codename_fullsize()])
+        return self._compact(keys[:-1], keys[-1], blocks_num)
+
+    @counted
+    def _has_content(self, keys: Sequence[CodenameKey]) -> bool:
+        """Whether all the names have content."""
+        with self._handle.opened() as vault:
+            return not keys or vault is not None and all(
+                ng.fresh_content_dios
+                for ng in vault.name_groups(keys, fresh_only=True))
+
+    @counted
+    def _compact(self, keys: Sequence[CodenameKey], dummy_key: CodenameKey,
+                 blocks_num: int) -> CompactResult:
+        with self._rewriting() as (vault, old_blobs, new_blobs):
+            if vault is None:
+                raise FileNotFoundError(self.path)
+            size_before = vault.fingerprint.size
+            blocks_before = len(old_blobs)
+            scan_before = estimate_scan_seconds(old_blobs, dummy_key)
+            name_groups = vault.name_groups(keys)
+            if any(not ng.fresh_content_dios for ng in name_groups):
+                raise DmkKeyError
+            compact_namegroups_b(name_groups, dummy_key, old_blobs,
+                                 new_blobs, blocks_num)
+        with self._handle.opened() as vault:
+            assert vault is not None
+            return CompactResult(
+                size_before=size_before,
+                size_after=vault.fingerprint.size,
+                blocks_before=blocks_before,
+                blocks_after=len(vault.blobs),
+                scan_seconds_before=scan_before,
+                scan_seconds_after=estimate_scan_seconds(vault.blobs,
+                                                         dummy_key))
+
+    @counted
     def set_from_io(self, codename: str, source: BinaryIO):
-        ck = CodenameKey(codename, self.salt)
-        with WritingToTempFile(self.path) as wtf:
-            with self._old_blobs() as old_blobs, \
-                    wtf.dirty.open('wb') as new_file_io, \
-                    StorageFileWriter(new_file_io, self.salt) as writer:
-                update_namegroup_b(ck, source, old_blobs, writer.blobs)
-            # both files are closed now
-            wtf.commit()
+        self._set(self._key(codename), source)
+
+    @counted
+    def set_if_version(self, codename: str, data: bytes,
+                       expected_data_version: Optional[int]):
+        """Same as `set_bytes`, but only if the fresh content of the name
+        still has the `expected_data_version` (see `get_bytes_and_version`).
+        With None, the name must have no content yet.
+
+        Otherwise raises `DmkVersionError` and does not change the entry.
+        The writers of the vault take turns (see `a_utils.file_lock`), so
+        the version cannot change between the check and the write. Of the
+        writers expecting the same version, only the first one succeeds,
+        and the others must retry with the new version."""
+        with BytesIO(data) as source:
+            self._set(self._key(codename), source,
+                      _expect_version(expected_data_version))
+
+    @counted
+    def set_many_bytes(self, items: Mapping[str, bytes]) -> SetManyResult:
+        """Same as `set_bytes`, but for multiple names at once.
 
+        The keys are derived in parallel, and the vault is rewritten once.
+        The names with the same content as before are skipped.
+        """
+        if not items:
+            return SetManyResult([], [], [])
+        names = list(items.keys())
+        keys = self._keys(names)
+        sources = [BytesIO(items[name]) for name in names]
+        try:
+            states = self._unchanged(list(zip(keys, sources)))
+            updates = [update for update, same
+                       in zip(zip(keys, sources), states) if not same]
+            if updates and not self._appended(updates):
+                with self._rewriting() as (vault, old_blobs, new_blobs):
+                    name_groups = vault.name_groups(
+                        [cnk for cnk, _ in updates]) \
+                        if vault is not None else None
+                    update_namegroups_b(updates,
+                                        old_blobs, new_blobs,
+                                        name_groups=name_groups,
+                                        drop_outdated=self.append_writes,
+                                        delta=self.delta_writes)
+            return SetManyResult.from_states(names, states)
+        finally:
+            for source in sources:
+                source.close()
+
+    @counted
     def get_bytes(self, codename: str) -> Optional[bytes]:
-        ck = CodenameKey(codename, self.salt)
-        with self._old_blobs() as old_blobs:
-            ng = NameGroup(old_blobs, ck)
+        ck = self._key(codename)
+        with self._handle.opened() as vault:
+            if vault is None:
+                return None
+            return fresh_content(vault.name_group(ck, fresh_only=True))
 
+    @counted
+    def read_range(self, codename: str, offset: int, length: int) \
+            -> Optional[bytes]:
+        """Up to `length` bytes of the content starting from the `offset`,
+        or None if there is no content. Only the parts with these bytes are
+        decrypted."""
+        ck = self._key(codename)
+        with self._handle.opened() as vault:
+            if vault is None:
+                return None
+            ng = vault.name_group(ck, fresh_only=True)
             if not ng.fresh_content_dios:
                 return None
+            return DecryptedReader(ng.fresh_content_dios) \
+                .read_range(offset, length)
+
+    def open_entry(self, codename: str) -> Optional[DecryptedReader]:
+        """The read-only file-like object with the content, or None if
+        there is no content. It reads and decrypts only the requested bytes
+        (see `read_range`).
+
+        The vault file stays open until the object is closed."""
+        ck = self._key(codename)
+        stack = ExitStack()
+        try:
+            with counting(self.metrics):
+                vault = stack.enter_context(self._handle.opened())
+                ng = vault.name_group(ck, fresh_only=True) \
+                    if vault is not None else None
+            if ng is None or not ng.fresh_content_dios:
+                stack.close()
+                return None
+            return DecryptedReader(ng.fresh_content_dios,
+                                   on_close=stack.close)
+        except BaseException:
+            stack.close()
+            raise
+
+    @counted
+    def get_bytes_and_version(self, codename: str) \
+            -> Tuple[Optional[bytes], Optional[int]]:
+        """The content of the name and its version for `set_if_version`,
+        or (None, None) if there is no content."""
+        ck = self._key(codename)
+        with self._handle.opened() as vault:
+            if vault is None:
+                return None, None
+            ng = vault.name_group(ck, fresh_only=True)
+            return fresh_content(ng), ng.fresh_data_version
 
-            with BytesIO() as decrypted:
-                decrypt_from_dios(ng.fresh_content_dios, decrypted)
-                decrypted.seek(0, io.SEEK_SET)
-                return decrypted.read()
+    @counted
+    def get_many_bytes(self, codenames: Sequence[str]) \
+            -> List[Optional[bytes]]:
+        """Same as `get_bytes`, but for multiple names at once.
+
+        The keys are derived in parallel, and all the names are found in
+        a single pass over the vault. The results are in the same order as
+        `codenames`.
+        """
+        keys = self._keys(codenames)
+        with self._handle.opened() as vault:
+            if vault is None:
+                return [None] * len(codenames)
+            return [fresh_content(ng)
+                    for ng in vault.name_groups(keys, fresh_only=True)]
 
     def set_bytes(self, codename: str, data: bytes):
         # todo test
         with BytesIO(data) as bytes_io:
             self.set_from_io(codename, bytes_io)
+
+
+def metrics_stats(metrics: Counters) -> Dict[str, Any]:
+    """The counters along with the ratios computed from them."""
+    result: Dict[str, Any] = metrics.snapshot()
+    lookups = result.get('lookups', 0)
+    if lookups:
+        result['blocks_scanned_per_lookup'] = \
+            result.get('blocks_scanned', 0) / lookups
+        result['imprint_hits_per_lookup'] = \
+            result.get('imprint_hits', 0) / lookups
+    if result.get('bytes_set'):
+        result['write_amplification'] = \
+            result.get('bytes_written', 0) / result['bytes_set']
+    return result
+
+
+def fresh_content(ng: NameGroup) -> Optional[bytes]:
+    if not ng.fresh_content_dios:
+        return None
+
+    ng.will_read_fresh_content()
+    with BytesIO() as decrypted:
+        decrypt_from_dios(ng.fresh_content_dios, decrypted)
+        # unlike `read`, `getvalue` returns the buffer without copying
+        return decrypted.getvalue()
@@ -2,33 +2,43 @@
 # SPDX-License-Identifier: MIT
 
 from io import BytesIO
+from math import ceil
 from pathlib import Path
+from typing import Sequence, Union, Dict, Mapping
 
-from dmk import DmkFile
+from dmk._common import DmkKeyError
+from dmk._vault_file import SetManyResult
+from dmk._vault_segments import AnyDmkFile
+from dmk._vault_stream import StreamedVault
+from dmk.a_utils.randoms import random_codename_fullsize
+from dmk.a_utils.spans import span
 
+# the reading functions also accept the vault read from a stream
+ReadableDmkFile = Union[AnyDmkFile, StreamedVault]
 
-def set_text(dmk_file: DmkFile,
+
+def set_text(dmk_file: AnyDmkFile,
              codename: str,
              source_text: str):
     with BytesIO(source_text.encode('utf-8')) as source_io:
         dmk_file.set_from_io(codename, source_io)
 
 
-def get_text(dmk_file: DmkFile, codename: str) -> str:
+def get_text(dmk_file: ReadableDmkFile, codename: str) -> str:
     decrypted_bytes = dmk_file.get_bytes(codename)
     if decrypted_bytes is None:
         raise DmkKeyError
     return decrypted_bytes.decode('utf-8')
 
 
-def set_file(dmk_file: DmkFile,
+def set_file(dmk_file: AnyDmkFile,
              codename: str,
              source_file: Path):
     with Path(source_file).open('rb') as source_io:
         dmk_file.set_from_io(codename, source_io)
 
 
-def get_file(dmk_file: DmkFile,
+def get_file(dmk_file: ReadableDmkFile,
              codename: str,
              target_file: Path):
     if target_file.exists():
@@ -42,5 +52,72 @@ def get_file(dmk_file: DmkFile,
         target_io.write(decrypted_bytes)
 
 
-class DmkKeyError(KeyError):
-    pass
\ No newline at end of file
+def get_env(dmk_file: ReadableDmkFile,
+            codenames: Mapping[str, str]) -> Dict[str, str]:
+    """The text of the entries by the names of the environment variables.
+    The `codenames` are the entries of the variables.
+
+    All the names are found in a single pass over the vault, with the keys
+    derived in parallel. Raises `DmkKeyError` if any of the entries is not
+    found, and `ValueError` if a text cannot be a variable value."""
+    values = dmk_file.get_many_bytes(list(codenames.values()))
+    result: Dict[str, str] = dict()
+    for var, value in zip(codenames.keys(), values):
+        if value is None:
+            raise DmkKeyError
+        text = value.decode('utf-8')
+        if '\0' in text:
+            raise ValueError(f"The value of {var} contains a null character")
+        result[var] = text
+    return result
+
+
+def migrate(source: AnyDmkFile, target: AnyDmkFile,
+            codenames: Sequence[str]):
+    """Copies the entries from the `source` vault to the new `target`.
+
+    The vault does not know its names, so the entries to copy must be
+    listed. Other blocks of the `source` are not copied, but the `target`
+    gets fake blocks, so it is not smaller. The `source` is not changed.
+
+    Raises `DmkKeyError` before writing anything if any of the entries is
+    not found, and `FileExistsError` if the `target` already exists."""
+    if target.path.exists():
+        raise FileExistsError(target.path)
+    values = source.get_many_bytes(codenames)
+    if any(value is None for value in values):
+        raise DmkKeyError
+    target.create()
+    target.set_many_bytes({name: value
+                           for name, value in zip(codenames, values)
+                           if value is not None})
+    missing_size = (source.blobs_len * source.cluster_size
+                    - target.blobs_len * target.cluster_size)
+    if missing_size > 0:
+        target.add_fakes(random_codename_fullsize(),
+                         ceil(missing_size / target.cluster_size))
+
+
+def dir_entries(directory: Path, prefix: str = '') -> Dict[str, Path]:
+    """The files in the `directory` and its subdirectories by the names of
+    their entries: the `prefix` followed by the relative path, with `/` as
+    the separator."""
+    return {prefix + path.relative_to(directory).as_posix(): path
+            for path in sorted(directory.rglob('*')) if path.is_file()}
+
+
+def sync_dir(dmk_file: AnyDmkFile, directory: Path,
+             prefix: str = '') -> SetManyResult:
+    """Writes the files of the `directory` to the entries named by
+    `dir_entries`.
+
+    The keys are derived in parallel, and all the names are found by one
+    scan. Only the files that differ from their entries are written, all in
+    one rewrite. The entries of the files deleted from the `directory`
+    stay in the vault: it does not know the names to remove."""
+    with span('read') as s:
+        items = {name: path.read_bytes()
+                 for name, path in dir_entries(directory, prefix).items()}
+        s.add('files', len(items))
+        s.add('bytes', sum(len(data) for data in items.values()))
+    return dmk_file.set_many_bytes(items)
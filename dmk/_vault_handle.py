@@ -0,0 +1,337 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Tuple, NamedTuple, Iterator, BinaryIO, \
+    Sequence, List, Callable
+
+from .a_base import CodenameKey
+from .a_utils.counters import count
+from .a_utils.spans import span
+from .b_cryptoblobs._20_encdec_part import Header
+from .b_storage_file import StorageFileReader, BlocksIndexedReader
+from .c_namegroups import NameGroup, scan_name_groups
+from .c_namegroups._placement import probe_name_group
+
+
+class VaultFingerprint(NamedTuple):
+    """Identifies the state of the vault file. When the file is replaced
+    or modified, at least one of the values changes."""
+    inode: int
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def from_stat(cls, st: os.stat_result) -> 'VaultFingerprint':
+        return cls(st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class CachedNameGroup(NamedTuple):
+    """What we learned about a codename by scanning the whole file.
+
+    Only the block indices and the headers are kept. The decrypted data
+    is never cached.
+    """
+    headers: Tuple[Tuple[int, Header], ...]
+    fresh_indices: Tuple[int, ...]
+
+    @classmethod
+    def from_name_group(cls, ng: NameGroup) -> 'CachedNameGroup':
+        return cls(
+            headers=tuple((item.idx, item.dio.header) for item in ng.items),
+            fresh_indices=tuple(item.idx for item in ng.items
+                                if item.is_fresh_data))
+
+    @property
+    def indices(self) -> Tuple[int, ...]:
+        return tuple(idx for idx, _ in self.headers)
+
+
+def find_name_groups(reader: StorageFileReader,
+                     groups: Dict[bytes, CachedNameGroup],
+                     cnks: Sequence[CodenameKey],
+                     fresh_only: bool = False,
+                     prefetched: Callable[[], List[bytes]] = list) \
+        -> List[NameGroup]:
+    """The `NameGroup` for each of the `cnks`, in the same order.
+
+    The names cached in `groups` are read only from their known blocks. All
+    the other names are found in a single pass over the file, and added to
+    the `groups`. With `fresh_only=True` the groups will contain only the
+    blocks with the fresh data.
+
+    With the keyed placement and `fresh_only=True`, the names are probed
+    first (see `probe_name_group`), and only the rest are scanned.
+    The probed groups are not cached: they may lack some blocks.
+
+    The `prefetched` is called before the scan. It returns the prefixes of
+    the first blocks, if they were already read (see `PrefixPrefetch`)."""
+    blobs = reader.blobs
+    unknown = list({cnk.as_bytes: cnk for cnk in cnks
+                    if cnk.as_bytes not in groups}.values())
+    count('lookups', len(cnks))
+    found: Dict[bytes, NameGroup] = dict()
+    if fresh_only and reader.layout.keyed_placement:
+        for cnk in unknown:
+            ng_probed = probe_name_group(blobs, cnk)
+            if ng_probed is not None:
+                found[cnk.as_bytes] = ng_probed
+        unknown = [cnk for cnk in unknown if cnk.as_bytes not in found]
+    prefixes: List[bytes] = []
+    if unknown:
+        count('scans')
+        prefixes = prefetched()
+    for ng in scan_name_groups(blobs, unknown, prefixes):
+        groups[ng.cnk.as_bytes] = CachedNameGroup.from_name_group(ng)
+        found[ng.cnk.as_bytes] = ng
+
+    result: List[NameGroup] = []
+    for cnk in cnks:
+        ng_opt = found.get(cnk.as_bytes)
+        if ng_opt is None:
+            cached = groups[cnk.as_bytes]
+            indices = cached.fresh_indices if fresh_only else cached.indices
+            ng_opt = NameGroup(blobs, cnk, indices=indices,
+                               headers=dict(cached.headers))
+        result.append(ng_opt)
+    return result
+
+
+# the nonces and imprints kept in memory by a prefetch (44 bytes each).
+# The rest of the blocks are only read into the disk cache
+PREFETCH_MAX_PREFIXES = 65536
+
+
+class PrefixPrefetch:
+    """Reads the nonces and imprints of the blocks in a background thread,
+    while the keys are derived. Both take a while on a cold start, and the
+    scan needs both.
+
+    The vaults with the keyed placement are not read: their lookups probe
+    only a few blocks."""
+
+    def __init__(self, path: Path, fingerprint: VaultFingerprint):
+        self.fingerprint = fingerprint
+        self._prefixes: List[bytes] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, args=(path,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _read(self, path: Path):
+        try:
+            with path.open('rb') as file:
+                if VaultFingerprint.from_stat(os.fstat(file.fileno())) \
+                        != self.fingerprint:
+                    return
+                reader = StorageFileReader(file)
+                if reader.layout.keyed_placement:
+                    return
+                for prefix in reader.blobs.prefixes():
+                    if self._stop.is_set():
+                        return
+                    if len(self._prefixes) < PREFETCH_MAX_PREFIXES:
+                        self._prefixes.append(prefix)
+        except (OSError, ValueError):
+            # the scan will read the blocks itself
+            pass
+
+    def take(self) -> List[bytes]:
+        """Stops the reading and returns the prefixes of the first blocks
+        read so far."""
+        self.stop()
+        return self._prefixes
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class OpenedVault:
+    """The vault file opened for positional reading, along with the scan
+    results that are valid for this particular state of the file."""
+
+    def __init__(self, file: BinaryIO,
+                 groups: Dict[bytes, CachedNameGroup],
+                 take_prefetch: Optional[Callable[
+                     [VaultFingerprint], Optional[PrefixPrefetch]]] = None):
+        self.file = file
+        self.reader = StorageFileReader(file, positional=True)
+        self.fingerprint = VaultFingerprint.from_stat(os.fstat(file.fileno()))
+        self.groups = groups
+        # returns the prefetch started for this state of the file, if any
+        self._take_prefetch = take_prefetch
+        self.users = 0
+        self.retired = False
+
+    @property
+    def blobs(self) -> BlocksIndexedReader:
+        return self.reader.blobs
+
+    def name_group(self, cnk: CodenameKey,
+                   fresh_only: bool = False) -> NameGroup:
+        """Returns the `NameGroup` for the `cnk`.
+
+        The whole file is scanned only the first time. After that, only the
+        blocks known to belong to the name are read. With `fresh_only=True`
+        the group will contain only the blocks with the fresh data.
+        """
+        return self.name_groups([cnk], fresh_only=fresh_only)[0]
+
+    def name_groups(self, cnks: Sequence[CodenameKey],
+                    fresh_only: bool = False) -> List[NameGroup]:
+        """Same as `name_group`, but for multiple keys (see
+        `find_name_groups`)."""
+        return find_name_groups(self.reader, self.groups, cnks,
+                                fresh_only=fresh_only,
+                                prefetched=self._prefetched)
+
+    def _prefetched(self) -> List[bytes]:
+        prefetch = self._take_prefetch(self.fingerprint) \
+            if self._take_prefetch is not None else None
+        if prefetch is None:
+            return []
+        prefixes = prefetch.take()
+        count('blocks_prefetched', len(prefixes))
+        return prefixes
+
+    def close(self):
+        self.file.close()
+
+
+class VaultHandle:
+    """Long-lived access to the vault file.
+
+    The handle remembers the blocks found for each codename. As long as the
+    file fingerprint (inode, size, mtime) stays the same, repeated lookups
+    read only the blocks of the name instead of scanning the whole file.
+
+    If `keep_open` is True, the file stays open between the calls. Otherwise,
+    it is closed as soon as nobody uses it, but the scan results are kept
+    anyway.
+
+    The handle can be used from multiple threads.
+    """
+
+    def __init__(self, path: Path, keep_open: bool = False):
+        self.path = path
+        self.keep_open = keep_open
+        self._lock = threading.Lock()
+        self._current: Optional[OpenedVault] = None
+        self._groups: Dict[bytes, CachedNameGroup] = dict()
+        self._groups_fingerprint: Optional[VaultFingerprint] = None
+        self._prefetch: Optional[PrefixPrefetch] = None
+
+    def prefetch(self):
+        """Starts reading the blocks in the background (see
+        `PrefixPrefetch`), if the next lookup is likely to scan the file:
+        nothing is known about its current state yet."""
+        with self._lock:
+            try:
+                fingerprint = VaultFingerprint.from_stat(os.stat(self.path))
+            except FileNotFoundError:
+                return
+            if self._groups_fingerprint == fingerprint and self._groups:
+                return
+            if self._prefetch is not None:
+                if self._prefetch.fingerprint == fingerprint:
+                    return
+                self._prefetch.stop()
+            self._prefetch = PrefixPrefetch(self.path, fingerprint)
+
+    def _take_prefetch(self, fingerprint: VaultFingerprint) \
+            -> Optional[PrefixPrefetch]:
+        with self._lock:
+            prefetch = self._prefetch
+            if prefetch is None or prefetch.fingerprint != fingerprint:
+                return None
+            self._prefetch = None
+            return prefetch
+
+    @contextmanager
+    def opened(self) -> Iterator[Optional[OpenedVault]]:
+        """Yields the opened vault, or None if the file does not exist."""
+        vault = self._acquire()
+        try:
+            yield vault
+        finally:
+            if vault is not None:
+                self._release(vault)
+
+    def _acquire(self) -> Optional[OpenedVault]:
+        with self._lock:
+            try:
+                fingerprint = VaultFingerprint.from_stat(os.stat(self.path))
+            except FileNotFoundError:
+                self._retire_current()
+                return None
+
+            if self._current is None \
+                    or self._current.fingerprint != fingerprint:
+                self._retire_current()
+                with span('open'):
+                    try:
+                        file = self.path.open('rb')
+                    except FileNotFoundError:
+                        return None
+                    try:
+                        vault = OpenedVault(file, dict(),
+                                            self._take_prefetch)
+                    except BaseException:
+                        file.close()
+                        raise
+                if vault.fingerprint != self._groups_fingerprint:
+                    self._groups = dict()
+                    self._groups_fingerprint = vault.fingerprint
+                vault.groups = self._groups
+                self._current = vault
+
+            self._current.users += 1
+            return self._current
+
+    def appended(self, old: VaultFingerprint, new: VaultFingerprint,
+                 cnks: Sequence[CodenameKey]):
+        """The file was changed from the `old` state to the `new` one only
+        by appending the blocks of the `cnks`. The old blocks did not move,
+        so the cached groups of the other names stay valid."""
+        with self._lock:
+            if self._groups_fingerprint == old:
+                self._groups_fingerprint = new
+                for cnk in cnks:
+                    self._groups.pop(cnk.as_bytes, None)
+
+    def _release(self, vault: OpenedVault):
+        with self._lock:
+            vault.users -= 1
+            assert vault.users >= 0
+            if vault.users == 0:
+                if vault.retired:
+                    vault.close()
+                elif not self.keep_open:
+                    vault.retired = True
+                    vault.close()
+                    if self._current is vault:
+                        self._current = None
+
+    def _retire_current(self):
+        # the file will be closed as soon as the last user releases it
+        current = self._current
+        if current is None:
+            return
+        self._current = None
+        current.retired = True
+        if current.users == 0:
+            current.close()
+
+    def close(self):
+        """Closes the file. The file will be reopened on the next access."""
+        with self._lock:
+            self._retire_current()
+            # the prefetch has the file open too
+            if self._prefetch is not None:
+                self._prefetch.stop()
+                self._prefetch = None
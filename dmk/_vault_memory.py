@@ -0,0 +1,201 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+from typing import BinaryIO, Optional, Iterator, Tuple, Sequence, List, \
+    Mapping, Dict, Any
+
+from Crypto.Random import get_random_bytes
+
+from ._common import KEY_SALT_SIZE, CLUSTER_SIZE, check_cluster_size
+from ._vault_file import fresh_content, metrics_stats, SetManyResult
+from ._vault_handle import CachedNameGroup, find_name_groups
+from .a_base import CodenameKey, derive_keys
+from .a_utils.counters import Counters, count, counted
+from .b_storage_file import StorageFileReader, StorageFileWriter, \
+    BlocksIndexedReader, BlocksSequentialWriter, Layout, check_size_band
+from .c_namegroups import NameGroup, update_namegroups_b
+from .c_namegroups._unchanged import same_content
+from .c_namegroups._update import add_fakes
+
+
+class MemoryDmkFile:
+    """The vault kept in memory as `bytes`, for the applications that store
+    it themselves, like in a database row:
+
+        vault = MemoryDmkFile(row.vault)
+        vault.set_bytes("secret name", b"value")
+        row.vault = vault.data
+
+    The blocks are the same as in `DmkFile`, but nothing is written to the
+    disk: the writes build the new vault in a buffer, and there is no temp
+    file to shred. The vault bytes are never modified in place, so the old
+    `data` stays valid after a write.
+
+    The `cluster_size`, `imprint_table`, `keyed_placement`, `salt`,
+    `min_blocks`, `max_blocks` and `delta_writes` are the same as for
+    `DmkFile`. There are no append writes: a buffer is rewritten anyway.
+
+    The calls are serialized by a lock. The blocks found for each name are
+    remembered until the next write.
+    """
+
+    def __init__(self, data: Optional[bytes] = None,
+                 cluster_size: int = CLUSTER_SIZE,
+                 imprint_table: bool = False,
+                 keyed_placement: bool = False,
+                 salt: Optional[bytes] = None,
+                 delta_writes: bool = False,
+                 min_blocks: int = 0,
+                 max_blocks: int = 0):
+        self.delta_writes = delta_writes
+        check_size_band(min_blocks, max_blocks)
+        self._new_layout = Layout(check_cluster_size(cluster_size),
+                                  imprint_table, keyed_placement,
+                                  min_blocks, max_blocks)
+        if salt is not None and len(salt) != KEY_SALT_SIZE:
+            raise ValueError(f"The salt must be {KEY_SALT_SIZE} bytes long")
+        self._data: Optional[bytes] = None
+        self._reader: Optional[StorageFileReader] = None
+        self._groups: Dict[bytes, CachedNameGroup] = dict()
+        self._replace(data or None)
+        self._salt = self._reader.salt if self._reader is not None \
+            else salt if salt is not None \
+            else get_random_bytes(KEY_SALT_SIZE)
+        self._lock = threading.RLock()
+        self.metrics = Counters()
+
+    def _replace(self, data: Optional[bytes]):
+        self._data = data
+        # `BytesIO` shares the buffer of the `bytes` until it is written
+        self._reader = StorageFileReader(BytesIO(data)) \
+            if data is not None else None
+        self._groups = dict()
+
+    @property
+    def data(self) -> Optional[bytes]:
+        """The vault, or None if nothing was written yet."""
+        return self._data
+
+    @property
+    def salt(self) -> bytes:
+        return self._salt
+
+    @property
+    def layout(self) -> Layout:
+        return self._reader.layout if self._reader is not None \
+            else self._new_layout
+
+    @property
+    def cluster_size(self) -> int:
+        return self.layout.cluster_size
+
+    @property
+    def blobs_len(self) -> int:
+        return len(self._reader.blobs) if self._reader is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        """The vault size and structure, along with the `metrics`."""
+        with self._lock:
+            result: Dict[str, Any] = dict()
+            result['vault_size'] = len(self._data) \
+                if self._data is not None else 0
+            result['blocks'] = self.blobs_len
+            result['tail_size'] = self._reader.blobs.tail_size \
+                if self._reader is not None else 0
+            result.update(self.layout._asdict())
+        result.update(metrics_stats(self.metrics))
+        return result
+
+    def _name_groups(self, cnks: Sequence[CodenameKey],
+                     fresh_only: bool = False) -> List[NameGroup]:
+        assert self._reader is not None
+        return find_name_groups(self._reader, self._groups, cnks,
+                                fresh_only=fresh_only)
+
+    @contextmanager
+    def _rewriting(self) -> Iterator[Tuple[BlocksIndexedReader,
+                                           BlocksSequentialWriter]]:
+        """Yields the old blocks and the writer for the new blocks. When the
+        block ends without errors, the new vault replaces the old one."""
+        old_blobs = self._reader.blobs if self._reader is not None \
+            else BlocksIndexedReader(BytesIO(),
+                                     cluster_size=self.cluster_size)
+        with BytesIO() as new_io:
+            with StorageFileWriter(new_io, self.salt,
+                                   *self.layout) as writer:
+                yield old_blobs, writer.blobs
+            count('bytes_written', new_io.tell())
+            self._replace(new_io.getvalue())
+
+    @counted
+    def add_fakes(self, codename: str, blocks_num: int):
+        """Same as `DmkFile.add_fakes`."""
+        ck = CodenameKey(codename, self.salt)
+        with self._lock, self._rewriting() as (old_blobs, new_blobs):
+            add_fakes(ck, old_blobs, new_blobs, blocks_num)
+
+    def _set_many(self, updates: Sequence[Tuple[CodenameKey, BinaryIO]]) \
+            -> List[Optional[bool]]:
+        """Same as `DmkFile._unchanged`, but also writes the changed
+        content."""
+        with self._lock:
+            if self._reader is None:
+                states: List[Optional[bool]] = [None] * len(updates)
+                name_groups: Optional[List[NameGroup]] = None
+            else:
+                found = self._name_groups([cnk for cnk, _ in updates])
+                states = [same_content(ng, source)
+                          if ng.fresh_content_dios else None
+                          for ng, (_, source) in zip(found, updates)]
+                count('writes_skipped', sum(1 for same in states if same))
+                name_groups = [ng for ng, same in zip(found, states)
+                               if not same]
+            changed = [update for update, same in zip(updates, states)
+                       if not same]
+            if changed:
+                with self._rewriting() as (old_blobs, new_blobs):
+                    update_namegroups_b(changed, old_blobs, new_blobs,
+                                        name_groups=name_groups,
+                                        delta=self.delta_writes)
+            return states
+
+    @counted
+    def set_from_io(self, codename: str, source: BinaryIO):
+        self._set_many([(CodenameKey(codename, self.salt), source)])
+
+    def set_bytes(self, codename: str, data: bytes):
+        with BytesIO(data) as source:
+            self.set_from_io(codename, source)
+
+    @counted
+    def set_many_bytes(self, items: Mapping[str, bytes]) -> SetManyResult:
+        """Same as `DmkFile.set_many_bytes`."""
+        if not items:
+            return SetManyResult([], [], [])
+        names = list(items.keys())
+        sources = [BytesIO(items[name]) for name in names]
+        try:
+            return SetManyResult.from_states(
+                names, self._set_many(list(zip(derive_keys(names, self.salt),
+                                               sources))))
+        finally:
+            for source in sources:
+                source.close()
+
+    def get_bytes(self, codename: str) -> Optional[bytes]:
+        return self.get_many_bytes([codename])[0]
+
+    @counted
+    def get_many_bytes(self, codenames: Sequence[str]) \
+            -> List[Optional[bytes]]:
+        """Same as `DmkFile.get_many_bytes`."""
+        keys = derive_keys(codenames, self.salt)
+        with self._lock:
+            if self._reader is None:
+                return [None] * len(codenames)
+            return [fresh_content(ng)
+                    for ng in self._name_groups(keys, fresh_only=True)]
@@ -0,0 +1,387 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""The vault split into segment files.
+
+A segmented vault is a directory with N ordinary vault files named `000`,
+`001` and so on. All of them share the same salt, so a name has the same
+key in each of them. The blocks of a name live in a single segment chosen
+by the key. Writing a name rewrites only its segment, so the write cost
+depends on the segment size, not on the size of the whole vault.
+
+The names and fakes are spread evenly, so the segments grow at about the
+same rate. But an observer of the directory learns which segment each
+write changed: the writes of the same name always change the same file.
+"""
+
+import functools
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from math import ceil
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Sequence, Mapping, BinaryIO, \
+    Union, Callable, TypeVar, Tuple
+
+from Crypto.Random import get_random_bytes
+
+from ._common import KEY_SALT_SIZE, CLUSTER_SIZE, DmkKeyError
+from ._vault_file import DmkFile, metrics_stats, CompactResult, \
+    SetManyResult
+from .a_base import CodenameKey, derive_keys
+from .a_utils.counters import Counters
+from .a_utils.randoms import random_codename_fullsize
+from .b_cryptoblobs import DecryptedReader
+from .b_cryptoblobs._20_encdec_part import blake2s
+from .b_storage_file import Layout, check_size_band
+
+DEFAULT_SEGMENTS = 16
+MIN_SEGMENTS = 2
+MAX_SEGMENTS = 256
+
+# the segments written at the same time. Each of them takes a thread, the
+# file I/O, and the memory of the key derivation
+MAX_PARALLEL_SEGMENTS = 8
+
+_SEGMENT_NAME_RE = re.compile(r'^\d{3}$')
+
+T = TypeVar('T')
+
+
+def check_segments_num(segments_num: int) -> int:
+    if not (MIN_SEGMENTS <= segments_num <= MAX_SEGMENTS):
+        raise ValueError(f"The number of segments must be from "
+                         f"{MIN_SEGMENTS} to {MAX_SEGMENTS}, "
+                         f"not {segments_num}")
+    return segments_num
+
+
+def segment_name(idx: int) -> str:
+    return f"{idx:03d}"
+
+
+def segment_index(cnk: CodenameKey, segments_num: int) -> int:
+    """The segment that keeps the blocks of the name."""
+    digest = blake2s(cnk.as_bytes + b'segment', 8)
+    return int.from_bytes(digest, 'big') % segments_num
+
+
+def existing_segments_num(path: Path) -> int:
+    """The number of segments in the directory, or 0 if there are none.
+    The other files (like the temporary ones left by an interrupted write)
+    are ignored."""
+    if not path.is_dir():
+        return 0
+    names = sorted(p.name for p in path.iterdir()
+                   if _SEGMENT_NAME_RE.match(p.name))
+    if names != [segment_name(i) for i in range(len(names))]:
+        raise ValueError(f"{path} does not contain a valid sequence "
+                         f"of segments")
+    return len(names)
+
+
+class SegmentedDmkFile:
+    """The vault directory with segment files. Has the same methods as
+    `DmkFile`, and each of them works with `DmkFile` objects of the
+    segments.
+
+    Writes of multiple names (`set_many_bytes`) are applied to each
+    segment separately: if one of them fails, the other segments may
+    already be updated.
+
+    The `segments_num` and the layout arguments are used only if the
+    directory does not contain segments yet. The segments are created on
+    the first write, all at once. The `append_writes` and `delta_writes`
+    are passed to the segments.
+
+    The size band (`min_blocks` and `max_blocks`) is for the whole vault:
+    each segment gets its share of it.
+    """
+
+    def __init__(self, path: Path, keep_open: bool = False,
+                 segments_num: int = DEFAULT_SEGMENTS,
+                 cluster_size: int = CLUSTER_SIZE,
+                 imprint_table: bool = False,
+                 keyed_placement: bool = False,
+                 append_writes: bool = False,
+                 delta_writes: bool = False,
+                 min_blocks: int = 0,
+                 max_blocks: int = 0):
+        self.path = path
+        self._append_writes = append_writes
+        self._delta_writes = delta_writes
+        existing = existing_segments_num(path)
+        self._new_salt: Optional[bytes] = None
+        if not existing:
+            existing = check_segments_num(segments_num)
+            self._new_salt = get_random_bytes(KEY_SALT_SIZE)
+        check_size_band(min_blocks, max_blocks)
+        self._new_layout = Layout(
+            cluster_size, imprint_table, keyed_placement,
+            ceil(min_blocks / existing), ceil(max_blocks / existing))
+        self.metrics = Counters()
+        self.segments: List[DmkFile] = [
+            self._segment_file(path, idx, keep_open)
+            for idx in range(existing)]
+        # the calls to any of the segments are counted together
+        for segment in self.segments:
+            segment.metrics = self.metrics
+        self._create_lock = threading.Lock()
+
+    def _segment_file(self, directory: Path, idx: int,
+                      keep_open: bool = False) -> DmkFile:
+        return DmkFile(directory / segment_name(idx), keep_open=keep_open,
+                       cluster_size=self._new_layout.cluster_size,
+                       imprint_table=self._new_layout.imprint_table,
+                       keyed_placement=self._new_layout.keyed_placement,
+                       min_blocks=self._new_layout.min_blocks,
+                       max_blocks=self._new_layout.max_blocks,
+                       salt=self._new_salt,
+                       append_writes=self._append_writes,
+                       delta_writes=self._delta_writes)
+
+    def __enter__(self):
+        for segment in self.segments:
+            segment.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    @property
+    def salt(self) -> bytes:
+        return self.segments[0].salt
+
+    @property
+    def blobs_len(self) -> int:
+        return sum(segment.blobs_len for segment in self.segments)
+
+    @property
+    def layout(self) -> Layout:
+        """The layout of the segments, with the size band of the whole
+        vault."""
+        layout = self.segments[0].layout
+        return layout._replace(
+            min_blocks=layout.min_blocks * len(self.segments),
+            max_blocks=layout.max_blocks * len(self.segments))
+
+    @property
+    def cluster_size(self) -> int:
+        return self.layout.cluster_size
+
+    def stats(self) -> Dict[str, Any]:
+        """Same as `DmkFile.stats`, summed over the segments."""
+        result: Dict[str, Any] = {'vault_size': 0, 'blocks': 0,
+                                  'tail_size': 0}
+        for segment in self.segments:
+            segment_stats = segment.stats()
+            for key in result:
+                result[key] += segment_stats[key]
+        result['segments'] = len(self.segments)
+        result.update(self.layout._asdict())
+        result.update(metrics_stats(self.metrics))
+        return result
+
+    def create(self):
+        """Creates the segments without blocks. The directory must not
+        contain segments."""
+        if existing_segments_num(self.path):
+            raise FileExistsError(self.path)
+        self._create_segments()
+
+    def _create_segments(self):
+        # the segments are created in a temporary directory, that is
+        # renamed when all of them are ready. So an interrupted creation
+        # does not leave a directory with some of the segments
+        with self._create_lock:
+            if existing_segments_num(self.path):
+                return
+            dirty = self.path.parent / (self.path.name + ".tmp")
+            if dirty.exists():
+                shutil.rmtree(dirty)
+            dirty.mkdir()
+            for idx in range(len(self.segments)):
+                self._segment_file(dirty, idx).create()
+            if self.path.exists():
+                self.path.rmdir()  # empty, otherwise it had segments
+            os.replace(dirty, self.path)
+
+    def _created(self) -> List[DmkFile]:
+        if self._new_salt is not None \
+                and not self.segments[0].path.exists():
+            self._create_segments()
+        return self.segments
+
+    def _segment_of(self, cnk: CodenameKey) -> int:
+        return segment_index(cnk, len(self.segments))
+
+    def _by_segment(self, keys: Sequence[CodenameKey]) \
+            -> Dict[int, List[int]]:
+        """The positions of the `keys` grouped by their segments."""
+        result: Dict[int, List[int]] = dict()
+        for pos, cnk in enumerate(keys):
+            result.setdefault(self._segment_of(cnk), []).append(pos)
+        return result
+
+    def _in_parallel(self, calls: List[Callable[[], T]]) -> List[T]:
+        max_workers = min(len(calls), os.cpu_count() or 4,
+                          MAX_PARALLEL_SEGMENTS)
+        if max_workers <= 1:
+            return [call() for call in calls]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(call) for call in calls]
+            return [future.result() for future in futures]
+
+    def add_fakes(self, codename: str, blocks_num: int):
+        """Same as `DmkFile.add_fakes`. The blocks are spread evenly over
+        the segments."""
+        segments = self._created()
+        per_segment, remainder = divmod(blocks_num, len(segments))
+        for idx, segment in enumerate(segments):
+            num = per_segment + (1 if idx < remainder else 0)
+            if num > 0:
+                segment.add_fakes(codename, num)
+
+    def set_size_band(self, min_blocks: int, max_blocks: int):
+        """Same as `DmkFile.set_size_band`. The band is split evenly over
+        the segments."""
+        check_size_band(min_blocks, max_blocks)
+        segments = self._created()
+        self._in_parallel([
+            functools.partial(segment.set_size_band,
+                              ceil(min_blocks / len(segments)),
+                              ceil(max_blocks / len(segments)))
+            for segment in segments])
+
+    def compact(self, codenames: Sequence[str],
+                blocks_num: int) -> CompactResult:
+        """Same as `DmkFile.compact`. The `blocks_num` is split evenly
+        over the segments, and they are rewritten in parallel.
+
+        The names are checked before the rewrite, so a missing name does not
+        change any of the segments. The scan times are for the largest
+        segment: a lookup scans only one of them."""
+        keys = derive_keys(list(dict.fromkeys(codenames))
+                           + [random_codename_fullsize()], self.salt)
+        dummy_key = keys.pop()
+        by_segment = self._by_segment(keys)
+        segments = self._created()
+        if not all(segments[idx]._has_content(
+                [keys[pos] for pos in positions])
+                   for idx, positions in by_segment.items()):
+            raise DmkKeyError
+        per_segment = ceil(blocks_num / len(segments))
+
+        def compact_segment(idx: int) -> Callable[[], CompactResult]:
+            return lambda: segments[idx]._compact(
+                [keys[pos] for pos in by_segment.get(idx, [])],
+                dummy_key, per_segment)
+
+        results = self._in_parallel([compact_segment(idx) for idx
+                                     in range(len(segments))])
+        return CompactResult(
+            size_before=sum(r.size_before for r in results),
+            size_after=sum(r.size_after for r in results),
+            blocks_before=sum(r.blocks_before for r in results),
+            blocks_after=sum(r.blocks_after for r in results),
+            scan_seconds_before=max(r.scan_seconds_before for r in results),
+            scan_seconds_after=max(r.scan_seconds_after for r in results))
+
+    def set_from_io(self, codename: str, source: BinaryIO):
+        ck = CodenameKey(codename, self.salt)
+        self._created()[self._segment_of(ck)].set_from_io(codename, source)
+
+    def set_bytes(self, codename: str, data: bytes):
+        with BytesIO(data) as bytes_io:
+            self.set_from_io(codename, bytes_io)
+
+    def set_if_version(self, codename: str, data: bytes,
+                       expected_data_version: Optional[int]):
+        ck = CodenameKey(codename, self.salt)
+        self._created()[self._segment_of(ck)].set_if_version(
+            codename, data, expected_data_version)
+
+    def set_many_bytes(self, items: Mapping[str, bytes]) -> SetManyResult:
+        """Same as `DmkFile.set_many_bytes`. Each affected segment is
+        rewritten once, in parallel with the others."""
+        if not items:
+            return SetManyResult([], [], [])
+        names = list(items.keys())
+        keys = derive_keys(names, self.salt)
+        segments = self._created()
+
+        def set_segment(idx: int, positions: List[int]) \
+                -> Callable[[], SetManyResult]:
+            return lambda: segments[idx].set_many_bytes(
+                {names[pos]: items[names[pos]] for pos in positions})
+
+        results = self._in_parallel([set_segment(idx, positions)
+                                     for idx, positions
+                                     in self._by_segment(keys).items()])
+        # in the order of the `items`
+        added = {name for result in results for name in result.added}
+        changed = {name for result in results for name in result.changed}
+        return SetManyResult(
+            added=[name for name in names if name in added],
+            changed=[name for name in names if name in changed],
+            unchanged=[name for name in names
+                       if name not in added and name not in changed])
+
+    def get_bytes(self, codename: str) -> Optional[bytes]:
+        ck = CodenameKey(codename, self.salt)
+        return self.segments[self._segment_of(ck)].get_bytes(codename)
+
+    def read_range(self, codename: str, offset: int, length: int) \
+            -> Optional[bytes]:
+        ck = CodenameKey(codename, self.salt)
+        return self.segments[self._segment_of(ck)] \
+            .read_range(codename, offset, length)
+
+    def open_entry(self, codename: str) -> Optional[DecryptedReader]:
+        ck = CodenameKey(codename, self.salt)
+        return self.segments[self._segment_of(ck)].open_entry(codename)
+
+    def get_bytes_and_version(self, codename: str) \
+            -> Tuple[Optional[bytes], Optional[int]]:
+        ck = CodenameKey(codename, self.salt)
+        return self.segments[self._segment_of(ck)] \
+            .get_bytes_and_version(codename)
+
+    def get_many_bytes(self, codenames: Sequence[str]) \
+            -> List[Optional[bytes]]:
+        """Same as `DmkFile.get_many_bytes`. The segments are scanned in
+        parallel."""
+        keys = derive_keys(codenames, self.salt)
+        groups = list(self._by_segment(keys).items())
+
+        def get_segment(idx: int, positions: List[int]) \
+                -> Callable[[], List[Optional[bytes]]]:
+            return lambda: self.segments[idx].get_many_bytes(
+                [codenames[pos] for pos in positions])
+
+        found = self._in_parallel([get_segment(idx, positions)
+                                   for idx, positions in groups])
+        result: List[Optional[bytes]] = [None] * len(codenames)
+        for (_, positions), values in zip(groups, found):
+            for pos, value in zip(positions, values):
+                result[pos] = value
+        return result
+
+
+AnyDmkFile = Union[DmkFile, SegmentedDmkFile]
+
+
+def open_dmk_file(path: Path, keep_open: bool = False) -> AnyDmkFile:
+    """`SegmentedDmkFile` if the `path` is a directory, otherwise
+    `DmkFile`."""
+    if path.is_dir():
+        return SegmentedDmkFile(path, keep_open=keep_open)
+    return DmkFile(path, keep_open=keep_open)
@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+from typing import BinaryIO, Optional, Sequence, List
+
+from ._vault_file import fresh_content
+from .a_base import CodenameKey, derive_keys
+from .a_utils.counters import Counters, counting, count
+from .b_storage_file import StorageStreamReader, Layout
+from .c_namegroups._streaming import stream_name_groups
+
+
+class StreamedVault:
+    """The vault read from a stream that cannot seek, like the standard
+    input of `ssh host cat vault.dmk | dmk -v - get -e name`.
+
+    The header is read on creation. The blocks are read by the first call
+    to `get_bytes` or `get_many_bytes`, in a single pass, and only the
+    blocks of the requested names are kept in memory. So the vault can be
+    read only once: pass all the names to `get_many_bytes`.
+
+    The vaults with the imprint table cannot be streamed (see
+    `StorageStreamReader`).
+    """
+
+    def __init__(self, source: BinaryIO):
+        self._reader = StorageStreamReader(source)
+        self.metrics = Counters()
+
+    @property
+    def salt(self) -> bytes:
+        return self._reader.salt
+
+    @property
+    def layout(self) -> Layout:
+        return self._reader.layout
+
+    @property
+    def cluster_size(self) -> int:
+        return self.layout.cluster_size
+
+    def get_bytes(self, codename: str) -> Optional[bytes]:
+        return self.get_many_bytes([codename])[0]
+
+    def get_many_bytes(self, codenames: Sequence[str]) \
+            -> List[Optional[bytes]]:
+        """The contents in the same order as `codenames`. Raises
+        `ValueError` if the stream was already read."""
+        with counting(self.metrics):
+            keys: List[CodenameKey] = derive_keys(codenames, self.salt)
+            count('lookups', len(keys))
+            return [fresh_content(ng)
+                    for ng in stream_name_groups(self._reader, keys)]
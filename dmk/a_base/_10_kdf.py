@@ -2,14 +2,18 @@
 # SPDX-License-Identifier: MIT
 
 
+import os
+import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Optional, NamedTuple
+from typing import Optional, NamedTuple, Dict, Tuple, List, Sequence
 
 import argon2.low_level
 
 from dmk._common import KEY_SALT_SIZE
 from dmk.a_base._05_codename import CodenameAscii
+from dmk.a_utils.spans import span
 
 
 class ArgonParams(NamedTuple):
@@ -60,11 +64,73 @@ class CodenameKey:
         if len(salt) != KEY_SALT_SIZE:
             raise ValueError("Wrong salt length")
         self.codename = password
-        self.as_bytes = _password_to_key_cached(
-            password=CodenameAscii.to_ascii(password),
-            salt=salt,
-            mem_cost=CodenameKey.__mem_cost,
-            time_cost=CodenameKey.__time_cost)
+        with span('kdf'):
+            self.as_bytes = _password_to_key_shared(
+                password=CodenameAscii.to_ascii(password),
+                salt=salt,
+                mem_cost=CodenameKey.__mem_cost,
+                time_cost=CodenameKey.__time_cost)
+
+
+def derive_keys(passwords: Sequence[str], salt: bytes,
+                max_workers: Optional[int] = None) -> List[CodenameKey]:
+    """Computes the keys for multiple passwords in parallel threads.
+
+    Argon2 releases the GIL, so the computations really run in parallel.
+    Each of them takes 128 MiB, therefore the number of threads is limited.
+    The results are in the same order as `passwords`.
+    """
+    unique = list(dict.fromkeys(passwords))
+    if max_workers is None:
+        max_workers = min(len(unique), os.cpu_count() or 1, 4)
+    if max_workers <= 1:
+        keys = [CodenameKey(p, salt) for p in unique]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            keys = list(executor.map(lambda p: CodenameKey(p, salt), unique))
+    by_password = dict(zip(unique, keys))
+    return [by_password[p] for p in passwords]
+
+
+_KeyArgs = Tuple[bytes, bytes, int, int]
+
+
+class _Pending:
+    """The lock of a key being derived, and the number of its callers."""
+    __slots__ = ["lock", "callers"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callers = 0
+
+
+_pending: Dict[_KeyArgs, _Pending] = dict()
+_pending_guard = threading.Lock()
+
+
+def _password_to_key_shared(password: bytes, salt: bytes, mem_cost: int,
+                            time_cost: int):
+    # `lru_cache` is thread-safe, but it does not prevent two threads from
+    # computing the same missing value at the same time. Argon2 is too
+    # expensive for that, so concurrent requests for the same key wait
+    # for the first one and then take the value from the cache. The lock
+    # is dropped only by the last of them, when the value is cached
+    args = (password, salt, mem_cost, time_cost)
+    with _pending_guard:
+        pending = _pending.get(args)
+        if pending is None:
+            pending = _pending[args] = _Pending()
+        pending.callers += 1
+    try:
+        with pending.lock:
+            return _password_to_key_cached(password=password, salt=salt,
+                                           mem_cost=mem_cost,
+                                           time_cost=time_cost)
+    finally:
+        with _pending_guard:
+            pending.callers -= 1
+            if pending.callers == 0:
+                del _pending[args]
 
 
 @lru_cache(10000)
@@ -1 +1 @@
-from ._10_kdf import CodenameKey
+from ._10_kdf import CodenameKey, derive_keys
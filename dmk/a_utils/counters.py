@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Operational counters: blocks scanned, bytes copied, bytes written.
+
+The low-level functions call `count` without knowing who is interested.
+The values go to the `Counters` object set by the nearest `counting` block
+of the same thread (or asyncio task). Outside such blocks `count` does
+nothing.
+
+    counters = Counters()
+    with counting(counters):
+        dmk_file.get_bytes("name")
+    counters['blocks_scanned']
+"""
+
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Iterator
+
+
+class Counters:
+    """Named integer counters. Can be updated from multiple threads."""
+
+    def __init__(self):
+        self._values: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, value: int = 1):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def __getitem__(self, key: str) -> int:
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+_current: ContextVar[Optional[Counters]] = ContextVar('dmk_counters',
+                                                       default=None)
+
+
+@contextmanager
+def counting(counters: Counters) -> Iterator[Counters]:
+    token = _current.set(counters)
+    try:
+        yield counters
+    finally:
+        _current.reset(token)
+
+
+def count(key: str, value: int = 1):
+    counters = _current.get()
+    if counters is not None:
+        counters.add(key, value)
+
+
+def counted(method):
+    """The counters updated while the method runs go to `self.metrics`."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with counting(self.metrics):
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -1,11 +1,14 @@
 # SPDX-FileCopyrightText: (c) 2021 Artёm IG <github.com/rtmigo>
 # SPDX-License-Identifier: MIT
 import os
+import secrets
 import shutil
 from pathlib import Path
 from typing import Optional
 
+from dmk.a_utils.counters import count
 from dmk.a_utils.shred import shred
+from dmk.a_utils.spans import span
 
 
 class WritingToTempFile:
@@ -14,16 +17,27 @@ class WritingToTempFile:
 
     We must use the same function for real files and fakes, so they
     look the same in logs.
+
+    The temporary names are random, so concurrent writers of the same file
+    do not write to the same temporary file.
     """
 
     def __init__(self, file: Path):
         self.final = file
-        self.dirty = file.parent / (file.name + ".tmp")
+        self._suffix = secrets.token_hex(4)
+        self.dirty = file.parent / f"{file.name}.{self._suffix}.tmp"
 
     def __enter__(self):
         return self
 
     def commit(self):
+        with span('commit') as s:
+            size = self.dirty.stat().st_size
+            s.add('bytes_written', size)
+            count('bytes_written', size)
+            self._commit()
+
+    def _commit(self):
         # instead of atomically replacing `final` with `dirty`,
         # we will copy `final` to a .bak file, rename `dirty` to `final`,
         # and securely remove the `.bak`. This way we'll be sure, the old
@@ -31,7 +45,7 @@ class WritingToTempFile:
 
         bak: Optional[Path] = None
         if self.final.exists():
-            bak = self.final.parent / f"{self.final.name}.bak"
+            bak = self.final.parent / f"{self.final.name}.{self._suffix}.bak"
             shutil.copy2(self.final, bak)
 
         os.replace(self.dirty, self.final)
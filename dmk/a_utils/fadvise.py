@@ -0,0 +1,41 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Access pattern hints for the OS page cache (`posix_fadvise`).
+
+    fadvise(file, SEQUENTIAL)
+    fadvise(file, WILLNEED, offset, length)
+
+They are only hints. Where `os.posix_fadvise` is not available (Windows,
+macOS), or the stream has no file descriptor (`BytesIO`), they do nothing.
+"""
+
+import io
+import os
+from typing import Optional, BinaryIO
+
+NORMAL: Optional[int] = getattr(os, 'POSIX_FADV_NORMAL', None)
+SEQUENTIAL: Optional[int] = getattr(os, 'POSIX_FADV_SEQUENTIAL', None)
+RANDOM: Optional[int] = getattr(os, 'POSIX_FADV_RANDOM', None)
+WILLNEED: Optional[int] = getattr(os, 'POSIX_FADV_WILLNEED', None)
+DONTNEED: Optional[int] = getattr(os, 'POSIX_FADV_DONTNEED', None)
+
+# the benchmarks turn the hints off to measure their effect
+enabled = True
+
+
+def fadvise(stream: BinaryIO, advice: Optional[int],
+            offset: int = 0, length: int = 0):
+    """Gives the `advice` for `length` bytes of the file from the `offset`.
+    Zero `length` means up to the end of the file."""
+    if not enabled or advice is None:
+        return
+    try:
+        fd = stream.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
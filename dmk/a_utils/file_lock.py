@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""The advisory lock of the vault file for the writers.
+
+    with locked(path):
+        ...  # read the file, write a new one and replace the old one
+
+The vault is replaced by renaming, so each version of it is a new file,
+and locking it would not stop the next writer. The lock is held on the
+`<name>.lock` file next to it instead. The file stays after the lock is
+released.
+
+The lock is exclusive between the processes, and also between the threads
+of one process: each call opens the lock file again. So the calls must not
+be nested for the same path.
+"""
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+    import msvcrt
+
+
+def lock_path(path: Path) -> Path:
+    return path.with_name(path.name + '.lock')
+
+
+@contextmanager
+def locked(path: Path) -> Iterator[None]:
+    """Waits for the other writers of the `path`, and keeps them waiting
+    until the block ends."""
+    with lock_path(path).open('a+b') as lock_io:
+        fd = lock_io.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            # locks the first byte. It does not have to exist
+            os.lseek(fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # it gives up after 10 seconds
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
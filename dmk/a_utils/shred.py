@@ -4,13 +4,33 @@
 
 from pathlib import Path
 
+from dmk._common import CLUSTER_SIZE
+
 from dmk.a_utils.randoms import get_noncrypt_random_bytes
+from dmk.a_utils.counters import count
+from dmk.a_utils.fadvise import fadvise, DONTNEED
+from dmk.a_utils.spans import span
+
+
+# the file is overwritten by chunks, so the memory usage does not depend on
+# the file size
+SHRED_CHUNK_SIZE = 16 * CLUSTER_SIZE
 
 
 def shred(file: Path, cycles=2):
-    size = file.stat().st_size
-    for _ in range(cycles):
-        data = get_noncrypt_random_bytes(size)
-        with file.open('wb') as f:
-            f.write(data)
-    file.unlink()
+    with span('shred') as s:
+        size = file.stat().st_size
+        for _ in range(cycles):
+            with file.open('r+b') as f:
+                left = size
+                while left > 0:
+                    chunk_size = min(left, SHRED_CHUNK_SIZE)
+                    f.write(get_noncrypt_random_bytes(chunk_size))
+                    left -= chunk_size
+                f.flush()
+                # the file is removed soon, its pages are of no use in the
+                # cache. The OS drops the pages that are already written
+                fadvise(f, DONTNEED)
+        file.unlink()
+        s.add('bytes_written', size * cycles)
+        count('bytes_shredded', size)
@@ -0,0 +1,156 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Timing spans for the slow stages: key derivation, scanning the blocks,
+decryption, rewriting the file.
+
+    with span('scan') as s:
+        ...
+        s.add('blocks', len(blobs))
+
+Spans are recorded only after `enable`. Before that, `span` returns the
+same do-nothing object on each call.
+"""
+
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Any
+
+TIMINGS_ENVNAME = 'DMK_TIMINGS'
+TIMINGS_FORMATS = ('table', 'json')
+
+
+class Span:
+    __slots__ = ('name', 'depth', 'started', 'duration', 'counts', '_token')
+
+    def __init__(self, name: str):
+        self.name = name
+        parent = _current.get()
+        self.depth: int = parent.depth + 1 if parent is not None else 0
+        self.started = 0.0
+        self.duration = 0.0
+        self.counts: Dict[str, int] = dict()
+
+    def __enter__(self) -> 'Span':
+        self._token = _current.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration = time.perf_counter() - self.started
+        _current.reset(self._token)
+        recorder = _recorder
+        if recorder is not None:
+            recorder.append(self)
+
+    def add(self, key: str, value: int = 1):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def add(self, key: str, value: int = 1):
+        pass
+
+
+class SpanRecorder:
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.created = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def append(self, s: Span):
+        with self._lock:
+            self.spans.append(s)
+
+    def summary(self, start: int = 0) -> List[Dict[str, Any]]:
+        """Spans with the same name joined in a single row. The rows are
+        in the order the stages started. The spans recorded before the
+        `start` one are skipped."""
+        rows: Dict[str, Dict[str, Any]] = dict()
+        with self._lock:
+            spans = self.spans[start:]
+        for s in sorted(spans, key=lambda x: x.started):
+            row = rows.setdefault(s.name, {'name': s.name, 'depth': s.depth,
+                                           'calls': 0, 'ms': 0.0,
+                                           'counts': dict()})
+            row['calls'] += 1
+            row['ms'] += s.duration * 1000
+            row['depth'] = min(row['depth'], s.depth)
+            for key, value in s.counts.items():
+                row['counts'][key] = row['counts'].get(key, 0) + value
+        return list(rows.values())
+
+    def format_table(self) -> str:
+        lines = [f"{'stage':<24} {'calls':>6} {'ms':>10}  counts"]
+        for row in self.summary():
+            name = '  ' * row['depth'] + row['name']
+            counts = ' '.join(f"{k}={v:,}" for k, v in row['counts'].items())
+            lines.append(f"{name:<24} {row['calls']:>6} "
+                         f"{row['ms']:>10.2f}  {counts}".rstrip())
+        return '\n'.join(lines)
+
+    def format_json(self) -> str:
+        return json.dumps({'spans': [
+            {'name': s.name,
+             'depth': s.depth,
+             'start_ms': round((s.started - self.created) * 1000, 3),
+             'ms': round(s.duration * 1000, 3),
+             **s.counts}
+            for s in sorted(self.spans, key=lambda x: x.started)]})
+
+    def format(self, fmt: str) -> str:
+        if fmt == 'json':
+            return self.format_json()
+        return self.format_table()
+
+
+_NULL_SPAN = _NullSpan()
+_current: ContextVar[Optional[Span]] = ContextVar('dmk_span', default=None)
+_recorder: Optional[SpanRecorder] = None
+
+
+def span(name: str):
+    if _recorder is None:
+        return _NULL_SPAN
+    return Span(name)
+
+
+def format_from_env() -> Optional[str]:
+    """The report format set by the environment variable, or None if the
+    spans are not enabled by it."""
+    value = os.environ.get(TIMINGS_ENVNAME, '').strip().lower()
+    if not value or value in ('0', 'no', 'false'):
+        return None
+    return value if value in TIMINGS_FORMATS else 'table'
+
+
+def enable() -> SpanRecorder:
+    """Starts recording the spans. Returns the new recorder."""
+    global _recorder
+    _recorder = SpanRecorder()
+    return _recorder
+
+
+def current_recorder() -> Optional[SpanRecorder]:
+    """The recorder of the spans, or None if they are not recorded."""
+    return _recorder
+
+
+def disable() -> Optional[SpanRecorder]:
+    """Stops recording. Returns the recorder with the spans recorded so far,
+    or None if it was not enabled."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
@@ -12,8 +12,8 @@ from Crypto.Hash import BLAKE2s
 from Crypto.Random import get_random_bytes
 
 from dmk._common import read_or_fail, InsufficientData, \
-    MAX_CLUSTER_CONTENT_SIZE, CLUSTER_SIZE, CLUSTER_META_SIZE, \
-    HEADER_SIZE, IMPRINT_SIZE
+    CLUSTER_SIZE, CLUSTER_META_SIZE, HEADER_SIZE, IMPRINT_SIZE, \
+    max_cluster_content_size, BLOCK_PREFIX_SIZE
 from dmk.a_base._10_kdf import CodenameKey
 from dmk.a_utils.bytes import bytes_to_str
 from dmk.a_utils.dirty_file import WritingToTempFile
@@ -21,7 +21,8 @@ from dmk.a_utils.randoms import set_random_last_modified, \
     get_noncrypt_random_bytes
 from dmk.b_cryptoblobs._10_byte_funcs import bytes_to_uint32, \
     uint32_to_bytes, uint16_to_bytes, \
-    bytes_to_uint16, uint48_to_bytes, bytes_to_uint48
+    bytes_to_uint16, uint48_to_bytes, bytes_to_uint48, uint24_to_bytes, \
+    bytes_to_uint24
 
 _DEBUG_PRINT = False
 
@@ -41,6 +42,7 @@ class ItemImprintMismatch(Exception):
 # in 2021 there are only finished ChaCha20 standards with 64-bit and
 # 96-bit nonce
 ENCRYPTION_NONCE_LEN = 12  # 96-bit
+assert ENCRYPTION_NONCE_LEN + IMPRINT_SIZE == BLOCK_PREFIX_SIZE
 
 
 # HEADER_CHECKSUM_LEN = 21
@@ -88,6 +90,7 @@ class Header(NamedTuple):
     # parts_len: int
     part_idx: int
     part_size: int
+    is_manifest: bool = False
 
 
 def get_stream_size(stream: BinaryIO) -> int:
@@ -120,6 +123,26 @@ def get_lower15bits(x: int) -> int:
     return x & 0x7FFF
 
 
+# The block format 1 keeps the part size in 15 bits. It is used for the
+# clusters that fit into that. The format 2 is the same, but it keeps the
+# part index in a single byte, and the part size in 23 bits of the next
+# three bytes. The highest bit of these three bytes is the "last" flag
+BLOCK_FORMAT_SHORT = 1
+BLOCK_FORMAT_LONG = 2
+
+LAST_PART_BIT_24 = 0x800000
+MAX_PART_SIZE_24 = LAST_PART_BIT_24 - 1
+
+# set in the format byte of the manifest blocks (see `encrypt_manifest`)
+MANIFEST_BIT = 0x80
+
+
+def block_format(cluster_size: int) -> int:
+    if max_cluster_content_size(cluster_size) <= 0x7FFF:
+        return BLOCK_FORMAT_SHORT
+    return BLOCK_FORMAT_LONG
+
+
 FAKE_CONTENT_VERSION = 0xFFFFFFFFFFFF
 
 
@@ -138,20 +161,25 @@ class Encrypt:
                  # original_size: int = None,
                  part_idx: int = 0,
                  parts_len: int = 1,
-                 part_size: Optional[int] = None):
+                 part_size: Optional[int] = None,
+                 manifest: bool = False):
 
         self.target_size = target_size
+        self.block_format = block_format(target_size)
+        self.manifest = manifest
 
         if not 0 <= part_idx <= 0xFF:
             raise ValueError(f"part_idx={part_idx}")
         if not 1 <= parts_len <= 0xFF + 1:
             raise ValueError(f"parts_len={parts_len}")
 
-        # we cannot fit blocks size larger than that into 15 bits
-        assert MAX_CLUSTER_CONTENT_SIZE <= 0x7FFF
+        # we cannot fit blocks size larger than that into 15 or 23 bits
+        assert max_cluster_content_size(target_size) <= (
+            0x7FFF if self.block_format == BLOCK_FORMAT_SHORT
+            else MAX_PART_SIZE_24)
 
         if part_size is not None and not (
-                0 <= part_size <= MAX_CLUSTER_CONTENT_SIZE):
+                0 <= part_size <= max_cluster_content_size(target_size)):
             raise ValueError(f"part_size={part_size}")
 
         self.cnk = cnk
@@ -194,7 +222,10 @@ class Encrypt:
                                         For fake blocks it is not a checksum,
                                         but four random bytes.
 
-                FORMAT_VER    (uint8)   Always 1.
+                FORMAT_VER    (uint8)   1, or 2 for the clusters larger
+                                        than 32 KiB (see BLOCK_FORMAT_LONG).
+                                        The highest bit is set in the
+                                        manifest blocks (MANIFEST_BIT).
 
                                         This constant will hypothetically make
                                         it possible to change the format of
@@ -212,6 +243,9 @@ class Encrypt:
                                         Highest bit is 1 if this is
                                         the last cluster, 0 if not
 
+                In the format 2 PART_IDX is uint8 and PART_SIZE is uint24
+                with 23 bits for the size.
+
                 ITEM_VER      (uint48)  Increases on each write.
 
                                         For fake blocks it's FFFF FFFF FFFF.
@@ -255,19 +289,28 @@ class Encrypt:
                 assert source is not None
                 self.part_size = get_stream_size(source)
 
-        assert get_lower15bits(self.part_size) == self.part_size
-
         is_last_part = self.part_idx == self.parts_len - 1
 
-        part_is_last_and_size = self.part_size
-        part_is_last_and_size = set_highest_bit_16(
-            part_is_last_and_size,
-            is_last_part
-        )
+        if self.block_format == BLOCK_FORMAT_SHORT:
+            assert get_lower15bits(self.part_size) == self.part_size
+
+            part_is_last_and_size = self.part_size
+            part_is_last_and_size = set_highest_bit_16(
+                part_is_last_and_size,
+                is_last_part
+            )
 
-        assert get_lower15bits(part_is_last_and_size) == self.part_size, \
-            (get_lower15bits(part_is_last_and_size), self.part_size)
-        assert get_highest_bit_16(part_is_last_and_size) == is_last_part
+            assert get_lower15bits(part_is_last_and_size) == self.part_size, \
+                (get_lower15bits(part_is_last_and_size), self.part_size)
+            assert get_highest_bit_16(part_is_last_and_size) == is_last_part
+
+            part_idx_bytes = uint16_to_bytes(self.part_idx)
+            part_size_bytes = uint16_to_bytes(part_is_last_and_size)
+        else:
+            assert 0 <= self.part_size <= MAX_PART_SIZE_24
+            part_idx_bytes = bytes((self.part_idx,))
+            part_size_bytes = uint24_to_bytes(
+                self.part_size | (LAST_PART_BIT_24 if is_last_part else 0))
 
         ##########
 
@@ -281,9 +324,6 @@ class Encrypt:
             body_bytes = read_or_fail(source, self.part_size)
             body_crc_bytes = uint32_to_bytes(zlib.crc32(body_bytes))
 
-        part_idx_bytes = uint16_to_bytes(self.part_idx)
-        part_size_bytes = uint16_to_bytes(part_is_last_and_size)
-
         # codename_data = CodenameAscii.to_padded_ascii(self.cnk.codename)
 
         cryptographer = Cryptographer(fpk=self.cnk,
@@ -309,7 +349,8 @@ class Encrypt:
         def encrypt_and_write(data: bytes):
             outfile.write(cryptographer.cipher.encrypt(data))
 
-        version = bytes((1,))
+        version = bytes((self.block_format
+                         | (MANIFEST_BIT if self.manifest else 0),))
 
         header_data = b''.join((
             # codename_data,
@@ -376,22 +417,27 @@ class DecryptedIO:
     After the object is created, only the imprint is read and checked.
     After accessing the `header` property, the header is read.
     After calling read_data() - the data itself (and the header).
+
+    The data is not kept in the object: each call to `read_data` reads
+    and decrypts it again, and checks its CRC-32.
+
+    If the `header` of the block is already known (from an earlier read
+    of the same block), it is not read again, and the imprint is not
+    checked.
     """
 
     def __init__(self,
                  fpk: CodenameKey,
-                 source: BinaryIO):
+                 source: BinaryIO,
+                 header: Optional[Header] = None):
         self.fpk = fpk
         self._source = source
 
         self._nonce: Optional[bytes] = None
         self._imprint: Optional[bytes] = None
 
-        self._header: Optional[Header] = None
-        self._tried_to_read_header = False
-
-        self._data_read = False
-        self._data = None
+        self._header: Optional[Header] = header
+        self._tried_to_read_header = header is not None
 
         pos = self._source.tell()
         if pos != 0:
@@ -463,14 +509,19 @@ class DecryptedIO:
 
         body_crc32_data = self.__read_and_decrypt(4)
         format_version_data = self.__read_and_decrypt(1)
+        is_manifest = (format_version_data[0] & MANIFEST_BIT) != 0
+        block_fmt = format_version_data[0] & ~MANIFEST_BIT
 
         # after reading the format version version we can choose different
         # paths. Do not forget that this may not be a version, but random data.
-        # And there are no different ways yet: there is only one block format
-        # version.
+        # The imprint is already checked, so the random data is unlikely.
 
-        part_idx_data = self.__read_and_decrypt(2)
-        part_size_data = self.__read_and_decrypt(2)
+        if block_fmt == BLOCK_FORMAT_LONG:
+            part_idx_data = self.__read_and_decrypt(1)
+            part_size_data = self.__read_and_decrypt(3)
+        else:
+            part_idx_data = self.__read_and_decrypt(2)
+            part_size_data = self.__read_and_decrypt(2)
         content_version_data = self.__read_and_decrypt(6)
         # header_checksum = self.__read_and_decrypt(HEADER_CHECKSUM_LEN)
 
@@ -488,12 +539,18 @@ class DecryptedIO:
 
         assert len(header_data) == HEADER_SIZE, len(header_data)
 
-        assert format_version_data[0] == 1
-        part_idx = bytes_to_uint16(part_idx_data)
+        if block_fmt == BLOCK_FORMAT_LONG:
+            part_idx = part_idx_data[0]
+            last_and_size = bytes_to_uint24(part_size_data)
+            part_size = last_and_size & MAX_PART_SIZE_24
+            is_last = (last_and_size & LAST_PART_BIT_24) != 0
+        else:
+            assert block_fmt == BLOCK_FORMAT_SHORT
+            part_idx = bytes_to_uint16(part_idx_data)
 
-        last_and_size = bytes_to_uint16(part_size_data)
-        part_size = get_lower15bits(last_and_size)
-        is_last = get_highest_bit_16(last_and_size)
+            last_and_size = bytes_to_uint16(part_size_data)
+            part_size = get_lower15bits(last_and_size)
+            is_last = get_highest_bit_16(last_and_size)
 
         content_version = bytes_to_uint48(content_version_data)
         content_crc32 = bytes_to_uint32(body_crc32_data)
@@ -506,44 +563,51 @@ class DecryptedIO:
                       # parts_len=parts_len,
                       part_idx=part_idx,
                       is_last_part=is_last,
+                      is_manifest=is_manifest,
                       valid=True)
 
     def read_data(self) -> bytes:
-        # todo remove
         result = self.data
         if result is None:
             raise TypeError
         return result
-        # if self._data_read:
-        #     raise RuntimeError("Cannot read data more than once")
-        #
-        # if not self.contains_data:
-        #     raise RuntimeError("contains_data is False")
-        #
-        # assert self._source.tell() == CLUSTER_META_SIZE, f"pos is {self._source.tell()}"
-        #
-        # body = self.__read_and_decrypt(self.header.part_size)
-        # if zlib.crc32(body) != self.header.content_crc32:
-        #     raise VerificationFailure("Body CRC mismatch.")
-        #
-        # self._data_read = True
-        # return body
 
     @property
-    def data(self):
-        if self._data_read:
-            return self._data
-        assert not self._data_read
-
-        self._data_read = True
-        if self.contains_data:
-            assert self._source.tell() == CLUSTER_META_SIZE, f"pos is {self._source.tell()}"
-
-            self._data = self.__read_and_decrypt(self.header.part_size)
-            if zlib.crc32(self._data) != self.header.content_crc32:
-                raise VerificationFailure("Body CRC mismatch.")
-
-            return self._data
+    def data(self) -> Optional[bytes]:
+        """The decrypted data, or None for fake blocks. Raises
+        `VerificationFailure` if the checksum does not match."""
+        if not self.contains_data:
+            return None
+
+        # the stream cipher is positioned right after the header, so the
+        # data can be decrypted any number of times
+        cipher = ChaCha20.new(key=self.fpk.as_bytes, nonce=self.nonce)
+        self._source.seek(CLUSTER_META_SIZE, io.SEEK_SET)
+        cipher.seek(HEADER_SIZE)
+        data = cipher.decrypt(read_or_fail(self._source,
+                                           self.header.part_size))
+        if zlib.crc32(data) != self.header.content_crc32:
+            raise VerificationFailure("Body CRC mismatch.")
+        return data
+
+    def read_data_range(self, offset: int, length: int) -> bytes:
+        """Decrypts only `length` bytes of the data starting from the
+        `offset`. The range must be inside the data.
+
+        The checksum covers the whole data, so it is verified only when the
+        range is the whole data."""
+        if not self.contains_data:
+            raise TypeError
+        if not (0 <= offset and 0 <= length
+                and offset + length <= self.header.part_size):
+            raise ValueError(f"offset={offset}, length={length}")
+        if offset == 0 and length == self.header.part_size:
+            return self.read_data()
+        # ChaCha20 can start decryption from any position of the stream
+        cipher = ChaCha20.new(key=self.fpk.as_bytes, nonce=self.nonce)
+        cipher.seek(HEADER_SIZE + offset)
+        self._source.seek(CLUSTER_META_SIZE + offset, io.SEEK_SET)
+        return cipher.decrypt(read_or_fail(self._source, length))
 
     # def verify_data(self) -> bool:
     #     """This can be called before removing an old block.
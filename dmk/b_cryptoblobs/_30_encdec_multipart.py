@@ -2,20 +2,30 @@
 # SPDX-License-Identifier: MIT
 
 
+import bisect
 import io
 import zlib
 from pathlib import Path
-from typing import BinaryIO, List, Set
+from typing import BinaryIO, List, Set, Sequence, Optional, Callable
 
-from dmk._common import MAX_CLUSTER_CONTENT_SIZE, CLUSTER_SIZE
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE, CLUSTER_SIZE, \
+    max_cluster_content_size
 from dmk.a_base._10_kdf import CodenameKey
 from dmk.a_utils.randoms import set_random_last_modified, unique_filename
+from dmk.a_utils.spans import span
+from dmk.b_cryptoblobs._10_byte_funcs import uint48_to_bytes, \
+    bytes_to_uint48
 from dmk.b_cryptoblobs._20_encdec_part import get_stream_size, \
     Encrypt, \
     DecryptedIO
 
+# each part is listed in the manifest as its uint48 data version
+_MANIFEST_ITEM_SIZE = 6
 
-def split_cluster_sizes(full_size: int) -> List[int]:
+
+def split_cluster_sizes(full_size: int,
+                        max_part_size: int = MAX_CLUSTER_CONTENT_SIZE) \
+        -> List[int]:
     if full_size < 0:
         raise ValueError
     if full_size == 0:
@@ -23,8 +33,8 @@ def split_cluster_sizes(full_size: int) -> List[int]:
     result: List[int] = []
     s = full_size
     while s > 0:
-        result.append(min(s, MAX_CLUSTER_CONTENT_SIZE))
-        s -= MAX_CLUSTER_CONTENT_SIZE
+        result.append(min(s, max_part_size))
+        s -= max_part_size
     assert sum(result) == full_size
     return result
 
@@ -33,24 +43,37 @@ class MultipartEncryptor:
     def __init__(self,
                  fpk: CodenameKey,
                  source_io: BinaryIO,
-                 content_version: int):
+                 content_version: int,
+                 cluster_size: int = CLUSTER_SIZE):
         self.fpk = fpk
         self.content_version = content_version
+        self.cluster_size = cluster_size
 
         self._source_bytesio = source_io
 
         # todo cache source io in bytes io?
 
         full_size = get_stream_size(source_io)
-        self.part_sizes = split_cluster_sizes(full_size)
+        self.part_sizes = split_cluster_sizes(
+            full_size, max_cluster_content_size(cluster_size))
         assert sum(self.part_sizes) == full_size
 
         assert self._source_bytesio.tell() == 0
-        self.source_crc = zlib.crc32(self._source_bytesio.read())
+        self.source_crc = 0
+        while True:
+            chunk = self._source_bytesio.read(CLUSTER_SIZE)
+            if not chunk:
+                break
+            self.source_crc = zlib.crc32(chunk, self.source_crc)
         self._source_bytesio.seek(0, io.SEEK_SET)
 
         self.encrypted_indices: Set[int] = set()
 
+    def part_data(self, part_idx: int) -> bytes:
+        self._source_bytesio.seek(sum(self.part_sizes[:part_idx]),
+                                  io.SEEK_SET)
+        return self._source_bytesio.read(self.part_sizes[part_idx])
+
     def encrypt(self, part_idx: int, target_io: BinaryIO):
         if part_idx in self.encrypted_indices:
             raise ValueError(f"The part {part_idx} is already encrypted.")
@@ -59,12 +82,13 @@ class MultipartEncryptor:
         self._source_bytesio.seek(src_pos, io.SEEK_SET)
 
         Encrypt(self.fpk,
+                target_size=self.cluster_size,
                 parts_len=len(self.part_sizes),
                 part_idx=part_idx,
                 part_size=self.part_sizes[part_idx],
                 data_version=self.content_version
                 ).io_to_io(self._source_bytesio, target_io)
-        assert target_io.seek(0, io.SEEK_END) == CLUSTER_SIZE
+        assert target_io.seek(0, io.SEEK_END) == self.cluster_size
 
         self.encrypted_indices.add(part_idx)
 
@@ -83,12 +107,44 @@ class MultipartEncryptor:
         return len(self.encrypted_indices) == len(self.part_sizes)
 
 
+def encrypt_manifest(fpk: CodenameKey, data_version: int,
+                     part_versions: Sequence[int],
+                     cluster_size: int = CLUSTER_SIZE) -> bytes:
+    """The block that makes the content version `data_version` out of the
+    parts with the `part_versions`: the part N is the block with the index
+    N and the version `part_versions[N]`.
+
+    So the new version can reuse the unchanged parts of the older ones,
+    without encrypting them again."""
+    body = b''.join(uint48_to_bytes(v) for v in part_versions)
+    with io.BytesIO(body) as source, io.BytesIO() as target:
+        Encrypt(fpk, data_version=data_version, target_size=cluster_size,
+                part_size=len(body), manifest=True).io_to_io(source, target)
+        return target.getvalue()
+
+
+def parse_manifest(data: bytes) -> List[int]:
+    """The versions of the parts from the decrypted manifest."""
+    if not data or len(data) % _MANIFEST_ITEM_SIZE != 0:
+        raise ValueError("Unexpected manifest size")
+    return [bytes_to_uint48(data[pos:pos + _MANIFEST_ITEM_SIZE])
+            for pos in range(0, len(data), _MANIFEST_ITEM_SIZE)]
+
+
 class BadFilesetError(Exception):
     pass
 
 
 def decrypt_from_dios(files: List[DecryptedIO],
                       target_io: BinaryIO):
+    with span('decrypt') as s:
+        _decrypt_from_dios(files, target_io)
+        s.add('blocks', len(files))
+        s.add('bytes_written', sum(f.header.part_size for f in files))
+
+
+def _decrypt_from_dios(files: List[DecryptedIO],
+                       target_io: BinaryIO):
     if not files:
         raise ValueError("Zero files passed")
 
@@ -107,10 +163,8 @@ def decrypt_from_dios(files: List[DecryptedIO],
         raise BadFilesetError(
             f"Some parts are missing")
 
-    first = files[0]
-    for f in files[1:]:
-        if f.header.data_version != first.header.data_version:
-            raise BadFilesetError("data_version mismatch")
+    # the versions of the parts may differ, if the content version reused
+    # the parts of the older ones (see `encrypt_manifest`)
 
     if len(set(f.header.part_idx for f in files)) != len(files):
         raise BadFilesetError("some part indexes are not unique")
@@ -124,3 +178,99 @@ def decrypt_from_dios(files: List[DecryptedIO],
     pos = target_io.seek(0, io.SEEK_CUR)
     if pos != sum(f.header.part_size for f in files):
         raise ValueError(f"Unexpected final stream position: {pos}.")
+
+
+class DecryptedReader(io.RawIOBase):
+    """Read-only file-like access to the content split into the parts.
+
+    Only the parts that contain the requested bytes are read, and only the
+    requested bytes of them are decrypted (see
+    `DecryptedIO.read_data_range`).
+
+    The `on_close` is called when the reader is closed.
+    """
+
+    def __init__(self, files: List[DecryptedIO],
+                 on_close: Optional[Callable[[], None]] = None):
+        super().__init__()
+        self._files = sorted(files, key=lambda f: f.header.part_idx)
+        if [f.header.part_idx for f in self._files] \
+                != list(range(len(self._files))):
+            raise BadFilesetError("Some parts are missing")
+        # the offset of each part in the content
+        self._starts: List[int] = []
+        size = 0
+        for f in self._files:
+            self._starts.append(size)
+            size += f.header.part_size
+        self._size = size
+        self._pos = 0
+        self._on_close = on_close
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"whence={whence}")
+        if pos < 0:
+            raise ValueError(f"Negative position {pos}")
+        self._pos = pos
+        return pos
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """Up to `length` bytes from the `offset`. Does not change the
+        position."""
+        if offset < 0 or length < 0:
+            raise ValueError(f"offset={offset}, length={length}")
+        end = min(offset + length, self._size)
+        chunks: List[bytes] = []
+        part_idx = bisect.bisect_right(self._starts, offset) - 1
+        while offset < end:
+            start = self._starts[part_idx]
+            part_size = self._files[part_idx].header.part_size
+            chunk_len = min(end, start + part_size) - offset
+            chunks.append(self._files[part_idx].read_data_range(
+                offset - start, chunk_len))
+            offset += chunk_len
+            part_idx += 1
+        return b''.join(chunks)
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        self._checkClosed()
+        if size is None or size < 0:
+            size = max(0, self._size - self._pos)
+        result = self.read_range(self._pos, size)
+        self._pos += len(result)
+        return result
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed and self._on_close is not None:
+            self._on_close()
+        super().close()
@@ -3,4 +3,5 @@
 
 
 from ._20_encdec_part import DecryptedIO
-from ._30_encdec_multipart import MultipartEncryptor, decrypt_from_dios
+from ._30_encdec_multipart import MultipartEncryptor, decrypt_from_dios, \
+    DecryptedReader
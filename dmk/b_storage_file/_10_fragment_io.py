@@ -3,6 +3,8 @@
 
 
 import io
+import os
+import threading
 from abc import abstractmethod
 from types import TracebackType
 from typing import BinaryIO, Optional, Type, Iterator, AnyStr, Iterable, List, \
@@ -84,14 +86,16 @@ class FragmentIO(BinaryIO):
         if bytes_to_read == 0:
             return b''
 
-        # in case the position in the outer stream has been changed
-        self._seek_to_pos()
-
-        buffer = self.underlying.read(bytes_to_read)
+        buffer = self._read_at(self.start + self.__pos, bytes_to_read)
         self.__pos += len(buffer)
         assert 0 <= self.__pos <= self.length
         return buffer
 
+    def _read_at(self, offset: int, size: int) -> bytes:
+        # in case the position in the outer stream has been changed
+        self.underlying.seek(offset, io.SEEK_SET)
+        return self.underlying.read(size)
+
     def write(self, s: Union[bytes, bytearray]) -> int:  # type: ignore
         raise NotImplementedError
 
@@ -144,3 +148,96 @@ class FragmentIO(BinaryIO):
 
     def __iter__(self) -> Iterator[AnyStr]:
         raise NotImplementedError
+
+
+class PositionalReader:
+    """Reads bytes at absolute positions of the `underlying` stream without
+    relying on the shared stream position.
+
+    For real files it uses `os.pread`, so any number of threads may read
+    through the same file descriptor at the same time. For other streams
+    (like `BytesIO`) and on platforms without `pread` (Windows) it falls back
+    to `seek` + `read` guarded by a lock.
+    """
+
+    def __init__(self, underlying: BinaryIO):
+        self.underlying = underlying
+        self._fd: Optional[int] = None
+        if hasattr(os, 'pread'):
+            try:
+                self._fd = underlying.fileno()
+            except (OSError, io.UnsupportedOperation, AttributeError):
+                self._fd = None
+        self._lock = threading.Lock()
+
+    @property
+    def uses_pread(self) -> bool:
+        return self._fd is not None
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if self._fd is None:
+            with self._lock:
+                self.underlying.seek(offset, io.SEEK_SET)
+                return self.underlying.read(size)
+
+        chunks: List[bytes] = []
+        while size > 0:
+            chunk = os.pread(self._fd, size, offset)  # type: ignore
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+            offset += len(chunk)
+        return b''.join(chunks)
+
+
+class SplitFragmentIO(FragmentIO):
+    """`FragmentIO` for a block stored in two places of the `underlying`
+    stream: the first `head_length` bytes at `head_start`, and the rest
+    at `body_start`.
+
+    With a `PositionalReader` the bytes are read by `read_at`, as in
+    `PositionalFragmentIO`.
+    """
+
+    def __init__(self, underlying: BinaryIO,
+                 head_start: int, head_length: int,
+                 body_start: int, length: int,
+                 reader: Optional[PositionalReader] = None):
+        # the local position N is at `start + N` for the body bytes
+        super().__init__(underlying, body_start - head_length, length)
+        self.head_start = head_start
+        self.head_length = head_length
+        self.reader = reader
+
+    def _read_at(self, offset: int, size: int) -> bytes:
+        local = offset - self.start
+        if local >= self.head_length:
+            return self._read_underlying(offset, size)
+        head_size = min(size, self.head_length - local)
+        head = self._read_underlying(self.head_start + local, head_size)
+        if head_size == size:
+            return head
+        return head + self._read_underlying(offset + head_size,
+                                            size - head_size)
+
+    def _read_underlying(self, offset: int, size: int) -> bytes:
+        if self.reader is not None:
+            return self.reader.read_at(offset, size)
+        return super()._read_at(offset, size)
+
+
+class PositionalFragmentIO(FragmentIO):
+    """`FragmentIO` that never changes the position of the underlying stream.
+
+    Each instance keeps its own local position, and the bytes are read
+    with `PositionalReader.read_at`. Fragments of the same stream can be
+    read concurrently from different threads.
+    """
+
+    def __init__(self, reader: PositionalReader, start: int, length: int):
+        super().__init__(reader.underlying, start, length)
+        self.reader = reader
+
+    def _read_at(self, offset: int, size: int) -> bytes:
+        return self.reader.read_at(offset, size)
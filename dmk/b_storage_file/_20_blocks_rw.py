@@ -2,24 +2,77 @@
 # SPDX-License-Identifier: MIT
 
 
+"""The blocks follow each other. Each block is `cluster_size` bytes.
+
+With the imprint table, the first `BLOCK_PREFIX_SIZE` bytes of the blocks
+(the nonce and the imprint) are stored apart from the rest:
+
+    BODIES    (cluster size - 44 bytes each)
+    TABLE     (44 bytes each)
+    TAIL
+
+To find the blocks of a name, we only need to read the table. It is a
+small contiguous part of the file, so a scan does not touch every page of
+the file. The table is placed after the bodies, because the number of
+blocks is unknown until all of them are written.
+
+The total size is the same in both cases, so the number of blocks is
+computed from the file size.
+"""
+
 from __future__ import annotations
 
 import io
 import random
-from typing import BinaryIO, Optional, Iterable
+import shutil
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Optional, Iterable, Iterator, NamedTuple
 
 from Crypto.Random import get_random_bytes
 
-from dmk._common import read_or_fail, CLUSTER_SIZE
-from dmk.b_storage_file._10_fragment_io import FragmentIO
+from dmk._common import read_or_fail, CLUSTER_SIZE, BLOCK_PREFIX_SIZE, \
+    InsufficientData
+from dmk.a_utils.fadvise import fadvise, SEQUENTIAL, NORMAL, RANDOM, \
+    WILLNEED
+from dmk.b_storage_file._10_fragment_io import FragmentIO, \
+    PositionalReader, PositionalFragmentIO, SplitFragmentIO
+
+# the table is kept in memory while it is smaller than this, and moved
+# to a temporary file otherwise
+TABLE_SPOOL_SIZE = 1024 * 1024
+
+# the table entries are read by this number at once
+TABLE_CHUNK_ENTRIES = 4096
+
+
+class SizeBand(NamedTuple):
+    """The number of blocks the vault should have. The updates add fewer
+    fakes when the vault is larger than `max_blocks`, and more of them when
+    it is smaller than `min_blocks` (see `c_namegroups._update.FakeDeltas`).
+    Zero means no limit."""
+    min_blocks: int = 0
+    max_blocks: int = 0
 
 
 class BlocksSequentialWriter:
 
-    def __init__(self, target_io: BinaryIO):
+    def __init__(self, target_io: BinaryIO,
+                 cluster_size: int = CLUSTER_SIZE,
+                 imprint_table: bool = False,
+                 keyed_placement: bool = False,
+                 size_band: SizeBand = SizeBand()):
         self.target_io = target_io
+        self.cluster_size = cluster_size
+        self.imprint_table = imprint_table
+        # the order of the blocks and the number of the fakes are chosen by
+        # the caller, we only keep the settings for it
+        self.keyed_placement = keyed_placement
+        self.size_band = size_band
         self._next_blob: Optional[bytes] = None
         self._tail_written = False
+        # the block prefixes waiting to be written after the last block
+        self._table: Optional[BinaryIO] = SpooledTemporaryFile(  # type: ignore
+            max_size=TABLE_SPOOL_SIZE) if imprint_table else None
 
     def __enter__(self):
         # todo remove
@@ -31,10 +84,15 @@ class BlocksSequentialWriter:
     def write_bytes(self, buffer: bytes):
         if self._tail_written:
             raise RuntimeError("Cannot run this after tail written")
-        if len(buffer) != CLUSTER_SIZE:
+        if len(buffer) != self.cluster_size:
             raise ValueError("Unexpected length")
 
-        self.target_io.write(buffer)
+        if self._table is not None:
+            view = memoryview(buffer)
+            self._table.write(view[:BLOCK_PREFIX_SIZE])
+            self.target_io.write(view[BLOCK_PREFIX_SIZE:])
+        else:
+            self.target_io.write(buffer)
 
     def write_io(self, source_io: BinaryIO, size: int):
         # todo chunks
@@ -45,27 +103,56 @@ class BlocksSequentialWriter:
         if self._tail_written:
             raise RuntimeError("Cannot run this after tail written")
 
-        tail = get_random_bytes(random.randint(1, CLUSTER_SIZE - 1))
-        assert 1 <= len(tail) < CLUSTER_SIZE
+        if self._table is not None:
+            self._table.seek(0, io.SEEK_SET)
+            shutil.copyfileobj(self._table, self.target_io,
+                               TABLE_CHUNK_ENTRIES * BLOCK_PREFIX_SIZE)
+            self._table.close()
+
+        tail = get_random_bytes(random.randint(1, self.cluster_size - 1))
+        assert 1 <= len(tail) < self.cluster_size
         self.target_io.write(tail)
         self._tail_written = True
 
 
 class BlocksIndexedReader:
+    """Random access to the blocks of the `source_io`.
+
+    By default, the blocks are read with `seek` + `read`, so the reader
+    must not be used from multiple threads. With `positional=True` the
+    blocks are read with `os.pread` (see `PositionalReader`), and the same
+    reader can serve concurrent lookups.
+
+    With `imprint_table=True` the blocks are read from the layout with
+    the table (see the module docstring). The `io` of a block is the same
+    in both layouts.
+    """
 
-    def __init__(self, source_io: BinaryIO, close_stream=False):
+    def __init__(self, source_io: BinaryIO, close_stream=False,
+                 positional=False, cluster_size: int = CLUSTER_SIZE,
+                 imprint_table: bool = False,
+                 keyed_placement: bool = False):
 
         self.source_io = source_io
+        self.cluster_size = cluster_size
         self.close_stream = close_stream
+        self._positional: Optional[PositionalReader] = \
+            PositionalReader(source_io) if positional else None
 
         # The blobs list must start at the current stream position.
         # But not necessarily from the beginning of the stream.
 
         self._start_pos = self.source_io.tell()
         self._io_size = self.source_io.seek(0, io.SEEK_END)
-        self._len = (self._io_size - self._start_pos) // CLUSTER_SIZE
+        self._len = (self._io_size - self._start_pos) // cluster_size
         self.source_io.seek(self._start_pos, io.SEEK_SET)
 
+        self.imprint_table = imprint_table
+        self.keyed_placement = keyed_placement
+        self._body_size = cluster_size - BLOCK_PREFIX_SIZE \
+            if imprint_table else cluster_size
+        self._table_pos = self._start_pos + self._len * self._body_size
+
     def __enter__(self):
         return self
 
@@ -78,7 +165,14 @@ class BlocksIndexedReader:
 
     @property
     def tail_size(self):
-        return (self._io_size - self._start_pos) - len(self) * CLUSTER_SIZE
+        return (self._io_size - self._start_pos) \
+            - len(self) * self.cluster_size
+
+    @property
+    def tail_pos(self) -> int:
+        """The position after the blocks (and after the table, if any).
+        Without the table, the new blocks can be appended here."""
+        return self._start_pos + len(self) * self.cluster_size
 
     def io(self, idx: int) -> FragmentIO:
 
@@ -87,10 +181,74 @@ class BlocksIndexedReader:
         if idx >= len(self):
             raise IndexError(f"Must not be larger than {len(self)}")
 
-        return FragmentIO(self.source_io,
-                          self._start_pos + idx * CLUSTER_SIZE,
-                          CLUSTER_SIZE)
+        start = self._start_pos + idx * self._body_size
+        if self.imprint_table:
+            return SplitFragmentIO(self.source_io,
+                                   self._table_pos + idx * BLOCK_PREFIX_SIZE,
+                                   BLOCK_PREFIX_SIZE,
+                                   start,
+                                   self.cluster_size,
+                                   reader=self._positional)
+        if self._positional is not None:
+            return PositionalFragmentIO(self._positional, start,
+                                        self.cluster_size)
+        return FragmentIO(self.source_io, start, self.cluster_size)
+
+    @property
+    def positional(self) -> bool:
+        return self._positional is not None
 
     def __iter__(self) -> Iterable[FragmentIO]:
         for i in range(len(self)):
             yield self.io(i)
+
+    def prefixes(self, start: int = 0) -> Iterator[bytes]:
+        """The first `BLOCK_PREFIX_SIZE` bytes of each block, in order,
+        starting from the block `start`.
+
+        With the imprint table, they are read from the table by large
+        chunks. Otherwise, each of them is read from its block, and the OS
+        is told that the file is read sequentially."""
+        if not self.imprint_table:
+            offset = self._start_pos + start * self.cluster_size
+            length = (len(self) - start) * self.cluster_size
+            fadvise(self.source_io, SEQUENTIAL, offset, length)
+            try:
+                for i in range(start, len(self)):
+                    yield self.io(i).read(BLOCK_PREFIX_SIZE)
+            finally:
+                # the blocks found by the scan are read in random order.
+                # Only the scanned range is reset: the reader may be shared
+                # with the other scans
+                fadvise(self.source_io, NORMAL, offset, length)
+            return
+
+        fadvise(self.source_io, WILLNEED,
+                self._table_pos + start * BLOCK_PREFIX_SIZE,
+                (len(self) - start) * BLOCK_PREFIX_SIZE)
+        for first in range(start, len(self), TABLE_CHUNK_ENTRIES):
+            num = min(TABLE_CHUNK_ENTRIES, len(self) - first)
+            chunk = self._read_at(self._table_pos + first * BLOCK_PREFIX_SIZE,
+                                  num * BLOCK_PREFIX_SIZE)
+            if len(chunk) != num * BLOCK_PREFIX_SIZE:
+                raise InsufficientData
+            for i in range(num):
+                yield chunk[i * BLOCK_PREFIX_SIZE:(i + 1) * BLOCK_PREFIX_SIZE]
+
+    def will_read(self, indices: Iterable[int]):
+        """Tells the OS that the blocks will be read soon, so it can read
+        all of them at once, instead of waiting for each one."""
+        for idx in indices:
+            fadvise(self.source_io, WILLNEED,
+                    self._start_pos + idx * self._body_size, self._body_size)
+
+    def random_access(self):
+        """Tells the OS that the blocks will be read in random order (by
+        a rewrite), so reading ahead of them is useless."""
+        fadvise(self.source_io, RANDOM)
+
+    def _read_at(self, offset: int, size: int) -> bytes:
+        if self._positional is not None:
+            return self._positional.read_at(offset, size)
+        self.source_io.seek(offset, io.SEEK_SET)
+        return self.source_io.read(size)
@@ -4,15 +4,53 @@
 
 """The vault file consists of a header and a list of blocks following it.
 Blocks contain encrypted data. We are not trying to interpret this data here.
-We only write wrote and read header and the blocks."""
+We only write wrote and read header and the blocks.
+
+Format version 1:
+
+    VERSION   (2 bytes)   See `version_to_bytes`
+    SALT      (38 bytes)
+    BLOCKS    (4096 bytes each)
+    TAIL      (1..4095 random bytes)
+
+Format version 2 is the same, but with the LAYOUT byte after the version.
+The lower 4 bits of the layout are the cluster size: 4096 << N. The bit 4
+is set when the blocks are stored with the imprint table (see
+`_20_blocks_rw`). The bit 5 is set when the blocks are placed by the keys
+(see `c_namegroups._placement`). The bit 6 is set when the vault has a size
+band (see `SizeBand`). Other bits are reserved and zero. The byte is XOR-ed
+with the first version byte, so it is not constant. This hides nothing: the
+version byte is stored openly, and anyone can unmask the layout. Only 72 of
+256 values are valid, so a version 2 file is easier to tell from random data
+than a version 1 file.
+
+    VERSION   (2 bytes)
+    LAYOUT    (1 byte)
+    SALT      (38 bytes)
+    BAND      (8 bytes, only with the bit 6 of the LAYOUT)
+    BLOCKS    (cluster size each)
+    TAIL      (1..cluster size-1 random bytes)
+
+The BAND is two uint32: the minimum and the maximum number of blocks. It is
+XOR-ed with a hash of the salt. The salt is stored openly, so anyone can
+read the band. And once unmasked, the band is easy to recognize: the high
+bytes of the numbers are usually zero, and the minimum is not larger than
+the maximum. There is no secret shared by all the names to mask it with.
+
+The version 1 is written for the vaults with the default layout, so they
+can be read by the older versions of the utility.
+"""
 
 import io
 import random
-from typing import BinaryIO
+from typing import BinaryIO, NamedTuple, Optional, Iterator
 
-from dmk._common import KEY_SALT_SIZE, read_or_fail
+from Crypto.Hash import BLAKE2s
+
+from dmk._common import KEY_SALT_SIZE, read_or_fail, CLUSTER_SIZE, \
+    MIN_CLUSTER_SIZE, check_cluster_size
 from dmk.b_storage_file._20_blocks_rw import BlocksSequentialWriter, \
-    BlocksIndexedReader
+    BlocksIndexedReader, SizeBand
 
 
 def version_to_bytes(ver: int) -> bytes:
@@ -41,17 +79,119 @@ def bytes_to_version(data: bytes) -> int:
 
 
 BLOCKS_START_POS = 40
+BLOCKS_START_POS_V2 = 41
+BAND_SIZE = 8
+
+LAYOUT_CLUSTER_BITS = 0x0F
+LAYOUT_IMPRINT_TABLE_BIT = 0x10
+LAYOUT_KEYED_PLACEMENT_BIT = 0x20
+LAYOUT_SIZE_BAND_BIT = 0x40
+
+MAX_BAND_BLOCKS = 0xFFFFFFFF
+
+
+class Layout(NamedTuple):
+    """How the blocks are stored. It is chosen when the vault is created.
+
+    The `min_blocks` and `max_blocks` are the size band (see `SizeBand`).
+    Zero means no limit."""
+    cluster_size: int = CLUSTER_SIZE
+    imprint_table: bool = False
+    keyed_placement: bool = False
+    min_blocks: int = 0
+    max_blocks: int = 0
+
+    @property
+    def size_band(self) -> SizeBand:
+        return SizeBand(self.min_blocks, self.max_blocks)
+
+
+def check_size_band(min_blocks: int, max_blocks: int) -> SizeBand:
+    if not (0 <= min_blocks <= MAX_BAND_BLOCKS
+            and 0 <= max_blocks <= MAX_BAND_BLOCKS):
+        raise ValueError(f"The number of blocks must be from 0 "
+                         f"to {MAX_BAND_BLOCKS}")
+    if max_blocks and min_blocks > max_blocks:
+        raise ValueError(f"The minimum {min_blocks} is larger than "
+                         f"the maximum {max_blocks}")
+    return SizeBand(min_blocks, max_blocks)
+
+
+def _band_mask(salt: bytes) -> bytes:
+    h_obj = BLAKE2s.new(digest_bits=BAND_SIZE * 8)
+    h_obj.update(salt + b'size band')
+    return h_obj.digest()
+
+
+def band_to_bytes(band: SizeBand, salt: bytes) -> bytes:
+    data = band.min_blocks.to_bytes(4, 'big') \
+           + band.max_blocks.to_bytes(4, 'big')
+    return bytes(a ^ b for a, b in zip(data, _band_mask(salt)))
+
+
+def bytes_to_band(data: bytes, salt: bytes) -> SizeBand:
+    data = bytes(a ^ b for a, b in zip(data, _band_mask(salt)))
+    return check_size_band(int.from_bytes(data[:4], 'big'),
+                           int.from_bytes(data[4:], 'big'))
+
+
+def layout_to_byte(layout: Layout, mask: int) -> bytes:
+    exponent = check_cluster_size(layout.cluster_size).bit_length() \
+               - MIN_CLUSTER_SIZE.bit_length()
+    assert MIN_CLUSTER_SIZE << exponent == layout.cluster_size
+    assert exponent & LAYOUT_CLUSTER_BITS == exponent
+    value = exponent
+    if layout.imprint_table:
+        value |= LAYOUT_IMPRINT_TABLE_BIT
+    if layout.keyed_placement:
+        value |= LAYOUT_KEYED_PLACEMENT_BIT
+    if layout.size_band != SizeBand():
+        value |= LAYOUT_SIZE_BAND_BIT
+    return bytes((value ^ mask,))
+
+
+def byte_to_layout(data: bytes, mask: int) -> Layout:
+    """The layout without the size band. The band is read separately,
+    if `has_size_band` is true."""
+    value = data[0] ^ mask
+    if value & ~(LAYOUT_CLUSTER_BITS | LAYOUT_IMPRINT_TABLE_BIT
+                 | LAYOUT_KEYED_PLACEMENT_BIT | LAYOUT_SIZE_BAND_BIT):
+        raise ValueError(f"Unexpected layout: {value}")
+    return Layout(
+        cluster_size=check_cluster_size(
+            MIN_CLUSTER_SIZE << (value & LAYOUT_CLUSTER_BITS)),
+        imprint_table=bool(value & LAYOUT_IMPRINT_TABLE_BIT),
+        keyed_placement=bool(value & LAYOUT_KEYED_PLACEMENT_BIT))
+
+
+def has_size_band(data: bytes, mask: int) -> bool:
+    return bool((data[0] ^ mask) & LAYOUT_SIZE_BAND_BIT)
 
 
 class StorageFileWriter:
     def __init__(self,
                  output_io: BinaryIO,
-                 salt: bytes):
+                 salt: bytes,
+                 cluster_size: int = CLUSTER_SIZE,
+                 imprint_table: bool = False,
+                 keyed_placement: bool = False,
+                 min_blocks: int = 0,
+                 max_blocks: int = 0):
         if output_io.seek(0, io.SEEK_CUR) != 0:
             raise ValueError("Unexpected stream position")
 
-        # the first ever file format has version number 1
-        output_io.write(version_to_bytes(1))
+        check_cluster_size(cluster_size)
+        check_size_band(min_blocks, max_blocks)
+        self.layout = Layout(cluster_size, imprint_table, keyed_placement,
+                             min_blocks, max_blocks)
+        # the first ever file format has version number 1. We still use it
+        # when possible
+        self.version = 1 if self.layout == Layout() else 2
+
+        version_bytes = version_to_bytes(self.version)
+        output_io.write(version_bytes)
+        if self.version >= 2:
+            output_io.write(layout_to_byte(self.layout, version_bytes[0]))
 
         # WRITING SALT (32 BYTES)
 
@@ -59,10 +199,27 @@ class StorageFileWriter:
             raise ValueError("Unexpected salt size")
         output_io.write(salt)
 
-        assert output_io.tell() == BLOCKS_START_POS, output_io.tell()
+        assert output_io.tell() == (BLOCKS_START_POS if self.version == 1
+                                    else BLOCKS_START_POS_V2), \
+            output_io.tell()
+
+        if self.layout.size_band != SizeBand():
+            output_io.write(band_to_bytes(self.layout.size_band, salt))
 
         # READY TO WRITE BLOBS
-        self.blobs = BlocksSequentialWriter(output_io)
+        self.blobs = BlocksSequentialWriter(output_io,
+                                            cluster_size=cluster_size,
+                                            imprint_table=imprint_table,
+                                            keyed_placement=keyed_placement,
+                                            size_band=self.layout.size_band)
+
+    @property
+    def cluster_size(self) -> int:
+        return self.layout.cluster_size
+
+    @property
+    def imprint_table(self) -> bool:
+        return self.layout.imprint_table
 
     def __enter__(self):
         # todo remove
@@ -73,22 +230,105 @@ class StorageFileWriter:
         # self.blobs.close()
 
 
+class FileHeader(NamedTuple):
+    version: int
+    layout: Layout
+    salt: bytes
+
+
+def read_header(input_io: BinaryIO) -> FileHeader:
+    """Reads the header up to the first block. The stream is only read, so
+    it may be a pipe."""
+    version_bytes = read_or_fail(input_io, 2)
+    version = bytes_to_version(version_bytes)
+    if version == 1:
+        layout = Layout()
+    elif version == 2:
+        layout_byte = read_or_fail(input_io, 1)
+        layout = byte_to_layout(layout_byte, version_bytes[0])
+    else:
+        raise ValueError(f"Unexpected version: {version}")
+
+    # READING SALT
+
+    salt = read_or_fail(input_io, KEY_SALT_SIZE)
+
+    if version == 2 and has_size_band(layout_byte, version_bytes[0]):
+        band = bytes_to_band(read_or_fail(input_io, BAND_SIZE), salt)
+        layout = layout._replace(min_blocks=band.min_blocks,
+                                 max_blocks=band.max_blocks)
+    return FileHeader(version, layout, salt)
+
+
 class StorageFileReader:
     def __init__(self,
-                 input_io: BinaryIO):
+                 input_io: BinaryIO,
+                 positional: bool = False):
         if input_io.seek(0, io.SEEK_CUR) != 0:
             raise ValueError("Unexpected stream position")
 
-        ver = bytes_to_version(read_or_fail(input_io, 2))
-        if ver != 1:
-            raise ValueError(f"Unexpected version: {ver}")
+        self.version, self.layout, self.salt = read_header(input_io)
+
+        # READY TO READ BLOBS
 
-        # READING SALT
+        self.blobs = BlocksIndexedReader(
+            input_io, positional=positional,
+            cluster_size=self.layout.cluster_size,
+            imprint_table=self.layout.imprint_table,
+            keyed_placement=self.layout.keyed_placement)
 
-        self.salt = read_or_fail(input_io, KEY_SALT_SIZE)
+    @property
+    def cluster_size(self) -> int:
+        return self.layout.cluster_size
 
-        assert input_io.tell() == BLOCKS_START_POS, input_io.tell()
+    @property
+    def imprint_table(self) -> bool:
+        return self.layout.imprint_table
+
+
+class StorageStreamReader:
+    """Reads the vault from a stream that cannot seek, like a pipe.
+
+    The number of blocks is unknown until the end of the stream, so the
+    blocks are read once, in order (see `blocks`), and the last incomplete
+    cluster is the tail. The vaults with the imprint table cannot be read
+    this way: their imprints follow all the blocks."""
+
+    def __init__(self, input_io: BinaryIO):
+        self.version, self.layout, self.salt = read_header(input_io)
+        if self.layout.imprint_table:
+            raise ValueError("A vault with the imprint table cannot be "
+                             "read from a stream")
+        self._input_io: Optional[BinaryIO] = input_io
+        self.tail_size: Optional[int] = None
+
+    @property
+    def cluster_size(self) -> int:
+        return self.layout.cluster_size
+
+    def blocks(self) -> Iterator[bytes]:
+        """Each block whole. Can be called only once."""
+        input_io = self._input_io
+        if input_io is None:
+            raise ValueError("The blocks were already read")
+        self._input_io = None
+        while True:
+            block = _read_up_to(input_io, self.cluster_size)
+            if len(block) < self.cluster_size:
+                self.tail_size = len(block)
+                return
+            yield block
 
-        # READY TO READ BLOBS
 
-        self.blobs = BlocksIndexedReader(input_io)
+def _read_up_to(input_io: BinaryIO, size: int) -> bytes:
+    """Exactly `size` bytes, or less at the end of the stream. Unlike
+    `read`, does not return less when the pipe is not full yet."""
+    chunks = []
+    left = size
+    while left > 0:
+        chunk = input_io.read(left)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        left -= len(chunk)
+    return b''.join(chunks)
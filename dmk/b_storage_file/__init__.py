@@ -3,5 +3,6 @@
 
 
 from ._20_blocks_rw import BlocksIndexedReader, \
-    BlocksSequentialWriter
-from ._30_storage_file import StorageFileWriter, StorageFileReader
+    BlocksSequentialWriter, SizeBand
+from ._30_storage_file import StorageFileWriter, StorageFileReader, Layout, \
+    StorageStreamReader, check_size_band
@@ -2,5 +2,5 @@
 # SPDX-License-Identifier: MIT
 
 
-from ._namegroup import NameGroup, NameGroupItem
-from ._update import update_namegroup_b
+from ._namegroup import NameGroup, NameGroupItem, scan_name_groups
+from ._update import update_namegroup_b, update_namegroups_b
@@ -0,0 +1,149 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Appending the new content instead of rewriting the vault.
+
+The blocks that are already in the file stay where they are. The new
+blocks of the names, mixed with a few fakes of the same names, are written
+after them, in place of the old tail. So a write costs as much as the new
+content, whatever the vault size.
+
+The outdated content is not removed: `NameGroup` finds the newest complete
+version. When a name has too many outdated blocks (see `needs_compaction`),
+its next write is a regular rewrite by `update_namegroups_b`, that removes
+a random part of them and shuffles all the blocks again.
+
+Unlike the rewrite, appending shows which blocks were written last, and
+keeps the outdated versions in the file until the compaction.
+"""
+
+import random
+from typing import Sequence, Tuple, BinaryIO, List, Union
+
+from dmk._common import max_cluster_content_size
+from dmk.a_base import CodenameKey
+from dmk.a_utils.counters import count
+from dmk.a_utils.spans import span
+from dmk.b_cryptoblobs import MultipartEncryptor
+from dmk.b_cryptoblobs._30_encdec_multipart import split_cluster_sizes
+from dmk.b_storage_file import BlocksSequentialWriter, SizeBand
+from dmk.c_namegroups._delta import reusable_parts, write_manifest
+from dmk.c_namegroups._namegroup import NameGroup
+from dmk.c_namegroups._update import TaskEncrypt, TaskFake, TaskManifest, \
+    add_fake, write_encrypted, get_stream_size
+from dmk.c_namegroups.content_ver import increased_data_version
+
+# the outdated content blocks of a name allowed per block of its new content
+COMPACT_RATIO = 4
+
+# each write appends from one to this number of fakes (or to the number of
+# the new content blocks, if it is larger)
+MIN_MAX_FAKES = 3
+
+
+def _new_blocks_num(new_content_io: BinaryIO, cluster_size: int) -> int:
+    return len(split_cluster_sizes(get_stream_size(new_content_io),
+                                   max_cluster_content_size(cluster_size)))
+
+
+def needs_compaction(name_group: NameGroup, new_content_io: BinaryIO,
+                     cluster_size: int,
+                     ratio: float = COMPACT_RATIO) -> bool:
+    """Whether the write of the name should rewrite the vault instead of
+    appending."""
+    new_blocks_num = _new_blocks_num(new_content_io, cluster_size)
+    outdated = sum(1 for item in name_group.items if not item.is_fake)
+    return outdated >= ratio * new_blocks_num
+
+
+def _fakes_num(max_fakes: int, old_blocks_num: int, band: SizeBand) -> int:
+    if band.min_blocks and old_blocks_num < band.min_blocks:
+        return max_fakes
+    return random.randint(1, max_fakes)
+
+
+def exceeds_max_size(old_blocks_num: int,
+                     new_contents: Sequence[BinaryIO],
+                     cluster_size: int, band: SizeBand) -> bool:
+    """Whether appending the `new_contents` may make the vault larger
+    than its band. Then it must be rewritten instead."""
+    if not band.max_blocks:
+        return False
+    # the content blocks, the manifest and the fakes at most
+    most_blocks = 0
+    for new_content_io in new_contents:
+        blocks = _new_blocks_num(new_content_io, cluster_size) + 1
+        most_blocks += blocks + max(MIN_MAX_FAKES, blocks)
+    return old_blocks_num + most_blocks > band.max_blocks
+
+
+def append_namegroups_b(updates: Sequence[Tuple[CodenameKey, BinaryIO]],
+                        name_groups: Sequence[NameGroup],
+                        new_blobs: BlocksSequentialWriter,
+                        delta: bool = False,
+                        old_blocks_num: int = 0) -> List[List[int]]:
+    """Writes the new content of the names to `new_blobs`, that is
+    positioned after the old blocks. The `name_groups` must contain all
+    the blocks of the names.
+
+    With `delta=True` only the changed parts are appended, along with the
+    manifest (see `c_namegroups._delta`).
+
+    The `old_blocks_num` is compared to the size band of the `new_blobs`:
+    a vault below its minimum gets the most fakes. The appends cannot
+    shrink the vault, so a vault near its maximum must be rewritten instead
+    (see `exceeds_max_size`).
+
+    Returns, for each name, the indices of its new blocks relative to the
+    first appended block."""
+    if len(set(cdk.as_bytes for cdk, _ in updates)) != len(updates):
+        raise ValueError("The keys are not unique")
+    assert len(name_groups) == len(updates)
+
+    with span('append') as s:
+        tasks: List[Union[TaskEncrypt, TaskManifest, TaskFake]] = []
+        encryptors: List[MultipartEncryptor] = []
+        reused_parts = []
+        for group_idx, ((cdk, new_content_io), name_group) in \
+                enumerate(zip(updates, name_groups)):
+            encryptor = MultipartEncryptor(
+                cdk, new_content_io,
+                increased_data_version(name_group.all_content_versions),
+                cluster_size=new_blobs.cluster_size)
+            encryptors.append(encryptor)
+            parts_num = len(encryptor.part_sizes)
+            count('bytes_set', sum(encryptor.part_sizes))
+            reused = reusable_parts(name_group, encryptor) if delta \
+                else dict()
+            reused_parts.append(reused)
+            new_tasks: List[Union[TaskEncrypt, TaskManifest, TaskFake]] = [
+                TaskEncrypt(part_idx, group_idx)
+                for part_idx in range(parts_num) if part_idx not in reused]
+            if reused:
+                new_tasks.append(TaskManifest(group_idx))
+            tasks.extend(new_tasks)
+            tasks.extend(TaskFake(group_idx) for _ in range(
+                _fakes_num(max(MIN_MAX_FAKES, len(new_tasks)),
+                           old_blocks_num, new_blobs.size_band)))
+
+        random.shuffle(tasks)
+        positions: List[List[int]] = [[] for _ in updates]
+        for pos, task in enumerate(tasks):
+            positions[task.group_idx].append(pos)
+            if isinstance(task, TaskFake):
+                add_fake(updates[task.group_idx][0], new_blobs)
+            elif isinstance(task, TaskManifest):
+                write_manifest(updates[task.group_idx][0],
+                               encryptors[task.group_idx],
+                               reused_parts[task.group_idx], new_blobs)
+            else:
+                write_encrypted(encryptors[task.group_idx], task.part_idx,
+                                new_blobs)
+        new_blobs.write_tail()
+        assert all(len(e.encrypted_indices) + len(r) == len(e.part_sizes)
+                   for e, r in zip(encryptors, reused_parts))
+
+        s.add('blocks', len(tasks))
+        s.add('bytes_written', len(tasks) * new_blobs.cluster_size)
+        return positions
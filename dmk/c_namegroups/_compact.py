@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Rebuilding the vault with only the fresh content of the given names.
+
+The vault does not know its names, so everything else looks like garbage
+here: the outdated content, the fakes, the dummy blocks and the content of
+the names that are not listed. All of it is dropped. The fresh blocks are
+copied as they are, without decrypting them. Each name gets a few new
+fakes, and the rest of the new vault is new dummy blocks.
+"""
+
+import random
+import time
+from itertools import islice
+from typing import Sequence, List
+
+from dmk.a_base import CodenameKey
+from dmk.a_utils.spans import span
+from dmk.b_cryptoblobs._20_encdec_part import to_imprint, \
+    ENCRYPTION_NONCE_LEN
+from dmk.b_storage_file import BlocksIndexedReader, BlocksSequentialWriter
+from dmk.c_namegroups._append import MIN_MAX_FAKES
+from dmk.c_namegroups._namegroup import NameGroup
+from dmk.c_namegroups._update import TaskCopy, TaskFake, add_fake, \
+    copy_block, keyed_order
+
+# the scan time is measured on this number of blocks at most
+SCAN_SAMPLE_BLOCKS = 4096
+
+
+def min_compacted_blocks(name_groups: Sequence[NameGroup]) -> int:
+    """The fresh blocks of the names and one fake for each of them."""
+    return sum(sum(1 for item in ng.items if item.is_fresh_data) + 1
+               for ng in name_groups)
+
+
+def compact_namegroups_b(name_groups: Sequence[NameGroup],
+                         dummy_cdk: CodenameKey,
+                         old_blobs: BlocksIndexedReader,
+                         new_blobs: BlocksSequentialWriter,
+                         blocks_num: int):
+    """Writes `blocks_num` blocks to `new_blobs`: the fresh blocks of the
+    `name_groups` copied from `old_blobs`, the fakes of the names, and the
+    fakes of the `dummy_cdk`. The `name_groups` must contain all the blocks
+    of the names, as found by a scan.
+
+    Raises `ValueError` if `blocks_num` is less than
+    `min_compacted_blocks`."""
+    if blocks_num < min_compacted_blocks(name_groups):
+        raise ValueError(f"At least {min_compacted_blocks(name_groups)} "
+                         f"blocks are needed")
+    with span('compact') as s:
+        tasks: List[object] = []
+        fakes_num: List[int] = []
+        for group_idx, ng in enumerate(name_groups):
+            fresh = [item for item in ng.items if item.is_fresh_data]
+            tasks.extend(TaskCopy(item.idx, item.dio.header.part_idx,
+                                  group_idx) for item in fresh)
+            fakes_num.append(random.randint(1, max(MIN_MAX_FAKES,
+                                                   len(fresh))))
+        if len(tasks) + sum(fakes_num) > blocks_num:
+            fakes_num = [1] * len(name_groups)
+        for group_idx, num in enumerate(fakes_num):
+            tasks.extend(TaskFake(group_idx) for _ in range(num))
+        # the dummy blocks use the index past the names
+        dummy_idx = len(name_groups)
+        tasks.extend(TaskFake(dummy_idx)
+                     for _ in range(blocks_num - len(tasks)))
+        assert len(tasks) == blocks_num
+
+        cdks = [ng.cnk for ng in name_groups] + [dummy_cdk]
+        if new_blobs.keyed_placement:
+            ordered = keyed_order(tasks, cdks)
+        else:
+            ordered = list(tasks)
+            random.shuffle(ordered)
+        old_blobs.random_access()
+        for task in ordered:
+            if isinstance(task, TaskFake):
+                add_fake(cdks[task.group_idx], new_blobs)
+            elif isinstance(task, TaskCopy):
+                copy_block(old_blobs, task.old_block_idx, new_blobs)
+            else:
+                raise TypeError
+        new_blobs.write_tail()
+        s.add('blocks', blocks_num)
+        s.add('bytes_written', blocks_num * new_blobs.cluster_size)
+
+
+def estimate_scan_seconds(blobs: BlocksIndexedReader,
+                          cnk: CodenameKey) -> float:
+    """How long it takes to scan all the blocks for a single name. Only
+    `SCAN_SAMPLE_BLOCKS` are actually scanned, so this is an estimate."""
+    if not len(blobs):
+        return 0.0
+    started = time.perf_counter()
+    sampled = 0
+    for prefix in islice(blobs.prefixes(), SCAN_SAMPLE_BLOCKS):
+        to_imprint(cnk, prefix[:ENCRYPTION_NONCE_LEN])
+        sampled += 1
+    return (time.perf_counter() - started) * len(blobs) / sampled
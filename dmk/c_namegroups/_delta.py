@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Delta updates: the new content version reuses the unchanged parts of
+the fresh one.
+
+Only the changed parts are encrypted. The new version is assembled by its
+manifest block (see `encrypt_manifest`), that lists the versions of all
+the parts: the new ones and the kept ones.
+
+A part is kept when its size, its position (last or not) and the
+checksum in its header match the new part, and the decrypted data is the
+same.
+"""
+
+import zlib
+from typing import Dict, List
+
+from dmk.a_base import CodenameKey
+from dmk.a_utils.counters import count
+from dmk.b_cryptoblobs import MultipartEncryptor
+from dmk.b_cryptoblobs._30_encdec_multipart import encrypt_manifest
+from dmk.b_storage_file import BlocksSequentialWriter
+from dmk.c_namegroups._namegroup import NameGroup, NameGroupItem
+
+
+def reusable_parts(name_group: NameGroup,
+                   encryptor: MultipartEncryptor) -> Dict[int, NameGroupItem]:
+    """The blocks of the fresh content that contain the same data as the
+    parts of the new content, by the part index."""
+    parts_len = len(encryptor.part_sizes)
+    result: Dict[int, NameGroupItem] = dict()
+    for item in name_group.items:
+        if not item.is_fresh_data or item.dio.header.is_manifest:
+            continue
+        header = item.dio.header
+        part_idx = header.part_idx
+        if part_idx >= parts_len \
+                or header.part_size != encryptor.part_sizes[part_idx] \
+                or header.is_last_part != (part_idx == parts_len - 1):
+            continue
+        new_data = encryptor.part_data(part_idx)
+        if zlib.crc32(new_data) != header.content_crc32:
+            continue
+        if item.dio.read_data() != new_data:
+            continue
+        result[part_idx] = item
+    count('parts_reused', len(result))
+    return result
+
+
+def manifest_versions(encryptor: MultipartEncryptor,
+                      reused: Dict[int, NameGroupItem]) -> List[int]:
+    """The versions of the parts for the manifest of the new content."""
+    return [reused[part_idx].dio.header.data_version
+            if part_idx in reused else encryptor.content_version
+            for part_idx in range(len(encryptor.part_sizes))]
+
+
+def write_manifest(cdk: CodenameKey, encryptor: MultipartEncryptor,
+                   reused: Dict[int, NameGroupItem],
+                   new_blobs: BlocksSequentialWriter):
+    new_blobs.write_bytes(encrypt_manifest(
+        cdk, encryptor.content_version,
+        manifest_versions(encryptor, reused),
+        cluster_size=new_blobs.cluster_size))
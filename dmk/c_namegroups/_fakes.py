@@ -9,12 +9,12 @@ from dmk.a_base import CodenameKey
 from dmk.b_cryptoblobs._20_encdec_part import Encrypt
 
 
-def create_fake_bytes(pk: CodenameKey) -> bytes:
+def create_fake_bytes(pk: CodenameKey,
+                      cluster_size: int = CLUSTER_SIZE) -> bytes:
     with io.BytesIO() as temp_io:
-        Encrypt(cnk=pk).io_to_io(
+        Encrypt(cnk=pk, target_size=cluster_size).io_to_io(
             None,  # fake!
             temp_io)
-        temp_io.seek(0, io.SEEK_SET)
-        result = temp_io.read()
-        assert len(result) == CLUSTER_SIZE
+        result = temp_io.getvalue()
+        assert len(result) == cluster_size
         return result
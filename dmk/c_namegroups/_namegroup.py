@@ -2,10 +2,17 @@
 # SPDX-License-Identifier: MIT
 
 
-from typing import List, BinaryIO, Optional
+import itertools
+from typing import List, BinaryIO, Optional, Iterable, Sequence, Mapping
 
+from dmk._common import IMPRINT_SIZE
 from dmk.a_base import CodenameKey
+from dmk.a_utils.counters import count
+from dmk.a_utils.spans import span
 from dmk.b_cryptoblobs import DecryptedIO
+from dmk.b_cryptoblobs._30_encdec_multipart import parse_manifest
+from dmk.b_cryptoblobs._20_encdec_part import ENCRYPTION_NONCE_LEN, \
+    to_imprint, Header
 from dmk.b_storage_file import BlocksIndexedReader
 
 
@@ -29,9 +36,25 @@ class NameGroup:
     you know its code name (blobs are encrypted). Therefore, this object only
     finds and interprets blobs related to the name. The remaining blobs are
     ignored.
+
+    If `indices` are specified, only the blocks with these indices are
+    checked. This is useful when the indices are already known from
+    a previous scan of the same file. The `headers` known from that scan
+    are not decrypted again.
     """
 
-    def __init__(self, blobs: BlocksIndexedReader, cnk: CodenameKey):
+    def __init__(self, blobs: BlocksIndexedReader, cnk: CodenameKey,
+                 indices: Optional[Iterable[int]] = None,
+                 headers: Optional[Mapping[int, Header]] = None):
+        with span('namegroup') as s:
+            s.add('blocks', self.__init_items(blobs, cnk, indices,
+                                              headers or dict()))
+            s.add('matched', len(self.items))
+
+    def __init_items(self, blobs: BlocksIndexedReader, cnk: CodenameKey,
+                     indices: Optional[Iterable[int]],
+                     headers: Mapping[int, Header]) -> int:
+        """Returns the number of the checked blocks."""
         self.blobs = blobs
         self.cnk = cnk
         self._streams: List[BinaryIO] = []
@@ -42,34 +65,44 @@ class NameGroup:
 
         self.items: List[NameGroupItem] = []
 
-        for idx in range(len(self.blobs)):
+        scanning = indices is None
+        if indices is None:
+            # only the matched blocks will be read further
+            indices = find_imprints(self.blobs, [self.cnk])[0]
+
+        indices = list(indices)
+        # the headers of these blocks are read next
+        self.blobs.will_read(idx for idx in indices if idx not in headers)
+
+        checked = 0
+        for idx in indices:
+            checked += 1
             input_io = self.blobs.io(idx)
             assert input_io.tell() == 0
-            dio = DecryptedIO(self.cnk, input_io)
+            known_header = headers.get(idx)
+            dio = DecryptedIO(self.cnk, input_io, header=known_header)
             if not dio.belongs_to_namegroup:
                 continue
             assert dio.belongs_to_namegroup
+            if known_header is not None:
+                # the block was checked when the header was read
+                self.items.append(NameGroupItem(idx, dio))
+                continue
 
             # We have checked that the block belongs to this code name.
             # This assumption is wrong only in the case of a collision
             # of the 256-bit private keys or the 256-bit imprints.
             # We believe that any of these collisions are impossible.
             #
-            # But if speed is not a priority, we can double-check our belief
-            # in the absence of imprint collisions.
-
-            if dio.contains_data:
-                # checking CRC-32 of the decrypted body is ok
-                assert dio.data is not None
-            else:
-                # already checked 48-bit decrypted constant content_ver is ok,
-                # just recheck the property returns none
-                assert dio.data is None
+            # The bodies are not decrypted here: most of the matched blocks
+            # are old versions or fakes, and nobody reads them. The CRC-32
+            # of a body is checked by `DecryptedIO.read_data` when the body
+            # is actually read.
 
             gf = NameGroupItem(idx, dio)
             self.items.append(gf)
 
-        # Marking fakes
+        # Marking fakes. The manifests are neither fakes nor content
         for f in self.items:
             if not f.dio.contains_data:
                 f.is_fake = True
@@ -85,21 +118,33 @@ class NameGroup:
         # of the mentioned content versions, but the maximum with a full
         # set of parts.
         #
-        # For format version 2, this problem does not exist: now we are
-        # completely rewriting the entire file with all the blobs, and this
-        # is an "atomic" operation. Only after saving all the parts, we give
-        # the file a final name.
-        #
-        # However, this code is kept here just in case. Who knows, maybe the
-        # next versions will update the file instead of rewriting it, and
-        # and incomplete saving will be possible again.
-
-        all_content_files = [gf for gf in self.items if gf.dio.contains_data]
+        # For format version 2, a rewrite is an "atomic" operation: only
+        # after saving all the parts, we give the file a final name. But the
+        # append writes (see `_append`) change the file in place: the new
+        # blocks are written over the old tail. If the writing is
+        # interrupted, only some parts of the new version are in the file.
+        # So this check is required again: the incomplete version is
+        # skipped, and the previous complete one is returned.
+
+        all_content_files = [gf for gf in self.items if gf.dio.contains_data
+                             and not gf.dio.header.is_manifest]
+        manifests = {gf.dio.header.data_version: gf for gf in self.items
+                     if gf.dio.contains_data and gf.dio.header.is_manifest}
         self.all_content_versions = set(gf.dio.header.data_version
                                         for gf in all_content_files)
+        self.all_content_versions.update(manifests.keys())
 
         # trying versions from maximum to minimum
         for ver in sorted(self.all_content_versions, reverse=True):
+            if ver in manifests:
+                files_by_manifest = self.__manifest_files(
+                    manifests[ver], all_content_files)
+                if files_by_manifest is None:
+                    continue
+                for gf in files_by_manifest + [manifests[ver]]:
+                    gf.is_fresh_data = True
+                break
+
             files_by_ver = [gf for gf in all_content_files
                             if gf.dio.header.data_version == ver]
             last_part_idx: Optional[int] = next(
@@ -117,12 +162,94 @@ class NameGroup:
                     gf.is_fresh_data = True
                 break
 
+        return len(self.blobs) if scanning else checked
+
+    @staticmethod
+    def __manifest_files(manifest: NameGroupItem,
+                         content_files: List[NameGroupItem]) \
+            -> Optional[List[NameGroupItem]]:
+        """The parts listed in the manifest, or None if some of them
+        are missing."""
+        by_part_and_ver = {(gf.dio.header.part_idx,
+                            gf.dio.header.data_version): gf
+                           for gf in content_files}
+        part_versions = parse_manifest(manifest.dio.read_data())
+        result: List[NameGroupItem] = []
+        for part_idx, ver in enumerate(part_versions):
+            gf = by_part_and_ver.get((part_idx, ver))
+            if gf is None or gf.dio.header.is_last_part \
+                    != (part_idx == len(part_versions) - 1):
+                return None
+            result.append(gf)
+        return result
+
     def block_idx_to_item(self, idx: int) -> NameGroupItem:
         return next(gf for gf in self.items if gf.idx == idx)
 
+    def will_read_fresh_content(self):
+        """Tells the OS that the fresh content will be read whole (see
+        `BlocksIndexedReader.will_read`)."""
+        self.blobs.will_read(gf.idx for gf in self.items
+                             if gf.is_fresh_data
+                             and not gf.dio.header.is_manifest)
+
     @property
     def fresh_content_dios(self) -> List[DecryptedIO]:
         if self._fresh_content_dios is None:
             self._fresh_content_dios = [gf.dio for gf in self.items
-                                        if gf.is_fresh_data]
+                                        if gf.is_fresh_data
+                                        and not gf.dio.header.is_manifest]
         return self._fresh_content_dios
+
+    @property
+    def fresh_data_version(self) -> Optional[int]:
+        """The version of the fresh content, or None if there is no
+        content. With a manifest, it is the version of the manifest: the
+        kept parts have older ones."""
+        return max((gf.dio.header.data_version for gf in self.items
+                    if gf.is_fresh_data), default=None)
+
+
+def find_imprints(blobs: BlocksIndexedReader,
+                  cnks: Sequence[CodenameKey],
+                  prefetched: Sequence[bytes] = ()) -> List[List[int]]:
+    """For each of the `cnks` returns the indices of the blocks with the
+    matching imprint.
+
+    Each block is read only once: we read its nonce and imprint, and compare
+    the imprint with the imprints computed for every key. The `prefetched`
+    are the nonces and imprints of the first blocks, if they were already
+    read.
+    """
+    matched: List[List[int]] = [[] for _ in cnks]
+    if not cnks:
+        return matched
+    for idx, nonce_and_imprint in enumerate(itertools.chain(
+            prefetched, blobs.prefixes(start=len(prefetched)))):
+        nonce = nonce_and_imprint[:ENCRYPTION_NONCE_LEN]
+        imprint = nonce_and_imprint[ENCRYPTION_NONCE_LEN:]
+        for indices, cnk in zip(matched, cnks):
+            if to_imprint(cnk, nonce) == imprint:
+                indices.append(idx)
+    count('blocks_scanned', len(blobs))
+    count('imprint_hits', sum(len(indices) for indices in matched))
+    return matched
+
+
+def scan_name_groups(blobs: BlocksIndexedReader,
+                     cnks: Sequence[CodenameKey],
+                     prefetched: Sequence[bytes] = ()) -> List[NameGroup]:
+    """Finds the name groups for multiple code names in a single pass over
+    the blocks. Only the matched blocks are read further.
+
+    The results are in the same order as `cnks`.
+    """
+    with span('scan') as s:
+        matched = find_imprints(blobs, cnks, prefetched)
+        if cnks:
+            s.add('blocks', len(blobs))
+            s.add('bytes_read',
+                  len(blobs) * (ENCRYPTION_NONCE_LEN + IMPRINT_SIZE))
+
+        return [NameGroup(blobs, cnk, indices=indices)
+                for cnk, indices in zip(cnks, matched)]
@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Keyed placement of the blocks.
+
+In the vaults created with the keyed placement, the new content of a name
+is written to the slots (block indices) derived from its key. To find the
+content, we probe these few slots instead of scanning the whole vault.
+
+The slots of a name are a pseudo-random sequence of indices. Without the
+key, the order of the blocks is as random as with `random.shuffle`.
+
+The placement is a hint, not a rule. The probe is inconclusive when the
+slots do not contain complete content: the name does not exist, or its
+blocks were moved by the later writes of other names, or the vault grew
+over a power of two. Then we scan all the blocks as usual.
+
+Complete content found in the slots is always the fresh one: in these
+vaults each write removes all the outdated content blocks of the name
+(see `_update_namegroups_b`), so there are no other versions.
+"""
+
+from itertools import islice
+from typing import Iterator, List, Dict, Set, Optional
+
+from dmk.a_base import CodenameKey
+from dmk.a_utils.counters import count
+from dmk.a_utils.spans import span
+from dmk.b_cryptoblobs import DecryptedIO
+from dmk.b_cryptoblobs._20_encdec_part import blake2s
+from dmk.b_storage_file import BlocksIndexedReader
+from dmk.c_namegroups._namegroup import NameGroup
+
+# if none of these slots belong to the name, we give up
+PROBE_FIRST_SLOTS = 16
+
+# enough for the 256 parts of the largest entry, even if some of the slots
+# were taken by other names written at the same time
+PROBE_MAX_SLOTS = 2 * 256 + 64
+
+_SLOT_SIZE = 4
+
+
+def candidate_slots(cnk: CodenameKey, blocks_num: int) -> Iterator[int]:
+    """Distinct pseudo-random indices in `range(blocks_num)`, derived from
+    the key.
+
+    The indices are taken from `range(2**bits)` that covers `blocks_num`,
+    and the ones outside `blocks_num` are skipped. So when the number of
+    blocks changes, but not over a power of two, the sequence keeps the
+    same order of the same indices, with the new ones interleaved."""
+    if blocks_num <= 0:
+        return
+    mask = (1 << max(1, (blocks_num - 1).bit_length())) - 1
+    seen: Set[int] = set()
+    counter = 0
+    while len(seen) < blocks_num:
+        digest = blake2s(cnk.as_bytes + b'placement'
+                         + counter.to_bytes(4, 'big'), 32)
+        counter += 1
+        for pos in range(0, len(digest), _SLOT_SIZE):
+            slot = int.from_bytes(digest[pos:pos + _SLOT_SIZE], 'big') & mask
+            if slot < blocks_num and slot not in seen:
+                seen.add(slot)
+                yield slot
+
+
+def probe_name_group(blobs: BlocksIndexedReader,
+                     cnk: CodenameKey) -> Optional[NameGroup]:
+    """Reads the blocks in the candidate slots of the `cnk`, until complete
+    content is found. Returns the group with the found blocks, or None if
+    the probe is inconclusive.
+
+    The group may lack the fake blocks of the name, so it must not be used
+    for updates."""
+    with span('probe') as s:
+        count('probes')
+        matched: List[int] = []
+        parts: Dict[int, Set[int]] = dict()
+        last_part: Dict[int, int] = dict()
+        probed = 0
+        for slot in islice(candidate_slots(cnk, len(blobs)),
+                           PROBE_MAX_SLOTS):
+            if probed >= PROBE_FIRST_SLOTS and not matched:
+                break
+            probed += 1
+            dio = DecryptedIO(cnk, blobs.io(slot))
+            if not dio.belongs_to_namegroup:
+                continue
+            matched.append(slot)
+            if not dio.contains_data:
+                continue
+            ver = dio.header.data_version
+            parts.setdefault(ver, set()).add(dio.header.part_idx)
+            if dio.header.is_last_part:
+                last_part[ver] = dio.header.part_idx
+            if ver in last_part and len(parts[ver]) == last_part[ver] + 1:
+                s.add('slots', probed)
+                ng = NameGroup(blobs, cnk, indices=matched)
+                assert ng.fresh_content_dios
+                return ng
+        s.add('slots', probed)
+        count('probe_misses')
+        return None
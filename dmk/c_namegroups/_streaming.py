@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Finding the names in a vault that is read from a stream (see
+`StorageStreamReader`).
+
+The blocks are read in a single pass. Only the blocks with a matching
+imprint are kept in memory. They make a small vault of their own, and
+`NameGroup` resolves the versions there the same way as in the whole
+file.
+"""
+
+from io import BytesIO
+from typing import List, Sequence
+
+from dmk._common import BLOCK_PREFIX_SIZE
+from dmk.a_base import CodenameKey
+from dmk.a_utils.counters import count
+from dmk.a_utils.spans import span
+from dmk.b_cryptoblobs._20_encdec_part import ENCRYPTION_NONCE_LEN, \
+    to_imprint
+from dmk.b_storage_file import StorageStreamReader, BlocksIndexedReader
+from dmk.c_namegroups._namegroup import NameGroup
+
+
+def stream_name_groups(reader: StorageStreamReader,
+                       cnks: Sequence[CodenameKey]) -> List[NameGroup]:
+    """Same as `scan_name_groups`, but reads the blocks from the stream.
+    The results are in the same order as `cnks`."""
+    with span('scan') as s:
+        count('scans')
+        matched: List[List[int]] = [[] for _ in cnks]
+        kept: List[bytes] = []
+        blocks_num = 0
+        for block in reader.blocks():
+            blocks_num += 1
+            nonce = block[:ENCRYPTION_NONCE_LEN]
+            imprint = block[ENCRYPTION_NONCE_LEN:BLOCK_PREFIX_SIZE]
+            hit = False
+            for indices, cnk in zip(matched, cnks):
+                if to_imprint(cnk, nonce) == imprint:
+                    # the index in the kept blocks
+                    indices.append(len(kept))
+                    hit = True
+            if hit:
+                kept.append(block)
+        count('blocks_scanned', blocks_num)
+        count('imprint_hits', sum(len(indices) for indices in matched))
+        s.add('blocks', blocks_num)
+        s.add('bytes_read', blocks_num * reader.cluster_size)
+
+    blobs = BlocksIndexedReader(BytesIO(b''.join(kept)),
+                                cluster_size=reader.cluster_size)
+    return [NameGroup(blobs, cnk, indices=indices)
+            for cnk, indices in zip(cnks, matched)]
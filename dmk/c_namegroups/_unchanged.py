@@ -0,0 +1,40 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+"""Finding the writes that would not change the content of the name, so
+they can be skipped."""
+
+import io
+import zlib
+from typing import BinaryIO
+
+from dmk.c_namegroups._namegroup import NameGroup
+from dmk.c_namegroups._update import get_stream_size
+
+
+def same_content(name_group: NameGroup, source: BinaryIO) -> bool:
+    """Whether the `source` contains the same bytes as the fresh content
+    of the name. The `source` must be positioned at its start, and it is
+    positioned there again when the function returns.
+
+    The size and the CRC-32 of each part are compared with the headers
+    first. The blocks are decrypted only if all of them match."""
+    dios = sorted(name_group.fresh_content_dios,
+                  key=lambda dio: dio.header.part_idx)
+    if not dios:
+        return False
+    if get_stream_size(source) != sum(dio.header.part_size for dio in dios):
+        return False
+    try:
+        for dio in dios:
+            if zlib.crc32(source.read(dio.header.part_size)) \
+                    != dio.header.content_crc32:
+                return False
+        source.seek(0, io.SEEK_SET)
+        for dio in dios:
+            if source.read(dio.header.part_size) != dio.read_data():
+                return False
+        return True
+    finally:
+        source.seek(0, io.SEEK_SET)
@@ -4,13 +4,20 @@
 
 import io
 import random
-from typing import List, BinaryIO, Set, NamedTuple
+from typing import List, BinaryIO, Set, NamedTuple, Optional, Sequence, \
+    Tuple, Dict, Union
 
 from dmk.a_base import CodenameKey
+from dmk.a_utils.counters import count
+from dmk.a_utils.spans import span
 from dmk.b_cryptoblobs import MultipartEncryptor
-from dmk.b_storage_file import BlocksIndexedReader, BlocksSequentialWriter
+from dmk.b_storage_file import BlocksIndexedReader, \
+    BlocksSequentialWriter, SizeBand
+from dmk.c_namegroups._delta import reusable_parts, write_manifest
 from dmk.c_namegroups._fakes import create_fake_bytes
-from dmk.c_namegroups._namegroup import NameGroup
+from dmk.c_namegroups._namegroup import NameGroup, NameGroupItem, \
+    scan_name_groups
+from dmk.c_namegroups._placement import candidate_slots
 from dmk.c_namegroups.content_ver import increased_data_version
 
 
@@ -40,11 +47,35 @@ class TaskKeep(NamedTuple):
 
 
 class TaskFake:
-    pass
+    def __init__(self, group_idx: int = 0):
+        # index of the name (in the list of updated names) which key
+        # is used to create the fake
+        self.group_idx = group_idx
 
 
 class TaskEncrypt(NamedTuple):
     part_idx: int
+    group_idx: int = 0
+
+
+class TaskManifest(NamedTuple):
+    group_idx: int = 0
+
+
+class TaskCopy(NamedTuple):
+    """Copies the old block with the part of the fresh content to the
+    position chosen for the new content."""
+    old_block_idx: int
+    part_idx: int
+    group_idx: int = 0
+
+
+def write_encrypted(encryptor: MultipartEncryptor, part_idx: int,
+                    new_blobs: BlocksSequentialWriter):
+    assert not encryptor.all_encrypted
+    with io.BytesIO() as temp_io:
+        encryptor.encrypt(part_idx=part_idx, target_io=temp_io)
+        new_blobs.write_bytes(temp_io.getvalue())
 
 
 def copy_block(old_blobs: BlocksIndexedReader,
@@ -53,10 +84,12 @@ def copy_block(old_blobs: BlocksIndexedReader,
     old_buf = old_blobs.io(old_block_idx).read()
     # todo don't recompute crc32
     new_blobs.write_bytes(old_buf)
+    count('bytes_copied', len(old_buf))
 
 
 def add_fake(cdk: CodenameKey, new_blobs: BlocksSequentialWriter):
-    new_blobs.write_bytes(create_fake_bytes(cdk))
+    new_blobs.write_bytes(create_fake_bytes(cdk, new_blobs.cluster_size))
+    count('fakes_added')
 
 
 def add_fakes(cdk: CodenameKey,
@@ -81,7 +114,18 @@ def add_fakes(cdk: CodenameKey,
 
 
 class FakeDeltas:
-    def __init__(self, old_blocks_num: int, adding_blocks: int):
+    """How many blocks of the name may be removed (from `min_loss` to
+    `max_loss`) and how many fakes are added (from `min_add` to `max_add`)
+    by an update.
+
+    With a `band`, the numbers are chosen to move the vault size into it:
+    a vault larger than `band.max_blocks` loses as much as the name allows
+    and gets one fake, a vault smaller than `band.min_blocks` gets more
+    fakes and loses one block. Inside the band, the ranges are narrowed so
+    the vault stays there."""
+
+    def __init__(self, old_blocks_num: int, adding_blocks: int,
+                 band: SizeBand = SizeBand()):
         max_loss_percent = 0.05
         min_delta = 3
 
@@ -109,75 +153,226 @@ class FakeDeltas:
         self.max_loss = max(self.max_loss, adding_blocks)
         self.max_loss = min(self.max_loss, old_blocks_num)
 
-        assert self.max_add >= 1
+        self.min_loss = 1
+        self.min_add = 1
+
+        if band.max_blocks and old_blocks_num >= band.max_blocks:
+            excess = old_blocks_num - band.max_blocks + adding_blocks + 1
+            self.max_loss = min(max(self.max_loss, excess), old_blocks_num)
+            self.min_loss = self.max_loss
+            self.max_add = 1
+        elif band.min_blocks and old_blocks_num < band.min_blocks:
+            # growing at most twice per update
+            deficit = band.min_blocks - old_blocks_num
+            self.max_add = max(self.max_add,
+                               min(deficit, old_blocks_num))
+            self.min_add = self.max_add
+            self.max_loss = min(1, old_blocks_num)
+        else:
+            if band.max_blocks:
+                room = band.max_blocks - old_blocks_num - adding_blocks \
+                       + self.min_loss
+                self.max_add = max(1, min(self.max_add, room))
+            if band.min_blocks:
+                surplus = old_blocks_num - band.min_blocks + self.min_add
+                self.max_loss = max(min(self.max_loss, surplus),
+                                    self.min_loss)
+            self.max_loss = min(self.max_loss, old_blocks_num)
+
+        assert 1 <= self.min_add <= self.max_add
         assert self.max_loss >= 0
         assert self.max_loss <= old_blocks_num
 
 
+def keyed_order(tasks: List[object],
+                 cdks: Sequence[CodenameKey]) -> List[object]:
+    """The order of the tasks for the vaults with the keyed placement.
+
+    The kept blocks stay at their old indices. The new (or copied) content
+    goes to the candidate slots of its key, moving the blocks that were
+    there. All the rest fill the free slots in random order."""
+    slots: List[Optional[object]] = [None] * len(tasks)
+    rest: List[object] = []
+    encrypts: List[Union[TaskEncrypt, TaskCopy]] = []
+    for task in tasks:
+        if isinstance(task, (TaskEncrypt, TaskCopy)):
+            encrypts.append(task)
+        elif isinstance(task, TaskKeep) and task.old_block_idx < len(slots):
+            slots[task.old_block_idx] = task
+        else:
+            rest.append(task)
+
+    claimed: Set[int] = set()
+    group_indices = list(range(len(cdks)))
+    random.shuffle(group_indices)
+    for group_idx in group_indices:
+        free = (slot for slot in candidate_slots(cdks[group_idx], len(slots))
+                if slot not in claimed)
+        for task in sorted((t for t in encrypts if t.group_idx == group_idx),
+                           key=lambda t: t.part_idx):
+            slot = next(free)
+            moved = slots[slot]
+            if moved is not None:
+                rest.append(moved)
+            slots[slot] = task
+            claimed.add(slot)
+
+    random.shuffle(rest)
+    rest_iter = iter(rest)
+    result = [task if task is not None else next(rest_iter)
+              for task in slots]
+    assert next(rest_iter, None) is None
+    return result
+
+
 def update_namegroup_b(cdk: CodenameKey,
                        new_content_io: BinaryIO,
                        old_blobs: BlocksIndexedReader,
-                       new_blobs: BlocksSequentialWriter):
-    name_group = NameGroup(old_blobs, cdk)
-
-    encryptor = MultipartEncryptor(cdk, new_content_io,
-                                   increased_data_version(name_group.all_content_versions))
+                       new_blobs: BlocksSequentialWriter,
+                       name_group: Optional[NameGroup] = None,
+                       drop_outdated: bool = False,
+                       delta: bool = False):
+    # the `name_group` can be passed if it's already known for `old_blobs`
+    update_namegroups_b([(cdk, new_content_io)], old_blobs, new_blobs,
+                        name_groups=None if name_group is None
+                        else [name_group],
+                        drop_outdated=drop_outdated, delta=delta)
+
+
+def update_namegroups_b(updates: Sequence[Tuple[CodenameKey, BinaryIO]],
+                        old_blobs: BlocksIndexedReader,
+                        new_blobs: BlocksSequentialWriter,
+                        name_groups: Optional[Sequence[NameGroup]] = None,
+                        drop_outdated: bool = False,
+                        delta: bool = False):
+    """Sets new content for multiple names with a single rewrite.
+
+    For each name it's the same as `update_namegroup_b`: the old blocks of
+    the name group are removed (except a random few), the new content and
+    a random number of fakes are added. The keys must be unique.
+
+    With the keyed placement, the `name_groups` must contain all the blocks
+    of the names, as found by a scan.
+
+    With `drop_outdated=True` (and always with the keyed placement) all
+    the outdated content blocks of the names are removed, and only some of
+    their fakes stay.
+
+    With `delta=True` the unchanged parts of the fresh content are kept
+    instead of encrypting them again (see `c_namegroups._delta`). It is
+    ignored with the keyed placement.
+    """
+    with span('update') as s:
+        blocks = _update_namegroups_b(updates, old_blobs, new_blobs,
+                                      name_groups, drop_outdated, delta)
+        s.add('blocks', blocks)
+        s.add('bytes_written', blocks * new_blobs.cluster_size)
+
+
+def _update_namegroups_b(updates: Sequence[Tuple[CodenameKey, BinaryIO]],
+                         old_blobs: BlocksIndexedReader,
+                         new_blobs: BlocksSequentialWriter,
+                         name_groups: Optional[Sequence[NameGroup]],
+                         drop_outdated: bool, delta: bool) -> int:
+    """Returns the number of the written blocks."""
+
+    if len(set(cdk.as_bytes for cdk, _ in updates)) != len(updates):
+        raise ValueError("The keys are not unique")
+
+    if name_groups is None:
+        name_groups = scan_name_groups(old_blobs,
+                                       [cdk for cdk, _ in updates])
+    assert len(name_groups) == len(updates)
 
     all_blob_indexes = set(range(len(old_blobs)))
-    ng_old_indexes = set(e.idx for e in name_group.items)
-    assert all(idx in all_blob_indexes for idx in ng_old_indexes)
-
-    # All ng_old_indexes refer to the current codename. But there is no
-    # longer any valuable data among them. There are only fake or outdated
-    # ones. Therefore, we can safely delete them.
-
-    fake_deltas = FakeDeltas(
-        old_blocks_num=len(old_blobs),
-        adding_blocks=len(encryptor.part_sizes)
-    )
-
-    if len(ng_old_indexes) >= 1:
-        ng_new_indexes = remove_random_items(
-            ng_old_indexes,
-            min_to_delete=1,
-            max_to_delete=fake_deltas.max_loss)
-    else:
-        assert len(ng_old_indexes) == 0
-        ng_new_indexes = set()
+    indexes_to_keep = set(all_blob_indexes)
 
     tasks: List[object] = list()
+    encryptors: List[MultipartEncryptor] = []
+    reused_parts: List[Dict[int, NameGroupItem]] = []
+
+    for group_idx, ((cdk, new_content_io), name_group) in \
+            enumerate(zip(updates, name_groups)):
+        encryptor = MultipartEncryptor(
+            cdk, new_content_io,
+            increased_data_version(name_group.all_content_versions),
+            cluster_size=new_blobs.cluster_size)
+        encryptors.append(encryptor)
+        count('bytes_set', sum(encryptor.part_sizes))
+        reused = reusable_parts(name_group, encryptor) \
+            if delta and not new_blobs.keyed_placement else dict()
+        reused_parts.append(reused)
+        reused_indexes = set(item.idx for item in reused.values())
+
+        ng_old_indexes = set(e.idx for e in name_group.items)
+        assert all(idx in all_blob_indexes for idx in ng_old_indexes)
+
+        # All ng_old_indexes refer to the current codename. But there is no
+        # longer any valuable data among them. There are only fake or
+        # outdated ones. Therefore, we can safely delete them.
+
+        fake_deltas = FakeDeltas(
+            old_blocks_num=len(old_blobs),
+            adding_blocks=len(encryptor.part_sizes),
+            band=new_blobs.size_band
+        )
+
+        # with the keyed placement, the outdated content could be found by
+        # the probes. So only the fakes may stay
+        ng_may_stay = set(e.idx for e in name_group.items if e.is_fake) \
+            if new_blobs.keyed_placement or drop_outdated \
+            else ng_old_indexes - reused_indexes
+
+        if len(ng_may_stay) >= 1:
+            ng_new_indexes = remove_random_items(
+                ng_may_stay,
+                min_to_delete=min(fake_deltas.min_loss, len(ng_may_stay)),
+                max_to_delete=fake_deltas.max_loss)
+        else:
+            assert len(ng_may_stay) == 0
+            ng_new_indexes = set()
 
-    indexes_to_keep = set(all_blob_indexes)
-    indexes_to_keep -= ng_old_indexes
-    indexes_to_keep.update(ng_new_indexes)
+        indexes_to_keep -= ng_old_indexes
+        indexes_to_keep.update(ng_new_indexes)
+        indexes_to_keep.update(reused_indexes)
 
-    for idx in indexes_to_keep:
-        tasks.append(TaskKeep(idx))
+        for part_idx in range(len(encryptor.part_sizes)):
+            if part_idx not in reused:
+                tasks.append(TaskEncrypt(part_idx, group_idx))
+        if reused:
+            tasks.append(TaskManifest(group_idx))
 
-    for part_idx in range(len(encryptor.part_sizes)):
-        tasks.append(TaskEncrypt(part_idx))
+        for idx in range(random.randint(fake_deltas.min_add,
+                                        fake_deltas.max_add)):
+            tasks.append(TaskFake(group_idx))
 
-    for idx in range(random.randint(1, fake_deltas.max_add)):
-        tasks.append(TaskFake())
+    for idx in indexes_to_keep:
+        tasks.append(TaskKeep(idx))
 
-    assert sum(1 for t in tasks if isinstance(t, TaskFake)) >= 1
+    assert sum(1 for t in tasks if isinstance(t, TaskFake)) >= len(updates)
 
-    # in random order: copying old blocks, writing fake blocks,
-    # adding new content
-    random.shuffle(tasks)
+    if new_blobs.keyed_placement:
+        tasks = keyed_order(tasks, [cdk for cdk, _ in updates])
+    else:
+        # in random order: copying old blocks, writing fake blocks,
+        # adding new content
+        random.shuffle(tasks)
+        old_blobs.random_access()
     for task in tasks:
         if isinstance(task, TaskFake):
-            add_fake(cdk, new_blobs)
+            add_fake(updates[task.group_idx][0], new_blobs)
         elif isinstance(task, TaskEncrypt):
-            assert not encryptor.all_encrypted
-            with io.BytesIO() as temp_io:
-                encryptor.encrypt(part_idx=task.part_idx,
-                                  target_io=temp_io)
-                temp_io.seek(0, io.SEEK_SET)
-                new_blobs.write_bytes(temp_io.read())
+            write_encrypted(encryptors[task.group_idx], task.part_idx,
+                            new_blobs)
+        elif isinstance(task, TaskManifest):
+            write_manifest(updates[task.group_idx][0],
+                           encryptors[task.group_idx],
+                           reused_parts[task.group_idx], new_blobs)
         elif isinstance(task, TaskKeep):
             copy_block(old_blobs, task.old_block_idx, new_blobs)
         else:
             raise TypeError
     new_blobs.write_tail()
-    assert encryptor.all_encrypted
+    assert all(len(e.encrypted_indices) + len(r) == len(e.part_sizes)
+               for e, r in zip(encryptors, reused_parts))
+    return len(tasks)
@@ -0,0 +1,115 @@
+"""Load test for the `dmk serve` daemon.
+
+Starts the server in a background thread on a temporary vault, then runs
+many clients in parallel threads. Prints p50/p99 latencies and the number
+of requests per second.
+
+    python -m experiments.bench_serve --clients 16 --requests 200
+"""
+
+import asyncio
+import random
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+
+import click
+
+from dmk._client import DmkClient
+from dmk._server import VaultServer
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.randoms import get_noncrypt_random_bytes, \
+    random_codename_fullsize
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    idx = min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))
+    return sorted_values[idx]
+
+
+def report(title: str, latencies: List[float], elapsed: float):
+    latencies = sorted(latencies)
+    print(f"{title}: {len(latencies)} requests in {elapsed:.2f} sec")
+    print(f"  requests/sec {len(latencies) / elapsed:.0f}")
+    print(f"  p50 {percentile(latencies, 50) * 1000:.2f} ms")
+    print(f"  p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"  mean {statistics.mean(latencies) * 1000:.2f} ms")
+
+
+@click.command()
+@click.option('--clients', default=16, help="Parallel client threads")
+@click.option('--requests', default=200, help="Gets per client")
+@click.option('--entries', default=20, help="Entries in the vault")
+@click.option('--entry-size', default=1024, help="Bytes per entry")
+@click.option('--dummy', default=1000, help="Dummy blocks in the vault")
+@click.option('--writes', default=0, help="Sets per client, mixed with gets")
+@click.option('--real-kdf', is_flag=True,
+              help="Use standard Argon2 params instead of faster ones")
+def main(clients: int, requests: int, entries: int, entry_size: int,
+         dummy: int, writes: int, real_kdf: bool):
+    if not hasattr(socket, 'AF_UNIX'):
+        raise click.ClickException("Unix sockets required")
+
+    faster = FasterKDF()
+    if not real_kdf:
+        faster.start()
+
+    with TemporaryDirectory() as tds:
+        vault_path = Path(tds) / "vault.dmk"
+        socket_path = Path(tds) / "dmk.sock"
+
+        names = [f"entry{i}" for i in range(entries)]
+        dmk_file = DmkFile(vault_path, keep_open=True)
+        dmk_file.add_fakes(random_codename_fullsize(), dummy)
+        for name in names:
+            dmk_file.set_bytes(name, get_noncrypt_random_bytes(entry_size))
+        print(f"Vault: {dmk_file.blobs_len} blocks, "
+              f"{vault_path.stat().st_size:,} bytes")
+
+        server = VaultServer(dmk_file)
+        thread = threading.Thread(
+            target=lambda: asyncio.run(server.serve(socket_path)))
+        thread.start()
+        server.ready.wait()
+
+        def run_client(_) -> List[float]:
+            ops = ['get'] * requests + ['set'] * writes
+            random.shuffle(ops)
+            latencies: List[float] = []
+            with DmkClient(socket_path) as client:
+                for op in ops:
+                    name = random.choice(names)
+                    t = time.perf_counter()
+                    if op == 'get':
+                        client.get_bytes(name)
+                    else:
+                        client.set_bytes(
+                            name, get_noncrypt_random_bytes(entry_size))
+                    latencies.append(time.perf_counter() - t)
+            return latencies
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                results = list(executor.map(run_client, range(clients)))
+            elapsed = time.perf_counter() - started
+        finally:
+            server.stop()
+            thread.join()
+            dmk_file.close()
+
+        report("serve", [x for r in results for x in r], elapsed)
+        print(f"  get batches {server.get_batches}")
+
+    if not real_kdf:
+        faster.end()
+
+
+if __name__ == "__main__":
+    main()
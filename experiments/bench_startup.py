@@ -0,0 +1,70 @@
+"""Startup time of the `dmk` command.
+
+Prints the slowest imports reported by `python -X importtime`, then runs
+`dmk vault` several times and compares the median time with the target.
+The command does not need the cryptography, so it must not import it.
+
+    python -m experiments.bench_startup --runs 20
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+import click
+
+# `dmk vault` on a laptop, including the interpreter startup
+TARGET_VAULT_MS = 150.0
+
+HEAVY_MODULES = ['Crypto', 'argon2', 'click_shell']
+
+
+def import_times(module: str) -> List[Tuple[int, str]]:
+    """Returns (cumulative microseconds, module name) for each import."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True)
+    times: List[Tuple[int, str]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def run_ms(args: List[str]) -> float:
+    t = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'dmk'] + args,
+                   stdout=subprocess.DEVNULL, check=True,
+                   env={**os.environ, 'DMK_VAULT_FILE': os.devnull})
+    return (time.perf_counter() - t) * 1000
+
+
+@click.command()
+@click.option('--runs', default=10, help="Runs of `dmk vault`")
+@click.option('--top', default=10, help="Slowest imports to print")
+def main(runs: int, top: int):
+    times = import_times('dmk')
+    print("Slowest imports of `import dmk` (cumulative):")
+    for us, name in sorted(times, reverse=True)[:top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    heavy = [name for _, name in times
+             if name.split('.')[0] in HEAVY_MODULES]
+    if heavy:
+        print(f"Heavy modules imported at startup: {', '.join(heavy)}")
+
+    timings = [run_ms(['vault']) for _ in range(runs)]
+    median = statistics.median(timings)
+    print(f"`dmk vault` median {median:.1f} ms, min {min(timings):.1f} ms, "
+          f"target {TARGET_VAULT_MS:.0f} ms")
+    if median > TARGET_VAULT_MS or heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
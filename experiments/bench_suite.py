@@ -0,0 +1,389 @@
+"""Benchmarks of the vault operations.
+
+Measures the operations on synthetic vaults of different sizes, with
+entries of different sizes. Argon2 is replaced with `FasterKDF`, so the
+results show the cost of the vault operations alone.
+
+    python -m experiments.bench_suite run -o before.json
+    python -m experiments.bench_suite run --vault-sizes 1M,256M,4G -o after.json
+    python -m experiments.bench_suite run --cluster-size 64K -o c64k.json
+    python -m experiments.bench_suite run --imprint-table -o table.json
+    python -m experiments.bench_suite run --keyed-placement -o keyed.json
+    python -m experiments.bench_suite compare before.json after.json
+
+`set_from_io_append` is the same as `set_from_io`, but with
+`append_writes=True`: compare them to see the cost of the rewrite.
+
+`compare` prints the ratio of median times for each benchmark present in
+both files, and exits with code 1 when any of them got slower than the
+threshold.
+
+The `*_cold` benchmarks drop the vault file from the OS page cache before
+each run (with `posix_fadvise`, so on Linux only). They show how much
+of a lookup is spent reading the disk. Compare the runs with and without
+`--imprint-table` to see the effect of the table layout.
+
+The storage layer gives the OS page cache access-pattern hints
+(`posix_fadvise`, so on Linux only). Compare the runs with and without
+`--no-fadvise` to see their effect, mostly on the `*_cold` benchmarks.
+
+With `--memory` each benchmark also records the peak memory allocated by
+Python (tracemalloc) during a separate run, and `compare` checks it the
+same way as the time.
+"""
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+import click
+
+from dmk._common import CLUSTER_SIZE, KEY_SALT_SIZE, \
+    MAX_CLUSTER_CONTENT_SIZE, check_cluster_size, max_cluster_content_size
+from dmk._constants import __version__
+from dmk._main import parse_n_units
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF, CodenameKey
+from dmk.a_utils import fadvise
+from dmk.a_utils.dirty_file import WritingToTempFile
+from dmk.a_utils.randoms import get_noncrypt_random_bytes
+from dmk.b_cryptoblobs import decrypt_from_dios
+from dmk.b_storage_file import StorageFileWriter, StorageFileReader, Layout
+from dmk.c_namegroups import NameGroup
+
+# the part index is a single byte, so an entry has at most 256 parts
+MAX_ENTRY_SIZE = 256 * MAX_CLUSTER_CONTENT_SIZE
+
+DEFAULT_VAULT_SIZES = "1M,16M,256M"
+DEFAULT_ENTRY_SIZES = f"1,4K,64K,{MAX_ENTRY_SIZE}"
+
+ENTRY_NAME = "benchmarked"
+FAKE_NAME = "some-random-name"
+
+# (setup, timed): `setup` prepares the files and is not measured
+Case = Tuple[Callable[[], None], Callable[[], None]]
+
+
+def create_synthetic_vault(path: Path, size: int,
+                           layout: Layout = Layout()):
+    """Creates a vault of random blocks.
+
+    The fake blocks are indistinguishable from random data, so this is
+    a vault full of fakes, but created much faster than with `add_fakes`.
+    """
+    blocks_num = max(1, size // layout.cluster_size)
+    with path.open('wb') as f:
+        writer = StorageFileWriter(f, get_noncrypt_random_bytes(KEY_SALT_SIZE),
+                                   *layout)
+        for _ in range(blocks_num):
+            writer.blobs.write_bytes(
+                get_noncrypt_random_bytes(layout.cluster_size))
+        writer.blobs.write_tail()
+
+
+def can_drop_page_cache() -> bool:
+    return hasattr(os, 'posix_fadvise')
+
+
+def drop_page_cache(path: Path):
+    """Asks the OS to forget the cached pages of the file, so the next
+    reads go to the disk."""
+    with path.open('rb') as f:
+        # the dirty pages would stay in the cache
+        os.fsync(f.fileno())
+        os.posix_fadvise(f.fileno(), 0, 0,  # type: ignore
+                         os.POSIX_FADV_DONTNEED)  # type: ignore
+
+
+def measure_peak_memory(case: Case) -> int:
+    """Peak bytes allocated by the timed part, over what was allocated
+    before it."""
+    setup, timed = case
+    setup()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        timed()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def measure(case: Case, runs: int) -> List[float]:
+    setup, timed = case
+    result: List[float] = []
+    for _ in range(runs):
+        setup()
+        t = time.perf_counter()
+        timed()
+        result.append(time.perf_counter() - t)
+    return result
+
+
+class Suite:
+    def __init__(self, workdir: Path, runs: int, memory: bool = False,
+                 layout: Layout = Layout()):
+        self.workdir = workdir
+        self.runs = runs
+        self.memory = memory
+        self.layout = layout
+        self.results: List[Dict[str, Any]] = []
+
+    def add(self, name: str, case: Case,
+            vault_size: Optional[int] = None,
+            entry_size: Optional[int] = None):
+        timings = measure(case, self.runs)
+        result: Dict[str, Any] = {
+            'name': name,
+            **self.layout._asdict(),
+            'vault_size': vault_size,
+            'entry_size': entry_size,
+            'runs': len(timings),
+            'median_sec': statistics.median(timings),
+            'min_sec': min(timings),
+        }
+        if self.memory:
+            result['peak_bytes'] = measure_peak_memory(case)
+        self.results.append(result)
+        print(f"{result_key(result):<40} "
+              f"median {result['median_sec'] * 1000:10.2f} ms  "
+              f"min {result['min_sec'] * 1000:10.2f} ms"
+              + (f"  peak {result['peak_bytes'] / 1024:10.0f} KiB"
+                 if self.memory else ""), file=sys.stderr)
+
+    def run(self, vault_sizes: List[int], entry_sizes: List[int]):
+        master = self.workdir / "master.dmk"
+        work = self.workdir / "work.dmk"
+
+        def restore():
+            shutil.copyfile(master, work)
+
+        for vault_size in vault_sizes:
+            create_synthetic_vault(master, vault_size, self.layout)
+            salt = DmkFile(master).salt
+
+            def scan():
+                with master.open('rb') as f:
+                    NameGroup(StorageFileReader(f).blobs,
+                              CodenameKey(ENTRY_NAME, salt))
+
+            self.add('namegroup_scan', (lambda: None, scan),
+                     vault_size=vault_size)
+            if can_drop_page_cache():
+                self.add('namegroup_scan_cold',
+                         (lambda: drop_page_cache(master), scan),
+                         vault_size=vault_size)
+
+            self.add('add_fakes', (
+                restore,
+                lambda: DmkFile(work).add_fakes(FAKE_NAME, 16)),
+                     vault_size=vault_size)
+
+            # the temporary names are random, so the file is prepared
+            # for a particular object
+            pending: List[WritingToTempFile] = []
+
+            def prepare_commit():
+                restore()
+                pending.append(WritingToTempFile(work))
+                shutil.copyfile(master, pending[-1].dirty)
+
+            def commit():
+                with pending.pop() as wtf:
+                    wtf.commit()
+
+            self.add('temp_file_commit', (prepare_commit, commit),
+                     vault_size=vault_size)
+
+            for entry_size in entry_sizes:
+                data = get_noncrypt_random_bytes(entry_size)
+
+                self.add('set_from_io', (
+                    restore,
+                    lambda: DmkFile(work).set_from_io(ENTRY_NAME,
+                                                      BytesIO(data))),
+                         vault_size=vault_size, entry_size=entry_size)
+
+                if can_drop_page_cache():
+                    def restore_cold():
+                        restore()
+                        drop_page_cache(work)
+
+                    self.add('set_from_io_cold', (
+                        restore_cold,
+                        lambda: DmkFile(work).set_from_io(ENTRY_NAME,
+                                                          BytesIO(data))),
+                             vault_size=vault_size, entry_size=entry_size)
+
+                self.add('set_from_io_append', (
+                    restore,
+                    lambda: DmkFile(work, append_writes=True).set_from_io(
+                        ENTRY_NAME, BytesIO(data))),
+                         vault_size=vault_size, entry_size=entry_size)
+
+                restore()
+                DmkFile(work).set_bytes(ENTRY_NAME, data)
+
+                # a new object each time, so the blocks are not cached
+                self.add('get_bytes', (
+                    lambda: None,
+                    lambda: DmkFile(work).get_bytes(ENTRY_NAME)),
+                         vault_size=vault_size, entry_size=entry_size)
+                if can_drop_page_cache():
+                    self.add('get_bytes_cold', (
+                        lambda: drop_page_cache(work),
+                        lambda: DmkFile(work).get_bytes(ENTRY_NAME)),
+                             vault_size=vault_size, entry_size=entry_size)
+
+                if vault_size == vault_sizes[0]:
+                    # does not depend on the vault size
+                    with work.open('rb') as f:
+                        dios = NameGroup(StorageFileReader(f).blobs,
+                                         CodenameKey(ENTRY_NAME, salt)) \
+                            .fresh_content_dios
+                        self.add('decrypt_from_dios', (
+                            lambda: None,
+                            lambda: decrypt_from_dios(dios, BytesIO())),
+                                 entry_size=entry_size)
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    parts = [result['name']]
+    if result.get('cluster_size', CLUSTER_SIZE) != CLUSTER_SIZE:
+        parts.append(f"cluster={result['cluster_size']}")
+    if result.get('imprint_table'):
+        parts.append("table")
+    if result.get('keyed_placement'):
+        parts.append("keyed")
+    if result.get('vault_size') is not None:
+        parts.append(f"vault={result['vault_size']}")
+    if result.get('entry_size') is not None:
+        parts.append(f"entry={result['entry_size']}")
+    return " ".join(parts)
+
+
+def parse_sizes(text: str) -> List[int]:
+    return [parse_n_units(s.strip()) for s in text.split(',') if s.strip()]
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--vault-sizes', default=DEFAULT_VAULT_SIZES,
+              help="Comma-separated, like 1M,16M,4G")
+@click.option('--entry-sizes', default=DEFAULT_ENTRY_SIZES,
+              help=f"Comma-separated, up to {MAX_ENTRY_SIZE} "
+                   f"for the default cluster size")
+@click.option('--runs', default=5, help="Runs of each benchmark")
+@click.option('-o', '--output', type=Path, default=None,
+              help="JSON file for the results. By default, stdout")
+@click.option('--workdir', type=Path, default=None,
+              help="Where to create the vaults. By default, a temp dir")
+@click.option('--memory', is_flag=True,
+              help="Also measure the peak memory of each benchmark")
+@click.option('--cluster-size', default='4K',
+              help="Block size of the vaults, from 4K to 1M")
+@click.option('--imprint-table', is_flag=True,
+              help="Create the vaults with the imprint table")
+@click.option('--keyed-placement', is_flag=True,
+              help="Create the vaults with the keyed placement")
+@click.option('--no-fadvise', is_flag=True,
+              help="Do not give the page cache hints")
+def run(vault_sizes: str, entry_sizes: str, runs: int,
+        output: Optional[Path], workdir: Optional[Path], memory: bool,
+        cluster_size: str, imprint_table: bool, keyed_placement: bool,
+        no_fadvise: bool):
+    """Run the benchmarks."""
+    fadvise.enabled = not no_fadvise
+    cluster = check_cluster_size(parse_n_units(cluster_size))
+    max_entry_size = 256 * max_cluster_content_size(cluster)
+    entries = parse_sizes(entry_sizes)
+    if max(entries) > max_entry_size:
+        raise click.BadParameter(f"Entries larger than {max_entry_size}")
+
+    faster = FasterKDF()
+    faster.start()
+    try:
+        with TemporaryDirectory(dir=workdir) as tds:
+            suite = Suite(Path(tds), runs, memory=memory,
+                          layout=Layout(cluster, imprint_table,
+                                        keyed_placement))
+            suite.run(parse_sizes(vault_sizes), entries)
+    finally:
+        faster.end()
+
+    report = {
+        'meta': {
+            'dmk_version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': datetime.now(timezone.utc).isoformat(),
+            'fadvise': fadvise.enabled,
+        },
+        'results': suite.results,
+    }
+    text = json.dumps(report, indent=2)
+    if output is not None:
+        output.write_text(text)
+    else:
+        print(text)
+
+
+@cli.command()
+@click.argument('old', type=Path)
+@click.argument('new', type=Path)
+@click.option('--threshold', default=1.2,
+              help="Ratio of medians considered a regression")
+def compare(old: Path, new: Path, threshold: float):
+    """Compare two result files."""
+    old_results = {result_key(r): r
+                   for r in json.loads(old.read_text())['results']}
+    new_results = {result_key(r): r
+                   for r in json.loads(new.read_text())['results']}
+
+    regressions = 0
+
+    def check(key: str, old_value: float, new_value: float, unit: str,
+              scale: float):
+        nonlocal regressions
+        ratio = new_value / max(old_value, 1e-9)
+        flag = ""
+        if ratio > threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 / threshold:
+            flag = "better"
+        print(f"{key:<40} {old_value * scale:10.2f} {unit} "
+              f"-> {new_value * scale:10.2f} {unit}  x{ratio:.2f} {flag}")
+
+    for key, new_result in new_results.items():
+        old_result = old_results.get(key)
+        if old_result is None:
+            continue
+        check(key, old_result['median_sec'], new_result['median_sec'],
+              'ms', 1000)
+        if 'peak_bytes' in old_result and 'peak_bytes' in new_result:
+            check(key, old_result['peak_bytes'], new_result['peak_bytes'],
+                  'KiB', 1 / 1024)
+
+    if regressions:
+        print(f"{regressions} regression(s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
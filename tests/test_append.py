@@ -0,0 +1,159 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.randoms import random_codename_fullsize
+from dmk.b_storage_file import BlocksSequentialWriter
+from tests.common import gen_random_content, gen_random_names
+
+
+class TestAppend(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_appended(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, append_writes=True)
+            dmk_file.add_fakes(random_codename_fullsize(), 20)
+
+            reference = dict()
+            for name in gen_random_names(5):
+                old_bytes = path.read_bytes()
+                tail_pos = 40 + dmk_file.blobs_len * 4096
+                reference[name] = gen_random_content(
+                    0, MAX_CLUSTER_CONTENT_SIZE * 3)
+                dmk_file.set_bytes(name, reference[name])
+
+                # the old blocks are not changed
+                self.assertEqual(path.read_bytes()[:tail_pos],
+                                 old_bytes[:tail_pos])
+
+            self.assertEqual(dmk_file.metrics['appends'], 5)
+            self.assertEqual(dmk_file.metrics['compactions'], 0)
+            self.assertEqual(DmkFile(path).get_many_bytes(
+                list(reference.keys())), list(reference.values()))
+
+    def test_cache_survives_append(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, append_writes=True)
+            dmk_file.set_bytes("abc", b'first')
+            dmk_file.set_bytes("def", b'second')
+            self.assertEqual(dmk_file.get_bytes("abc"), b'first')
+            scans = dmk_file.metrics['scans']
+
+            dmk_file.set_bytes("def", b'third')
+            dmk_file.set_bytes("abc", b'fourth')
+            self.assertEqual(dmk_file.get_bytes("abc"), b'fourth')
+            self.assertEqual(dmk_file.get_bytes("def"), b'third')
+            self.assertEqual(dmk_file.metrics['scans'], scans)
+
+    def test_compaction(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, append_writes=True, compact_ratio=2)
+            dmk_file.add_fakes(random_codename_fullsize(), 10)
+            for i in range(20):
+                dmk_file.set_bytes("abc", f'value {i}'.encode())
+                self.assertEqual(DmkFile(path).get_bytes("abc"),
+                                 f'value {i}'.encode())
+            self.assertGreater(dmk_file.metrics['compactions'], 0)
+            self.assertGreater(dmk_file.metrics['appends'],
+                               dmk_file.metrics['compactions'])
+
+    def test_interrupted_append(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, append_writes=True)
+            dmk_file.set_bytes("abc", b'old')
+            old_size = path.stat().st_size
+
+            data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 5,
+                                      MAX_CLUSTER_CONTENT_SIZE * 5)
+            dmk_file.set_bytes("abc", data)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), data)
+
+            # only a part of the new blocks was written
+            with path.open('r+b') as f:
+                f.truncate(old_size + 4096 * 2 + 100)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), b'old')
+
+    def test_append_cut_after_parts(self):
+        old = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 2,
+                                 MAX_CLUSTER_CONTENT_SIZE * 3)
+        new = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 5,
+                                 MAX_CLUSTER_CONTENT_SIZE * 5)
+        write_bytes = BlocksSequentialWriter.write_bytes
+        for parts_written in [1, 2, 4]:
+            with self.subTest(parts_written=parts_written), \
+                    TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, append_writes=True)
+                dmk_file.set_bytes("abc", old)
+                self.assertEqual(dmk_file.get_bytes("abc"), old)
+
+                calls = 0
+
+                def cut(writer: BlocksSequentialWriter, buffer: bytes):
+                    nonlocal calls
+                    if calls == parts_written:
+                        raise OSError("No space left on device")
+                    calls += 1
+                    write_bytes(writer, buffer)
+
+                # the process dies after writing some of the new parts.
+                # Without the shuffle, the parts are written before the fakes
+                with patch.object(BlocksSequentialWriter, 'write_bytes', cut), \
+                        patch('dmk.c_namegroups._append.random.shuffle'), \
+                        self.assertRaises(OSError):
+                    dmk_file.set_bytes("abc", new)
+
+                self.assertEqual(DmkFile(path).get_bytes("abc"), old)
+                self.assertEqual(dmk_file.get_bytes("abc"), old)
+                # the next write completes
+                dmk_file.set_bytes("abc", new)
+                self.assertEqual(DmkFile(path).get_bytes("abc"), new)
+
+    def test_layouts_rewritten(self):
+        for kwargs in [{'imprint_table': True}, {'keyed_placement': True}]:
+            with self.subTest(str(kwargs)), TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, append_writes=True, **kwargs)
+                dmk_file.set_bytes("abc", b'first')
+                dmk_file.set_bytes("abc", b'second')
+                self.assertEqual(dmk_file.metrics['appends'], 0)
+                self.assertEqual(DmkFile(path).get_bytes("abc"), b'second')
+
+    def test_set_many(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, append_writes=True)
+            dmk_file.set_bytes("abc", b'value')
+            reference = {name: gen_random_content()
+                         for name in gen_random_names(5)}
+            dmk_file.set_many_bytes(reference)
+            self.assertEqual(dmk_file.metrics['appends'], 1)
+            self.assertEqual(DmkFile(path).get_many_bytes(
+                list(reference.keys()) + ["abc"]),
+                list(reference.values()) + [b'value'])
+
+
+if __name__ == "__main__":
+    unittest.main()
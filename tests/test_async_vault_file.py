@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk import AsyncDmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from tests.common import gen_random_names, gen_random_content
+
+
+class TestAsyncDmkFile(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_set_get(self):
+        async def run(path: Path):
+            async with AsyncDmkFile(path) as vault:
+                self.assertIsNone(await vault.get_bytes("abc"))
+                await vault.set_bytes("abc", b'one')
+                self.assertEqual(await vault.get_bytes("abc"), b'one')
+                await vault.set_text("abc", "two")
+                self.assertEqual(await vault.get_text("abc"), "two")
+                await vault.add_fakes("fake", 10)
+                self.assertEqual(await vault.get_text("abc"), "two")
+
+        with TemporaryDirectory() as tds:
+            asyncio.run(run(Path(tds) / "vault.dmk"))
+
+    def test_concurrent_gets(self):
+        reference = {name: gen_random_content(max_size=1024 * 8)
+                     for name in gen_random_names(5)}
+
+        async def run(path: Path):
+            async with AsyncDmkFile(path) as vault:
+                await vault.set_many_bytes(reference)
+                names = list(reference.keys()) * 10
+                results = await asyncio.gather(
+                    *(vault.get_bytes(name) for name in names))
+                self.assertEqual(list(results),
+                                 [reference[name] for name in names])
+                self.assertEqual(await vault.get_many_bytes(names),
+                                 [reference[name] for name in names])
+                # all the lookups are finished and forgotten
+                self.assertEqual(len(vault._lookups), 0)
+
+        with TemporaryDirectory() as tds:
+            asyncio.run(run(Path(tds) / "vault.dmk"))
+
+    def test_same_name_shares_lookup(self):
+        async def run(path: Path):
+            async with AsyncDmkFile(path) as vault:
+                await vault.set_bytes("abc", b'value')
+                a = vault.get_bytes("abc")
+                b = vault.get_bytes("abc")
+                first = asyncio.ensure_future(a)
+                await asyncio.sleep(0)
+                self.assertEqual(len(vault._lookups), 1)
+                second = asyncio.ensure_future(b)
+                await asyncio.sleep(0)
+                self.assertEqual(len(vault._lookups), 1)
+                self.assertEqual(await first, b'value')
+                self.assertEqual(await second, b'value')
+
+        with TemporaryDirectory() as tds:
+            asyncio.run(run(Path(tds) / "vault.dmk"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import json
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from click.testing import CliRunner
+
+from dmk import dmk_cli
+from dmk._batch import run_batch
+from dmk._client import encode_data
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF
+
+
+class TestBatch(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_run_batch(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("old", b'old value')
+
+            lines = [
+                '{"op": "get", "name": "old"}',
+                '{"op": "get", "name": "missing"}',
+                '{"op": "set", "name": "a", "text": "A1"}',
+                '{"op": "get", "name": "a"}',
+                '{"op": "set", "name": "a", "text": "A2"}',
+                json.dumps({"op": "set", "name": "b",
+                            "data": encode_data(b'\xff\x00')}),
+                '{"op": "get", "name": "b", "base64": true}',
+                '',
+                'not json',
+                '{"op": "delete", "name": "a"}',
+                '{"op": "set", "name": "c"}',
+            ]
+
+            with DmkFile(path) as dmk_file:
+                results = run_batch(dmk_file, lines)
+
+            self.assertEqual(len(results), 10)
+            self.assertEqual(results[0]['text'], 'old value')
+            self.assertEqual(results[1]['found'], False)
+            self.assertTrue(results[2]['ok'])
+            self.assertEqual(results[3]['text'], 'A1')
+            self.assertTrue(results[4]['ok'])
+            self.assertTrue(results[5]['ok'])
+            self.assertEqual(results[6]['data'], encode_data(b'\xff\x00'))
+            for r in results[7:]:
+                self.assertFalse(r['ok'])
+                self.assertIn('error', r)
+            for r in results[:7]:
+                self.assertIn('kdf', r['ms'])
+            self.assertGreater(results[0]['ms']['read'], 0)
+            self.assertGreater(results[2]['ms']['write'], 0)
+
+            dmk_file = DmkFile(path)
+            self.assertEqual(dmk_file.get_bytes("a"), b'A2')
+            self.assertEqual(dmk_file.get_bytes("b"), b'\xff\x00')
+            self.assertEqual(dmk_file.get_bytes("old"), b'old value')
+
+    def test_write_error(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("old", b'old value')
+            lines = [
+                '{"op": "get", "name": "old"}',
+                '{"op": "set", "name": "a", "text": "A1"}',
+                '{"op": "get", "name": "a"}',
+            ]
+            with DmkFile(path) as dmk_file, \
+                    patch.object(dmk_file, 'set_many_bytes',
+                                 side_effect=OSError("disk full")):
+                results = run_batch(dmk_file, lines)
+            self.assertTrue(results[0]['ok'])
+            # the value was not saved, so it cannot be read either
+            for r in results[1:]:
+                self.assertFalse(r['ok'])
+                self.assertEqual(r['error'], "disk full")
+            self.assertIsNone(DmkFile(path).get_bytes("a"))
+
+            # other errors are not hidden
+            with DmkFile(path) as dmk_file, \
+                    patch.object(dmk_file, 'set_many_bytes',
+                                 side_effect=TypeError):
+                with self.assertRaises(TypeError):
+                    run_batch(dmk_file, lines)
+
+    def test_cli(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            runner = CliRunner()
+            result = runner.invoke(
+                dmk_cli, ['-v', str(path), 'batch'],
+                input='{"op": "set", "name": "a", "text": "A"}\n'
+                      '{"op": "get", "name": "a"}\n',
+                catch_exceptions=False)
+            self.assertEqual(result.exit_code, 0)
+            lines = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual([r['ok'] for r in lines], [True, True])
+            self.assertEqual(lines[1]['text'], 'A')
+            self.assertEqual(DmkFile(path).get_bytes("a"), b'A')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,13 +9,16 @@ from io import BytesIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import List, Iterable
+from unittest.mock import patch
 
 from dmk.a_base._10_kdf import FasterKDF, CodenameKey
 from dmk.a_utils.randoms import get_noncrypt_random_bytes
-from dmk.b_cryptoblobs._30_encdec_multipart import MultipartEncryptor
+from dmk.b_cryptoblobs import DecryptedIO
+from dmk.b_cryptoblobs._30_encdec_multipart import MultipartEncryptor, \
+    decrypt_from_dios
 from dmk.b_storage_file import BlocksIndexedReader, BlocksSequentialWriter
 from dmk.c_namegroups._fakes import create_fake_bytes
-from dmk.c_namegroups._namegroup import NameGroup
+from dmk.c_namegroups._namegroup import NameGroup, scan_name_groups
 # from codn.c_namegroups._fakes import create_fake_bytes
 from tests.common import testing_salt
 
@@ -162,6 +165,89 @@ class TestNamegroup(unittest.TestCase):
                     self.assertEqual(len(ng.all_content_versions), 0)
                     self.assertEqual(len(name_group_to_content_blobs(ng)), 0)
 
+    def test_scan_multiple_names(self):
+        keys = [CodenameKey(name, testing_salt)
+                for name in ("abc", "def", "missing")]
+        all_blobs: List[bytes] = []
+        for pk in keys[:2]:
+            all_blobs.append(create_fake_bytes(pk))
+            with BytesIO(get_noncrypt_random_bytes(1024 * 16)) as inp:
+                all_blobs.extend(
+                    MultipartEncryptor(pk, inp, 1).encrypt_all_to_list())
+        random.shuffle(all_blobs)
+
+        with BytesIO() as blobs_stream:
+            write_blobs_to_stream(all_blobs, blobs_stream)
+            blobs_stream.seek(0, io.SEEK_SET)
+            r = BlocksIndexedReader(blobs_stream)
+
+            groups = scan_name_groups(r, keys)
+            self.assertEqual(len(groups), 3)
+            for pk, ng in zip(keys, groups):
+                expected = NameGroup(r, pk)
+                self.assertIs(ng.cnk, pk)
+                self.assertEqual([item.idx for item in ng.items],
+                                 [item.idx for item in expected.items])
+                self.assertEqual(
+                    set(name_group_to_content_blobs(ng)),
+                    set(name_group_to_content_blobs(expected)))
+            self.assertEqual(len(groups[2].items), 0)
+
+    def test_scan_imprint_table(self):
+        keys = [CodenameKey(name, testing_salt) for name in ("abc", "def")]
+        all_blobs: List[bytes] = []
+        for pk in keys:
+            all_blobs.append(create_fake_bytes(pk))
+            with BytesIO(get_noncrypt_random_bytes(1024 * 16)) as inp:
+                all_blobs.extend(
+                    MultipartEncryptor(pk, inp, 1).encrypt_all_to_list())
+        random.shuffle(all_blobs)
+
+        def scan(imprint_table: bool):
+            with BytesIO() as stream:
+                writer = BlocksSequentialWriter(stream,
+                                                imprint_table=imprint_table)
+                for b in all_blobs:
+                    writer.write_bytes(b)
+                writer.write_tail()
+                stream.seek(0, io.SEEK_SET)
+                r = BlocksIndexedReader(stream, imprint_table=imprint_table)
+                return [([item.idx for item in ng.items],
+                         name_group_to_content_blobs(ng))
+                        for ng in scan_name_groups(r, keys)
+                        + [NameGroup(r, pk) for pk in keys]]
+
+        self.assertEqual(scan(True), scan(False))
+
+    def test_bodies_decrypted_when_read(self):
+        pk = CodenameKey("abc", testing_salt)
+        all_blobs: List[bytes] = [create_fake_bytes(pk)]
+        for ver in (1, 2):
+            with BytesIO(get_noncrypt_random_bytes(1024 * 16)) as inp:
+                all_blobs.extend(
+                    MultipartEncryptor(pk, inp, ver).encrypt_all_to_list())
+        random.shuffle(all_blobs)
+
+        with BytesIO() as blobs_stream:
+            write_blobs_to_stream(all_blobs, blobs_stream)
+            blobs_stream.seek(0, io.SEEK_SET)
+            r = BlocksIndexedReader(blobs_stream)
+            decrypted_num = 0
+            data = DecryptedIO.data
+
+            def counted_data(dio: DecryptedIO):
+                nonlocal decrypted_num
+                decrypted_num += 1
+                return data.fget(dio)
+
+            with patch.object(DecryptedIO, 'data', property(counted_data)):
+                ng = NameGroup(r, pk)
+                # the scan does not decrypt the bodies
+                self.assertEqual(decrypted_num, 0)
+                with BytesIO() as decrypted:
+                    decrypt_from_dios(ng.fresh_content_dios, decrypted)
+                # each fresh part is decrypted once
+                self.assertEqual(decrypted_num, len(ng.fresh_content_dios))
 
 if __name__ == "__main__":
     unittest.main()
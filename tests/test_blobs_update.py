@@ -11,7 +11,9 @@ from dmk.a_base._10_kdf import FasterKDF, CodenameKey
 from dmk.b_cryptoblobs._20_encdec_part import is_content_io, \
     is_fake_io
 from dmk.b_storage_file import BlocksIndexedReader, BlocksSequentialWriter
-from dmk.c_namegroups._update import update_namegroup_b, FakeDeltas
+from dmk.c_namegroups._namegroup import NameGroup
+from dmk.c_namegroups._update import update_namegroup_b, FakeDeltas, \
+    update_namegroups_b
 from tests.common import testing_salt
 
 
@@ -113,6 +115,37 @@ class TestUpdate(unittest.TestCase):
         with self.subTest("Number of fakes is random"):
             self.assertGreaterEqual(len(fake_nums), 3)
 
+    def test_update_multiple_names(self):
+        keys = [CodenameKey(name, testing_salt) for name in ("a", "b", "c")]
+        contents = [b'1' * 10, b'2' * 5000, b'']
+
+        first_io = BytesIO()
+        with BlocksSequentialWriter(first_io) as writer:
+            update_namegroup_b(keys[0], BytesIO(b'old'),
+                               BlocksIndexedReader(BytesIO()), writer)
+        first_io.seek(0, io.SEEK_SET)
+
+        second_io = BytesIO()
+        with BlocksSequentialWriter(second_io) as writer:
+            update_namegroups_b(
+                [(k, BytesIO(c)) for k, c in zip(keys, contents)],
+                BlocksIndexedReader(first_io), writer)
+        second_io.seek(0, io.SEEK_SET)
+
+        reader = BlocksIndexedReader(second_io)
+        for key, content in zip(keys, contents):
+            ng = NameGroup(reader, key)
+            self.assertEqual(
+                b''.join(d.read_data() for d in sorted(
+                    ng.fresh_content_dios, key=lambda d: d.header.part_idx)),
+                content)
+            self.assertTrue(any(item.is_fake for item in ng.items))
+
+        with self.assertRaises(ValueError):
+            update_namegroups_b([(keys[0], BytesIO()), (keys[0], BytesIO())],
+                                BlocksIndexedReader(BytesIO()),
+                                BlocksSequentialWriter(BytesIO()))
+
 
 if __name__ == "__main__":
     unittest.main()
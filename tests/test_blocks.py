@@ -3,8 +3,12 @@
 
 
 import io
+import random
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
 
 from dmk._common import CLUSTER_SIZE
 from dmk.a_utils.randoms import get_noncrypt_random_bytes
@@ -56,6 +60,38 @@ class TestBlobsListFile(unittest.TestCase):
                         with self.assertRaises(IndexError):
                             reader.io(3)
 
+    def test_positional_shared_between_threads(self):
+        blocks = [get_noncrypt_random_bytes(CLUSTER_SIZE) for _ in range(32)]
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "blocks"
+            with path.open('wb') as f, BlocksSequentialWriter(f) as writer:
+                for block in blocks:
+                    writer.write_bytes(block)
+                writer.write_tail()
+
+            def read_randomly(reader: BlocksIndexedReader) -> bool:
+                for _ in range(200):
+                    idx = random.randrange(len(blocks))
+                    fragment = reader.io(idx)
+                    # by parts, so the reads of the threads interleave
+                    data = fragment.read(100) + fragment.read()
+                    if data != blocks[idx]:
+                        return False
+                return True
+
+            with path.open('rb') as file_io, \
+                    BytesIO(path.read_bytes()) as bytes_io:
+                # the file is read with `os.pread`, the `BytesIO` with
+                # seek and read under a lock
+                for source in [file_io, bytes_io]:
+                    with self.subTest(type(source).__name__):
+                        reader = BlocksIndexedReader(source, positional=True)
+                        self.assertEqual(len(reader), len(blocks))
+                        with ThreadPoolExecutor(max_workers=8) as executor:
+                            results = list(executor.map(
+                                lambda _: read_randomly(reader), range(8)))
+                        self.assertTrue(all(results))
+
     # def test_write_read_bytes(self):
     #     with BytesIO() as large_io:
     #         clusters = [
@@ -2,12 +2,14 @@
 # SPDX-License-Identifier: MIT
 
 
+import json
 import os
 import random
 import unittest
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Dict
+from unittest.mock import patch
 
 from click.testing import CliRunner
 
@@ -127,6 +129,207 @@ class Test(unittest.TestCase):
             dst_file.read_text(encoding='utf-8'),
             'sample')
 
+    def test_init_cluster_size(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            dmk_cli,
+            ['init', '--cluster-size', '64K', '--imprint-table'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(os.path.exists(self.dmk_file))
+
+        result = runner.invoke(
+            dmk_cli,
+            ['set', '-e', 'abc', '-t', 'The Value'])
+        self.assertEqual(result.exit_code, 0)
+        result = runner.invoke(
+            dmk_cli,
+            ['get', '-e', 'abc'])
+        self.assertEqual(result.output, 'The Value\n')
+
+        result = runner.invoke(dmk_cli, ['stats', '--json'])
+        self.assertEqual(json.loads(result.output)['cluster_size'], 64 * 1024)
+        self.assertTrue(json.loads(result.output)['imprint_table'])
+
+        # the file already exists
+        result = runner.invoke(dmk_cli, ['init'])
+        self.assertNotEqual(result.exit_code, 0)
+
+    def test_init_wrong_cluster_size(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            dmk_cli,
+            ['init', '--cluster-size', '5K'])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertFalse(os.path.exists(self.dmk_file))
+
+    def test_segments_and_migrate(self):
+        runner = CliRunner()
+        result = runner.invoke(dmk_cli, ['init', '--segments', '4'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(os.path.isdir(self.dmk_file))
+
+        for name in ['abc', 'def']:
+            result = runner.invoke(
+                dmk_cli, ['set', '-e', name, '-t', f'Value of {name}'])
+            self.assertEqual(result.exit_code, 0)
+        result = runner.invoke(dmk_cli, ['get', '-e', 'abc'])
+        self.assertEqual(result.output, 'Value of abc\n')
+
+        result = runner.invoke(dmk_cli, ['stats', '--json'])
+        self.assertEqual(json.loads(result.output)['segments'], 4)
+
+        single = str(self.temp_dir / "single.dmk")
+        result = runner.invoke(dmk_cli, ['migrate', single],
+                               input='abc\ndef\n\n')
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(os.path.isfile(single))
+        result = runner.invoke(dmk_cli, ['-v', single, 'get', '-e', 'def'])
+        self.assertEqual(result.output, 'Value of def\n')
+
+        # the entry is not found, nothing is written
+        other = str(self.temp_dir / "other")
+        result = runner.invoke(dmk_cli, ['-v', single, 'migrate', other,
+                                         '--segments', '2',
+                                         '-e', 'abc', '-e', 'xyz'])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertFalse(os.path.exists(other))
+
+        result = runner.invoke(dmk_cli, ['-v', single, 'migrate', other,
+                                         '--segments', '2', '-e', 'abc'])
+        self.assertEqual(result.exit_code, 0)
+        result = runner.invoke(dmk_cli, ['-v', other, 'get', '-e', 'abc'])
+        self.assertEqual(result.output, 'Value of abc\n')
+
+    def test_compact(self):
+        runner = CliRunner()
+        result = runner.invoke(dmk_cli, ['dummy', '200K'])
+        self.assertEqual(result.exit_code, 0)
+        for name in ['abc', 'def', 'xyz']:
+            result = runner.invoke(
+                dmk_cli, ['set', '-e', name, '-t', f'Value of {name}'])
+            self.assertEqual(result.exit_code, 0)
+
+        result = runner.invoke(dmk_cli, ['compact', '100K',
+                                         '-e', 'abc', '-e', 'missing'])
+        self.assertNotEqual(result.exit_code, 0)
+
+        result = runner.invoke(dmk_cli, ['compact', '100K'],
+                               input='abc\ndef\n\n')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Kept 2 entries', result.output)
+        self.assertIn('-> 25\n', result.output)
+        self.assertIn('Scan time', result.output)
+        self.assertEqual(
+            runner.invoke(dmk_cli, ['get', '-e', 'def']).output,
+            'Value of def\n')
+        self.assertNotEqual(
+            runner.invoke(dmk_cli, ['get', '-e', 'xyz']).exit_code, 0)
+
+    def test_size_band(self):
+        runner = CliRunner()
+        result = runner.invoke(dmk_cli, ['init', '--max-size', '40K'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        result = runner.invoke(dmk_cli, ['dummy', '100K'])
+        self.assertEqual(result.exit_code, 0)
+        for _ in range(10):
+            result = runner.invoke(dmk_cli, ['set', '-e', 'abc', '-t', 'x'])
+            self.assertEqual(result.exit_code, 0)
+        result = runner.invoke(dmk_cli, ['size-band', '--min', '20K'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Minimum size: 20,480 B (5 blocks)', result.output)
+        self.assertIn('Maximum size: no limit', result.output)
+        # the writes removed all the old blocks of the entry, but not the
+        # dummy ones: 25 of them, the content and one fake
+        self.assertIn('(27 blocks)', result.output)
+
+        result = runner.invoke(dmk_cli, ['size-band', '--min', '20K',
+                                         '--max', '10K'])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertEqual(
+            runner.invoke(dmk_cli, ['get', '-e', 'abc']).output, 'x\n')
+
+    def test_vault_from_stdin(self):
+        runner = CliRunner()
+        result = runner.invoke(dmk_cli, ['set', '-e', 'abc', '-t', 'value'])
+        self.assertEqual(result.exit_code, 0)
+        with open(self.dmk_file, 'rb') as f:
+            vault_bytes = f.read()
+        result = runner.invoke(dmk_cli, ['-v', '-', 'get', '-e', 'abc'],
+                               input=vault_bytes)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.output, 'value\n')
+
+        result = runner.invoke(dmk_cli, ['-v', '-', 'set', '-e', 'abc',
+                                         '-t', 'other'], input=vault_bytes)
+        self.assertNotEqual(result.exit_code, 0)
+
+    def test_sync(self):
+        runner = CliRunner()
+        source = self.temp_dir / "source"
+        (source / "sub").mkdir(parents=True)
+        (source / "a.txt").write_text('a')
+        (source / "sub" / "b.txt").write_text('b')
+        result = runner.invoke(dmk_cli, ['sync', str(source)])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Added 2, changed 0, unchanged 0 files', result.output)
+        self.assertIn('kdf', result.output)
+
+        (source / "a.txt").write_text('changed')
+        result = runner.invoke(dmk_cli, ['sync', str(source)])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Changed: a.txt\n', result.output)
+        self.assertIn('Added 0, changed 1, unchanged 1 files', result.output)
+        self.assertEqual(
+            runner.invoke(dmk_cli, ['get', '-e', 'sub/b.txt']).output, 'b\n')
+
+        result = runner.invoke(dmk_cli, ['sync', str(source / "a.txt")])
+        self.assertNotEqual(result.exit_code, 0)
+
+    def test_exec(self):
+        runner = CliRunner()
+        for name in ['abc', 'def']:
+            result = runner.invoke(
+                dmk_cli, ['set', '-e', name, '-t', f'Value of {name}'])
+            self.assertEqual(result.exit_code, 0)
+
+        with patch('os.execvpe') as execvpe:
+            result = runner.invoke(dmk_cli, [
+                'exec', '--env', 'A=abc', '--env', 'B=def', '--',
+                'printenv', '-0', 'A'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            execvpe.assert_called_once()
+            file, args, env = execvpe.call_args[0]
+            self.assertEqual(file, 'printenv')
+            self.assertEqual(args, ['printenv', '-0', 'A'])
+            self.assertEqual(env['A'], 'Value of abc')
+            self.assertEqual(env['B'], 'Value of def')
+            self.assertEqual(env[VAULT_FILE_ENVNAME], self.dmk_file)
+
+            execvpe.reset_mock()
+            for bad in [['--env', 'A=missing', '--', 'env'],
+                        ['--env', 'A', '--', 'env'],
+                        ['--env', 'A=abc']]:
+                result = runner.invoke(dmk_cli, ['exec'] + bad)
+                self.assertNotEqual(result.exit_code, 0)
+            execvpe.assert_not_called()
+
+    def test_exec_in_shell(self):
+        runner = CliRunner()
+        result = runner.invoke(dmk_cli, ['set', '-e', 'abc', '-t', 'value'])
+        self.assertEqual(result.exit_code, 0)
+
+        # the shell must keep running, so the command is a child process
+        with patch('dmk._cli._is_running_shell', return_value=True), \
+                patch('os.execvpe') as execvpe, \
+                patch('subprocess.call', return_value=3) as call:
+            result = runner.invoke(dmk_cli, [
+                'exec', '--env', 'A=abc', '--', 'printenv', 'A'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            execvpe.assert_not_called()
+            call.assert_called_once()
+            self.assertEqual(call.call_args[0][0], ['printenv', 'A'])
+            self.assertEqual(call.call_args[1]['env']['A'], 'value')
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,118 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE, DmkKeyError
+from dmk._vault_file import DmkFile
+from dmk._vault_segments import SegmentedDmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.randoms import random_codename_fullsize
+from tests.common import gen_random_content, gen_random_names
+
+
+class TestCompact(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_compact(self):
+        for kwargs in [{}, {'imprint_table': True},
+                       {'keyed_placement': True},
+                       {'append_writes': True, 'delta_writes': True}]:
+            with self.subTest(str(kwargs)), TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, **kwargs)
+                dmk_file.add_fakes(random_codename_fullsize(), 200)
+                reference = {name: gen_random_content(
+                    0, MAX_CLUSTER_CONTENT_SIZE * 3)
+                    for name in gen_random_names(5)}
+                for _ in range(3):
+                    for name, data in reference.items():
+                        dmk_file.set_bytes(name, data + b'!')
+                        dmk_file.set_bytes(name, data)
+                dmk_file.set_bytes("dropped", b'dropped')
+                old_size = path.stat().st_size
+
+                result = dmk_file.compact(list(reference.keys()), 100)
+                self.assertEqual(result.size_before, old_size)
+                self.assertEqual(result.size_after, path.stat().st_size)
+                self.assertEqual(result.blocks_after, 100)
+                self.assertEqual(dmk_file.blobs_len, 100)
+                self.assertGreater(result.blocks_before, 200)
+                self.assertGreater(result.scan_seconds_before, 0)
+                self.assertGreater(result.scan_seconds_after, 0)
+
+                other = DmkFile(path)
+                self.assertEqual(other.get_many_bytes(list(reference.keys())),
+                                 list(reference.values()))
+                self.assertIsNone(other.get_bytes("dropped"))
+
+                # the vault works as usual after that
+                dmk_file.set_bytes("new", b'new')
+                self.assertEqual(DmkFile(path).get_bytes("new"), b'new')
+
+    def test_keyed_probes_after_compact(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, keyed_placement=True)
+            dmk_file.add_fakes(random_codename_fullsize(), 300)
+            reference = {name: gen_random_content()
+                         for name in gen_random_names(5)}
+            dmk_file.set_many_bytes(reference)
+            dmk_file.compact(list(reference.keys()), 50)
+
+            other = DmkFile(path)
+            self.assertEqual(other.get_many_bytes(list(reference.keys())),
+                             list(reference.values()))
+            self.assertEqual(other.metrics['scans'], 0)
+
+    def test_errors(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path)
+            dmk_file.add_fakes(random_codename_fullsize(), 20)
+            dmk_file.set_bytes("abc", b'abc')
+            old_bytes = path.read_bytes()
+            with self.assertRaises(DmkKeyError):
+                dmk_file.compact(["abc", "missing"], 10)
+            with self.assertRaises(ValueError):
+                dmk_file.compact(["abc"], 1)
+            self.assertEqual(path.read_bytes(), old_bytes)
+            self.assertEqual(sorted(p.name for p in Path(tds).iterdir()),
+                             ["vault.dmk", "vault.dmk.lock"])
+
+    def test_segmented(self):
+        with TemporaryDirectory() as tds:
+            vault = SegmentedDmkFile(Path(tds) / "vault", segments_num=4)
+            vault.add_fakes(random_codename_fullsize(), 80)
+            reference = {name: gen_random_content()
+                         for name in gen_random_names(6)}
+            vault.set_many_bytes(reference)
+            vault.set_bytes("dropped", b'dropped')
+
+            with self.assertRaises(DmkKeyError):
+                vault.compact(list(reference.keys()) + ["missing"], 40)
+            self.assertEqual(vault.get_bytes("dropped"), b'dropped')
+
+            result = vault.compact(list(reference.keys()), 40)
+            self.assertEqual(result.blocks_after, 40)
+            self.assertEqual(vault.blobs_len, 40)
+            other = SegmentedDmkFile(vault.path)
+            self.assertEqual(other.get_many_bytes(list(reference.keys())),
+                             list(reference.values()))
+            self.assertIsNone(other.get_bytes("dropped"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import json
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from click.testing import CliRunner
+
+from dmk import dmk_cli
+from dmk._common import CLUSTER_SIZE
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.counters import Counters, counting, count
+
+
+class TestCounters(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_counting(self):
+        outer = Counters()
+        inner = Counters()
+        count('x')  # nobody counts
+        with counting(outer):
+            count('x')
+            with counting(inner):
+                count('x', 5)
+            count('x')
+        self.assertEqual(outer.snapshot(), {'x': 2})
+        self.assertEqual(inner['x'], 5)
+        self.assertEqual(inner['y'], 0)
+        inner.reset()
+        self.assertEqual(inner.snapshot(), {})
+
+    def test_dmk_file_metrics(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path)
+            dmk_file.add_fakes("fakes", 20)
+            self.assertEqual(dmk_file.metrics['fakes_added'], 20)
+            self.assertEqual(dmk_file.metrics['bytes_written'],
+                             path.stat().st_size)
+
+            dmk_file.metrics.reset()
+            dmk_file.set_bytes("abc", b'12345')
+            m = dmk_file.metrics.snapshot()
+            self.assertEqual(m['bytes_set'], 5)
+            # comparing with the old content, then writing
+            self.assertEqual(m['lookups'], 2)
+            self.assertEqual(m['scans'], 1)
+            self.assertEqual(m['blocks_scanned'], 20)
+            self.assertEqual(m['imprint_hits'], 0)
+            self.assertGreaterEqual(m['fakes_added'], 1)
+            self.assertEqual(m['bytes_copied'] % CLUSTER_SIZE, 0)
+            self.assertGreater(m['bytes_shredded'], 20 * CLUSTER_SIZE)
+            self.assertEqual(m['bytes_written'], path.stat().st_size)
+
+            stats = dmk_file.stats()
+            self.assertEqual(stats['vault_size'], path.stat().st_size)
+            self.assertEqual(stats['blocks'], dmk_file.blobs_len)
+            self.assertGreater(stats['tail_size'], 0)
+            self.assertGreater(stats['write_amplification'], 1000)
+
+            dmk_file.metrics.reset()
+            self.assertEqual(DmkFile(path).get_bytes("abc"), b'12345')
+            self.assertEqual(dmk_file.metrics.snapshot(), {})
+
+            self.assertEqual(dmk_file.get_bytes("abc"), b'12345')
+            # the content block and at least one fake
+            self.assertGreaterEqual(dmk_file.metrics['imprint_hits'], 2)
+            self.assertEqual(dmk_file.metrics['lookups'], 1)
+
+    def test_cli(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("abc", b'value')
+
+            result = CliRunner().invoke(
+                dmk_cli, ['-v', str(path), 'stats', '--json'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            stats = json.loads(result.output)
+            self.assertEqual(stats['vault_size'], path.stat().st_size)
+
+            result = CliRunner().invoke(dmk_cli, ['-v', str(path), 'stats'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Blocks:', result.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
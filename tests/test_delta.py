@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import random
+import unittest
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE, CLUSTER_SIZE
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF, CodenameKey
+from dmk.a_utils.randoms import random_codename_fullsize
+from dmk.b_cryptoblobs import DecryptedIO
+from dmk.b_cryptoblobs._30_encdec_multipart import encrypt_manifest, \
+    parse_manifest
+from tests.common import gen_random_content, testing_salt
+
+
+def _changed(data: bytes) -> bytes:
+    """Same data with one random byte changed, or a few bytes added or
+    removed at the end."""
+    choice = random.randint(0, 2)
+    if choice == 0 and data:
+        pos = random.randrange(len(data))
+        return data[:pos] + bytes(((data[pos] + 1) % 256,)) + data[pos + 1:]
+    if choice == 1:
+        return data + gen_random_content(1, 100)
+    return data[:max(0, len(data) - random.randint(1, 100))]
+
+
+class TestDelta(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_manifest(self):
+        key = CodenameKey("abc", testing_salt)
+        block = encrypt_manifest(key, 12345, [5, 12345, 7])
+        self.assertEqual(len(block), CLUSTER_SIZE)
+        dio = DecryptedIO(key, BytesIO(block))
+        self.assertTrue(dio.header.is_manifest)
+        self.assertEqual(dio.header.data_version, 12345)
+        self.assertEqual(parse_manifest(dio.read_data()), [5, 12345, 7])
+
+    def test_one_part_changed(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, delta_writes=True)
+            dmk_file.add_fakes(random_codename_fullsize(), 10)
+            data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 10,
+                                      MAX_CLUSTER_CONTENT_SIZE * 10)
+            dmk_file.set_bytes("abc", data)
+            self.assertEqual(dmk_file.metrics['parts_reused'], 0)
+
+            pos = MAX_CLUSTER_CONTENT_SIZE * 3 + 5
+            data = data[:pos] + b'X' + data[pos + 1:]
+            dmk_file.set_bytes("abc", data)
+            self.assertEqual(dmk_file.metrics['parts_reused'], 9)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), data)
+
+    def test_random_changes(self):
+        for append_writes in [False, True]:
+            with self.subTest(f"append {append_writes}"), \
+                    TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, delta_writes=True,
+                                   append_writes=append_writes)
+                data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 3,
+                                          MAX_CLUSTER_CONTENT_SIZE * 6)
+                dmk_file.set_bytes("abc", data)
+                dmk_file.set_bytes("other", b'other')
+                for _ in range(30):
+                    data = _changed(data)
+                    dmk_file.set_bytes("abc", data)
+                    self.assertEqual(dmk_file.get_bytes("abc"), data)
+                    self.assertEqual(DmkFile(path).get_bytes("abc"), data)
+                self.assertGreater(dmk_file.metrics['parts_reused'], 0)
+                self.assertEqual(DmkFile(path).get_bytes("other"), b'other')
+
+    def test_appended_only_changes(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, delta_writes=True, append_writes=True)
+            data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 20,
+                                      MAX_CLUSTER_CONTENT_SIZE * 20)
+            dmk_file.set_bytes("abc", data)
+            old_size = path.stat().st_size
+
+            data = data[:-1] + b'X'
+            dmk_file.set_bytes("abc", data)
+            self.assertEqual(dmk_file.metrics['appends'], 1)
+            # the changed part, the manifest and a few fakes
+            self.assertLess(path.stat().st_size - old_size,
+                            CLUSTER_SIZE * 10)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,12 +8,13 @@ import unittest
 from io import BytesIO
 
 from dmk._common import MAX_CLUSTER_CONTENT_SIZE, CLUSTER_SIZE, \
-    CODENAME_LENGTH_BYTES
+    CODENAME_LENGTH_BYTES, MAX_CLUSTER_SIZE, max_cluster_content_size
 from dmk.a_base._05_codename import CodenameAscii
 from dmk.a_base._10_kdf import FasterKDF, CodenameKey
 from dmk.a_utils.randoms import get_noncrypt_random_bytes
 from dmk.b_cryptoblobs._20_encdec_part import Encrypt, \
-    DecryptedIO, is_content_io, is_fake_io
+    DecryptedIO, is_content_io, is_fake_io, block_format, \
+    BLOCK_FORMAT_SHORT, BLOCK_FORMAT_LONG
 from tests.common import testing_salt
 
 
@@ -135,6 +136,28 @@ class TestEncryptDecrypt(unittest.TestCase):
                                   part_size=MAX_CLUSTER_CONTENT_SIZE,
                                   part_idx=2)
 
+    def test_encdec_larger_clusters(self):
+        self.assertEqual(block_format(CLUSTER_SIZE), BLOCK_FORMAT_SHORT)
+        self.assertEqual(block_format(MAX_CLUSTER_SIZE), BLOCK_FORMAT_LONG)
+
+        for cluster_size in [CLUSTER_SIZE * 2, 64 * 1024, MAX_CLUSTER_SIZE]:
+            with self.subTest(f"cluster {cluster_size}"):
+                max_size = max_cluster_content_size(cluster_size)
+                body = get_noncrypt_random_bytes(max_size * 2)
+                self._encrypt_decrypt('name', body,
+                                      pos=1,
+                                      parts_len=3,
+                                      part_size=max_size,
+                                      part_idx=1,
+                                      cluster_size=cluster_size)
+                self._encrypt_decrypt('name', body[:100],
+                                      cluster_size=cluster_size)
+
+        with self.assertRaises(ValueError):
+            Encrypt(CodenameKey('name', testing_salt),
+                    parts_len=2,
+                    part_size=max_cluster_content_size(CLUSTER_SIZE) + 1)
+
     def test_encdec_part_random(self):
         for _ in range(1000):
             name_len = random.randint(0, 10)
@@ -191,6 +214,7 @@ class TestEncryptDecrypt(unittest.TestCase):
                          parts_len=1,
                          part_idx=0,
                          part_size=None,
+                         cluster_size=CLUSTER_SIZE,
 
                          check_wrong=True):
 
@@ -211,11 +235,12 @@ class TestEncryptDecrypt(unittest.TestCase):
                 Encrypt(fpk,
                         parts_len=parts_len,
                         part_idx=part_idx,
-                        part_size=part_size) \
+                        part_size=part_size,
+                        target_size=cluster_size) \
                     .io_to_io(original_io, encrypted_io)
                 encrypted_io.seek(0)
                 encrypted = encrypted_io.read()
-                self.assertEqual(len(encrypted), CLUSTER_SIZE)
+                self.assertEqual(len(encrypted), cluster_size)
 
         # checking that the original content can be found in original file,
         # but not in the encrypted file
@@ -249,7 +274,7 @@ class TestEncryptDecrypt(unittest.TestCase):
             self.assertEqual(decrypted_part_content, expected_part_content)
 
         self.assertLessEqual(len(decrypted_part_content),
-                             MAX_CLUSTER_CONTENT_SIZE)
+                             max_cluster_content_size(cluster_size))
 
         return decrypted_part_content
 
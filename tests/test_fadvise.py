@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import os
+import unittest
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from dmk._common import KEY_SALT_SIZE, CLUSTER_SIZE
+from dmk.a_utils import fadvise
+from dmk.a_utils.randoms import get_noncrypt_random_bytes
+from dmk.b_storage_file import StorageFileWriter, StorageFileReader
+
+
+@unittest.skipUnless(hasattr(os, 'posix_fadvise'), "no posix_fadvise")
+class TestFadvise(unittest.TestCase):
+
+    def test_no_file_descriptor(self):
+        with patch('os.posix_fadvise') as mock:
+            fadvise.fadvise(BytesIO(b'abc'), fadvise.WILLNEED)
+            mock.assert_not_called()
+
+    def test_disabled(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "file"
+            path.write_bytes(b'abc')
+            with path.open('rb') as f, patch('os.posix_fadvise') as mock:
+                fadvise.fadvise(f, fadvise.WILLNEED)
+                self.assertEqual(mock.call_count, 1)
+                with patch.object(fadvise, 'enabled', False):
+                    fadvise.fadvise(f, fadvise.WILLNEED)
+                self.assertEqual(mock.call_count, 1)
+
+    def test_scan_hints(self):
+        salt = get_noncrypt_random_bytes(KEY_SALT_SIZE)
+        for imprint_table in [False, True]:
+            with self.subTest(f"table {imprint_table}"), \
+                    TemporaryDirectory() as tds:
+                path = Path(tds) / "vault"
+                with path.open('wb') as f:
+                    writer = StorageFileWriter(f, salt,
+                                               imprint_table=imprint_table)
+                    for _ in range(3):
+                        writer.blobs.write_bytes(
+                            get_noncrypt_random_bytes(CLUSTER_SIZE))
+                    writer.blobs.write_tail()
+
+                with path.open('rb') as f, \
+                        patch('os.posix_fadvise') as mock:
+                    blobs = StorageFileReader(f).blobs
+                    self.assertEqual(len(list(blobs.prefixes())), 3)
+                    advices = [call.args[3] for call in mock.call_args_list]
+                    if imprint_table:
+                        self.assertEqual(advices, [fadvise.WILLNEED])
+                    else:
+                        self.assertEqual(advices, [fadvise.SEQUENTIAL,
+                                                   fadvise.NORMAL])
+                        # the reset covers only the scanned range, so it
+                        # does not change the hints of the other scans
+                        ranges = [call.args[1:3]
+                                  for call in mock.call_args_list]
+                        self.assertEqual(ranges[1], ranges[0])
+                        self.assertGreater(ranges[0][1], 0)
+
+                    mock.reset_mock()
+                    blobs.will_read([0, 2])
+                    self.assertEqual(mock.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
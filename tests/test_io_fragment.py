@@ -5,8 +5,11 @@
 import io
 import unittest
 from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
 
-from dmk.b_storage_file._10_fragment_io import FragmentIO
+from dmk.b_storage_file._10_fragment_io import FragmentIO, \
+    PositionalReader, PositionalFragmentIO, SplitFragmentIO
 
 
 class Test(unittest.TestCase):
@@ -185,5 +188,58 @@ class Test(unittest.TestCase):
                             0)
 
 
+class TestPositional(unittest.TestCase):
+
+    def test_bytesio_fallback(self):
+        with BytesIO(b'0123456789') as larger:
+            reader = PositionalReader(larger)
+            self.assertFalse(reader.uses_pread)
+            self.assertEqual(reader.read_at(3, 4), b'3456')
+            self.assertEqual(reader.read_at(8, 4), b'89')
+
+    def test_file_does_not_move_position(self):
+        with TemporaryDirectory() as tds:
+            file = Path(tds) / "data.bin"
+            file.write_bytes(b'0123456789')
+            with file.open('rb') as larger:
+                larger.seek(7, io.SEEK_SET)
+                reader = PositionalReader(larger)
+
+                a = PositionalFragmentIO(reader, 1, 5)
+                b = PositionalFragmentIO(reader, 4, 3)
+                self.assertEqual(a.read(2), b'12')
+                self.assertEqual(b.read(2), b'45')
+                self.assertEqual(a.read(), b'345')
+                self.assertEqual(b.read(), b'6')
+                self.assertEqual(a.read(), b'')
+
+                if reader.uses_pread:
+                    self.assertEqual(larger.tell(), 7)
+
+
+class TestSplit(unittest.TestCase):
+
+    def test_read(self):
+        # the block is "abc" + "3456"
+        with BytesIO(b'0123456789abcdef') as larger:
+            for reader in [None, PositionalReader(larger)]:
+                with self.subTest(f"reader {reader}"):
+                    fragment = SplitFragmentIO(larger, 10, 3, 3, 7,
+                                               reader=reader)
+                    self.assertEqual(fragment.read(), b'abc3456')
+
+                    fragment.seek(0, io.SEEK_SET)
+                    self.assertEqual(fragment.read(2), b'ab')
+                    self.assertEqual(fragment.read(2), b'c3')
+                    self.assertEqual(fragment.read(2), b'45')
+                    self.assertEqual(fragment.read(2), b'6')
+                    self.assertEqual(fragment.read(2), b'')
+
+                    fragment.seek(4, io.SEEK_SET)
+                    self.assertEqual(fragment.read(), b'456')
+                    fragment.seek(1, io.SEEK_SET)
+                    self.assertEqual(fragment.read(3), b'bc3')
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -2,9 +2,15 @@
 # SPDX-License-Identifier: MIT
 
 
+import threading
+import time
 import unittest
+from unittest.mock import patch
 
-from dmk.a_base._10_kdf import CodenameKey
+from dmk.a_base import _10_kdf
+from dmk.a_base._10_kdf import CodenameKey, derive_keys, FasterKDF
+from dmk.a_utils.randoms import get_noncrypt_random_bytes
+from dmk._common import KEY_SALT_SIZE
 from tests.common import testing_salt
 
 
@@ -38,6 +44,43 @@ class TestKdf(unittest.TestCase):
         self.assertNotEqual(CodenameKey('abc', testing_salt).as_bytes,
                             CodenameKey('d', testing_salt).as_bytes)
 
+    def test_derive_keys(self):
+        with FasterKDF():
+            names = ['a', 'b', 'a', 'c']
+            keys = derive_keys(names, testing_salt)
+            self.assertEqual([k.codename for k in keys], names)
+            self.assertEqual(
+                [k.as_bytes for k in keys],
+                [CodenameKey(name, testing_salt).as_bytes for name in names])
+
+    def test_concurrent_same_key(self):
+        original = _10_kdf._password_to_key_noncached
+        calls = []
+
+        def slow(**kwargs):
+            calls.append(kwargs['password'])
+            time.sleep(0.2)
+            return original(**kwargs)
+
+        # a new salt, so the key is not cached yet
+        salt = get_noncrypt_random_bytes(KEY_SALT_SIZE)
+        keys = []
+        with FasterKDF(), \
+                patch.object(_10_kdf, '_password_to_key_noncached', slow):
+            threads = [threading.Thread(
+                target=lambda: keys.append(CodenameKey('same', salt)))
+                for _ in range(8)]
+            for t in threads:
+                t.start()
+                time.sleep(0.01)
+            for t in threads:
+                t.join()
+            # arriving after the others are done
+            keys.append(CodenameKey('same', salt))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(k.as_bytes for k in keys)), 1)
+        self.assertEqual(_10_kdf._pending, dict())
+
     def test(self):
         # the password to key returns cached values, so we
         # test two things at once:
@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import shutil
+import tracemalloc
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable
+
+from dmk._common import CLUSTER_SIZE, KEY_SALT_SIZE, MAX_CLUSTER_CONTENT_SIZE
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.dirty_file import WritingToTempFile
+from dmk.a_utils.randoms import get_noncrypt_random_bytes
+from dmk.b_storage_file import StorageFileWriter
+
+# The peak memory may depend on the number of blocks: we keep a few small
+# objects for each of them. But it must not depend on the size of the
+# vault in bytes: the blocks are processed one by one, and the files are
+# copied and shredded by small chunks.
+
+BUFFERS_LIMIT = 64 * CLUSTER_SIZE
+PER_BLOCK_LIMIT = 512
+
+
+def peak_memory(func: Callable[[], object]) -> int:
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def create_vault_of_fakes(path: Path, blocks_num: int):
+    # random blocks are indistinguishable from fakes
+    with path.open('wb') as f:
+        writer = StorageFileWriter(f, get_noncrypt_random_bytes(KEY_SALT_SIZE))
+        for _ in range(blocks_num):
+            writer.blobs.write_bytes(get_noncrypt_random_bytes(CLUSTER_SIZE))
+        writer.blobs.write_tail()
+
+
+class TestPeakMemory(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def assertBounded(self, peak: int, blocks_num: int, entry_size: int,
+                      entry_copies: float):
+        limit = BUFFERS_LIMIT + blocks_num * PER_BLOCK_LIMIT \
+                + round(entry_size * entry_copies)
+        self.assertLess(peak, limit,
+                        f"blocks={blocks_num} entry={entry_size}")
+
+    def test_set_get(self):
+        max_entry = 256 * MAX_CLUSTER_CONTENT_SIZE
+        for blocks_num in [128, 512]:
+            for entry_size in [1, max_entry]:
+                with TemporaryDirectory() as tds:
+                    path = Path(tds) / "vault.dmk"
+                    create_vault_of_fakes(path, blocks_num)
+                    data = bytes(get_noncrypt_random_bytes(entry_size))
+                    dmk_file = DmkFile(path)
+                    _ = dmk_file.salt
+
+                    peak = peak_memory(lambda: dmk_file.set_bytes("a", data))
+                    self.assertBounded(peak, blocks_num, entry_size, 0.2)
+
+                    # the result itself, and the buffer growing to it
+                    peak = peak_memory(lambda: DmkFile(path).get_bytes("a"))
+                    self.assertBounded(peak, blocks_num, entry_size, 1.6)
+
+    def test_dummy_and_commit(self):
+        for blocks_num in [128, 512]:
+            with TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                create_vault_of_fakes(path, blocks_num)
+                dmk_file = DmkFile(path)
+                _ = dmk_file.salt
+
+                peak = peak_memory(lambda: dmk_file.add_fakes("fakes", 10))
+                self.assertBounded(peak, blocks_num, 0, 0)
+
+                with WritingToTempFile(path) as wtf:
+                    shutil.copyfile(path, wtf.dirty)
+                    self.assertLess(peak_memory(wtf.commit), BUFFERS_LIMIT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,10 +5,23 @@ import unittest
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
-from dmk import DmkFile, get_text, set_text, DmkKeyError, set_file, get_file
+from dmk import DmkFile, get_text, set_text, DmkKeyError, set_file, \
+    get_file, SegmentedDmkFile
+from dmk._vault_file_ops import sync_dir
+from dmk.a_base._10_kdf import FasterKDF
 
 
 class TestOps(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
 
     def test_get_set_text(self):
         with TemporaryDirectory() as tds:
@@ -90,3 +103,35 @@ class TestOps(unittest.TestCase):
                     set_file(dmk_file, "zzz", unexisting)
                 # we did not set
                 self.assertIsNone(dmk_file.get_bytes("zzz"))
+
+    def test_sync_dir(self):
+        for segments in [1, 3]:
+            with self.subTest(f"segments {segments}"), \
+                    TemporaryDirectory() as tds:
+                tempdir = Path(tds)
+                source = tempdir / "source"
+                (source / "sub").mkdir(parents=True)
+                (source / "a.txt").write_bytes(b'a')
+                (source / "sub" / "b.txt").write_bytes(b'b')
+                vault_path = tempdir / "vault"
+                dmk_file = DmkFile(vault_path) if segments == 1 \
+                    else SegmentedDmkFile(vault_path, segments_num=segments)
+
+                result = sync_dir(dmk_file, source, prefix="cfg/")
+                self.assertEqual(result.added, ["cfg/a.txt", "cfg/sub/b.txt"])
+                self.assertEqual(get_text(dmk_file, "cfg/sub/b.txt"), "b")
+
+                (source / "a.txt").write_bytes(b'changed')
+                (source / "c.txt").write_bytes(b'c')
+                result = sync_dir(dmk_file, source, prefix="cfg/")
+                self.assertEqual(result.added, ["cfg/c.txt"])
+                self.assertEqual(result.changed, ["cfg/a.txt"])
+                self.assertEqual(result.unchanged, ["cfg/sub/b.txt"])
+                self.assertEqual(get_text(dmk_file, "cfg/a.txt"), "changed")
+
+                (source / "c.txt").unlink()
+                result = sync_dir(dmk_file, source, prefix="cfg/")
+                self.assertEqual(result.added + result.changed, [])
+                # the entry of the deleted file stays
+                self.assertEqual(get_text(dmk_file, "cfg/c.txt"), "c")
+
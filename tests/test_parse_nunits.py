@@ -9,6 +9,7 @@ class TastParseN(unittest.TestCase):
         self.assertEqual(parse_n_units("10K"), 10240)
         self.assertEqual(parse_n_units("10k"), 10240)
         self.assertEqual(parse_n_units("10M"), 10485760)
+        self.assertEqual(parse_n_units("2G"), 2147483648)
 
     def test_errors(self):
         with self.assertRaises(ValueError):
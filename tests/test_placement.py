@@ -0,0 +1,117 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import random
+import unittest
+from itertools import islice
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF, CodenameKey
+from dmk.a_utils.randoms import random_codename_fullsize
+from dmk.b_storage_file import StorageFileReader
+from dmk.c_namegroups import NameGroup
+from dmk.c_namegroups._placement import candidate_slots
+from tests.common import testing_salt, gen_random_content, gen_random_names
+
+
+class TestPlacement(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_candidate_slots(self):
+        key = CodenameKey("abc", testing_salt)
+        for blocks_num in [1, 2, 3, 100, 1024, 1025]:
+            with self.subTest(f"blocks {blocks_num}"):
+                slots = list(candidate_slots(key, blocks_num))
+                self.assertEqual(sorted(slots), list(range(blocks_num)))
+                self.assertEqual(list(candidate_slots(key, blocks_num)),
+                                 slots)
+        self.assertEqual(list(candidate_slots(key, 0)), [])
+
+        other = list(islice(candidate_slots(CodenameKey("def", testing_salt),
+                                            1000), 20))
+        self.assertNotEqual(list(islice(candidate_slots(key, 1000), 20)),
+                            other)
+
+    def test_candidate_slots_growing(self):
+        # within the same power of two, the old indices keep their order
+        key = CodenameKey("abc", testing_salt)
+        smaller = list(candidate_slots(key, 600))
+        larger = list(candidate_slots(key, 1000))
+        self.assertEqual([slot for slot in larger if slot < 600], smaller)
+
+    def test_probed_without_scan(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, keyed_placement=True)
+            dmk_file.add_fakes(random_codename_fullsize(), 300)
+
+            reference = dict()
+            for name in gen_random_names(10):
+                size = random.choice([0, 100, MAX_CLUSTER_CONTENT_SIZE * 3])
+                reference[name] = gen_random_content(size, size)
+                dmk_file.set_bytes(name, reference[name])
+
+                # the name was just written to its slots
+                reader = DmkFile(path)
+                self.assertEqual(reader.get_bytes(name), reference[name])
+                self.assertEqual(reader.metrics['scans'], 0)
+                self.assertEqual(reader.metrics['blocks_scanned'], 0)
+                self.assertEqual(reader.metrics['probe_misses'], 0)
+
+            # the later writes of other names may have moved some blocks,
+            # but the results are the same
+            reader = DmkFile(path)
+            self.assertEqual(reader.get_many_bytes(list(reference.keys())),
+                             list(reference.values()))
+            self.assertLess(reader.metrics['scans'], 2)
+
+            self.assertEqual(reader.stats()['keyed_placement'], True)
+
+    def test_missing_name_is_scanned(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, keyed_placement=True)
+            dmk_file.set_bytes("abc", b'value')
+            dmk_file.add_fakes(random_codename_fullsize(), 100)
+
+            reader = DmkFile(path)
+            self.assertIsNone(reader.get_bytes("missing"))
+            self.assertEqual(reader.metrics['probe_misses'], 1)
+            self.assertEqual(reader.metrics['scans'], 1)
+            self.assertEqual(reader.metrics['blocks_scanned'],
+                             reader.blobs_len)
+
+    def test_single_content_version(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, keyed_placement=True)
+            dmk_file.add_fakes(random_codename_fullsize(), 50)
+            for _ in range(10):
+                data = gen_random_content(0, MAX_CLUSTER_CONTENT_SIZE * 2)
+                dmk_file.set_bytes("abc", data)
+                dmk_file.set_bytes("other", gen_random_content())
+                self.assertEqual(DmkFile(path).get_bytes("abc"), data)
+
+                # the outdated versions are removed, unlike in the vaults
+                # without the keyed placement
+                with path.open('rb') as f:
+                    ng = NameGroup(StorageFileReader(f).blobs,
+                                   CodenameKey("abc", dmk_file.salt))
+                    self.assertEqual(len(ng.all_content_versions), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
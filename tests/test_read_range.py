@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import io
+import random
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE
+from dmk._vault_file import DmkFile
+from dmk._vault_segments import SegmentedDmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.b_cryptoblobs import DecryptedIO
+from tests.common import gen_random_content
+
+
+class TestReadRange(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_read_range(self):
+        for kwargs in [{}, {'cluster_size': 65536}, {'delta_writes': True}]:
+            with self.subTest(str(kwargs)), TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, **kwargs)
+                data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 5,
+                                          MAX_CLUSTER_CONTENT_SIZE * 9)
+                dmk_file.set_bytes("abc", data)
+                # with the delta writes, the parts have different versions
+                data = data[:100] + b'X' + data[101:]
+                dmk_file.set_bytes("abc", data)
+
+                self.assertIsNone(dmk_file.read_range("other", 0, 10))
+                for _ in range(50):
+                    offset = random.randint(0, len(data) + 10)
+                    length = random.randint(0, MAX_CLUSTER_CONTENT_SIZE * 3)
+                    self.assertEqual(
+                        dmk_file.read_range("abc", offset, length),
+                        data[offset:offset + length])
+
+    def test_cached_headers_not_decrypted(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path)
+            data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 5,
+                                      MAX_CLUSTER_CONTENT_SIZE * 5)
+            dmk_file.set_bytes("abc", data)
+            dmk_file.get_bytes("abc")
+
+            with patch.object(DecryptedIO, 'data', None), \
+                    patch.object(DecryptedIO, '_DecryptedIO__read_header',
+                                 None):
+                self.assertEqual(dmk_file.read_range("abc", 5000, 100),
+                                 data[5000:5100])
+
+    def test_open_entry(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path)
+            self.assertIsNone(dmk_file.open_entry("abc"))
+            data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 3,
+                                      MAX_CLUSTER_CONTENT_SIZE * 4)
+            dmk_file.set_bytes("abc", data)
+            self.assertIsNone(dmk_file.open_entry("other"))
+
+            with dmk_file.open_entry("abc") as f:
+                self.assertEqual(f.size, len(data))
+                self.assertEqual(f.read(10), data[:10])
+                self.assertEqual(f.seek(-5, io.SEEK_END), len(data) - 5)
+                self.assertEqual(f.read(), data[-5:])
+                self.assertEqual(f.read(), b'')
+                f.seek(MAX_CLUSTER_CONTENT_SIZE - 3)
+                self.assertEqual(f.read(6), data[MAX_CLUSTER_CONTENT_SIZE - 3:
+                                                 MAX_CLUSTER_CONTENT_SIZE + 3])
+                f.seek(-2, io.SEEK_CUR)
+                self.assertEqual(f.tell(), MAX_CLUSTER_CONTENT_SIZE + 1)
+                f.seek(0)
+                self.assertEqual(io.BufferedReader(f).read(), data)
+            self.assertTrue(f.closed)
+            with self.assertRaises(ValueError):
+                f.read()
+
+    def test_empty(self):
+        with TemporaryDirectory() as tds:
+            dmk_file = DmkFile(Path(tds) / "vault.dmk")
+            dmk_file.set_bytes("abc", b'')
+            self.assertEqual(dmk_file.read_range("abc", 0, 10), b'')
+            with dmk_file.open_entry("abc") as f:
+                self.assertEqual(f.read(), b'')
+
+    def test_segmented(self):
+        with TemporaryDirectory() as tds:
+            vault = SegmentedDmkFile(Path(tds) / "vault", segments_num=2)
+            vault.set_bytes("abc", b'0123456789')
+            self.assertEqual(vault.read_range("abc", 3, 4), b'3456')
+            with vault.open_entry("abc") as f:
+                f.seek(8)
+                self.assertEqual(f.read(), b'89')
+
+
+if __name__ == "__main__":
+    unittest.main()
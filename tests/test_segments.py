@@ -0,0 +1,172 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import threading
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk._common import DmkKeyError
+from dmk._vault_file import DmkFile
+from dmk._vault_file_ops import migrate
+from dmk._vault_segments import SegmentedDmkFile, segment_index, \
+    existing_segments_num, open_dmk_file, MAX_PARALLEL_SEGMENTS
+from dmk.a_base._10_kdf import FasterKDF, CodenameKey
+from dmk.a_utils.randoms import random_codename_fullsize
+from tests.common import gen_random_content, gen_random_names
+
+
+class TestSegments(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_set_get(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault"
+            vault = SegmentedDmkFile(path, segments_num=4)
+            self.assertIsNone(vault.get_bytes("abc"))
+            self.assertFalse(path.exists())
+
+            reference = {name: gen_random_content()
+                         for name in gen_random_names(20)}
+            for name, data in reference.items():
+                vault.set_bytes(name, data)
+            self.assertEqual(existing_segments_num(path), 4)
+
+            other = SegmentedDmkFile(path, segments_num=8)
+            self.assertEqual(len(other.segments), 4)
+            self.assertEqual(other.salt, vault.salt)
+            for segment in other.segments:
+                self.assertEqual(segment.salt, vault.salt)
+            for name, data in reference.items():
+                self.assertEqual(other.get_bytes(name), data)
+            self.assertEqual(other.get_many_bytes(list(reference.keys())
+                                                  + ["missing"]),
+                             list(reference.values()) + [None])
+
+    def test_write_changes_one_segment(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault"
+            vault = SegmentedDmkFile(path, segments_num=4)
+            vault.add_fakes(random_codename_fullsize(), 10)
+            self.assertEqual(vault.blobs_len, 10)
+
+            before = {p.name: p.stat().st_ino for p in path.iterdir()}
+            vault.set_bytes("abc", b'value')
+            after = {p.name: p.stat().st_ino for p in path.iterdir()}
+
+            idx = segment_index(CodenameKey("abc", vault.salt), 4)
+            changed = [name for name in before if before[name] != after[name]]
+            self.assertEqual(changed, [vault.segments[idx].path.name])
+            self.assertEqual(DmkFile(vault.segments[idx].path)
+                             .get_bytes("abc"), b'value')
+
+    def test_set_many(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault"
+            with SegmentedDmkFile(path, segments_num=3) as vault:
+                reference = {name: gen_random_content()
+                             for name in gen_random_names(10)}
+                vault.set_many_bytes(reference)
+                self.assertEqual(vault.get_many_bytes(list(reference.keys())),
+                                 list(reference.values()))
+                stats = vault.stats()
+                self.assertEqual(stats['segments'], 3)
+                self.assertEqual(stats['vault_size'],
+                                 sum(p.stat().st_size
+                                     for p in path.iterdir()))
+
+    def test_parallel_limit(self):
+        with TemporaryDirectory() as tds:
+            vault = SegmentedDmkFile(Path(tds) / "vault", segments_num=64)
+            lock = threading.Lock()
+            running = [0]
+            most = [0]
+
+            def call(idx: int):
+                def run():
+                    with lock:
+                        running[0] += 1
+                        most[0] = max(most[0], running[0])
+                    time.sleep(0.01)
+                    with lock:
+                        running[0] -= 1
+                    return idx
+
+                return run
+
+            self.assertEqual(vault._in_parallel([call(i) for i in range(64)]),
+                             list(range(64)))
+            self.assertLessEqual(most[0], MAX_PARALLEL_SEGMENTS)
+
+    def test_create(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault"
+            SegmentedDmkFile(path, segments_num=5,
+                             cluster_size=8192).create()
+            self.assertEqual(sorted(p.name for p in path.iterdir()
+                                    if p.suffix != '.lock'),
+                             ['000', '001', '002', '003', '004'])
+            vault = open_dmk_file(path)
+            self.assertIsInstance(vault, SegmentedDmkFile)
+            self.assertEqual(vault.cluster_size, 8192)
+            self.assertEqual(vault.blobs_len, 0)
+            with self.assertRaises(FileExistsError):
+                vault.create()
+
+    def test_migrate(self):
+        with TemporaryDirectory() as tds:
+            single = DmkFile(Path(tds) / "single.dmk", cluster_size=8192)
+            reference = {name: gen_random_content(0, 20000)
+                         for name in gen_random_names(5)}
+            single.set_many_bytes(reference)
+            single.add_fakes(random_codename_fullsize(), 50)
+            names = list(reference.keys())
+
+            segmented = SegmentedDmkFile(Path(tds) / "segmented",
+                                         segments_num=4, cluster_size=8192)
+            migrate(single, segmented, names)
+            self.assertEqual(segmented.get_many_bytes(names),
+                             list(reference.values()))
+            self.assertNotEqual(segmented.salt, single.salt)
+            self.assertGreaterEqual(segmented.blobs_len, single.blobs_len)
+            # the source is not changed
+            self.assertEqual(single.get_many_bytes(names),
+                             list(reference.values()))
+
+            back = DmkFile(Path(tds) / "back.dmk")
+            migrate(segmented, back, names)
+            self.assertEqual(DmkFile(back.path).get_many_bytes(names),
+                             list(reference.values()))
+
+            with self.assertRaises(FileExistsError):
+                migrate(single, back, names)
+            missing = DmkFile(Path(tds) / "missing.dmk")
+            with self.assertRaises(DmkKeyError):
+                migrate(single, missing, names + ["missing"])
+            self.assertFalse(missing.path.exists())
+
+    def test_wrong_segments(self):
+        with TemporaryDirectory() as tds:
+            with self.assertRaises(ValueError):
+                SegmentedDmkFile(Path(tds) / "vault", segments_num=1)
+            path = Path(tds) / "broken"
+            path.mkdir()
+            (path / "000").write_bytes(b'')
+            (path / "002").write_bytes(b'')
+            with self.assertRaises(ValueError):
+                SegmentedDmkFile(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
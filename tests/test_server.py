@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import os
+import socket
+import stat
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from dmk._client import DmkClient, DmkServerError
+from dmk._server import VaultServer
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from tests.common import gen_random_names, gen_random_content
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "Unix sockets required")
+class TestServer(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def setUp(self) -> None:
+        self._temp_dir = TemporaryDirectory()
+        temp_dir = Path(self._temp_dir.name)
+        self.socket_path = temp_dir / "dmk.sock"
+        self.server = VaultServer(DmkFile(temp_dir / "vault.dmk",
+                                          keep_open=True))
+        self.thread = threading.Thread(
+            target=lambda: asyncio.run(self.server.serve(self.socket_path)))
+        self.thread.start()
+        self.assertTrue(self.server.ready.wait(10))
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.thread.join()
+        self.server.dmk_file.close()
+        self.assertFalse(self.socket_path.exists())
+        self._temp_dir.cleanup()
+
+    def test_set_get(self):
+        with DmkClient(self.socket_path) as client:
+            client.ping()
+            self.assertIsNone(client.get_bytes("abc"))
+            client.set_bytes("abc", b'value')
+            self.assertEqual(client.get_bytes("abc"), b'value')
+            client.set_text("abc", "другое")
+            self.assertEqual(client.get_text("abc"), "другое")
+            client.set_bytes("empty", b'')
+            self.assertEqual(client.get_bytes("empty"), b'')
+
+            stats = client.stats()
+            self.assertGreater(stats['blocks'], 0)
+            self.assertEqual(stats['bytes_set'], len(b'value') +
+                             len("другое".encode('utf-8')))
+            self.assertGreaterEqual(stats['requests'], 8)
+
+    def test_socket_permissions(self):
+        # the socket is created without access for the others, even
+        # before its mode is changed
+        socket_path = self.socket_path.with_name("other.sock")
+        server = VaultServer(self.server.dmk_file)
+        modes = []
+        original_chmod = os.chmod
+
+        def chmod(path, mode):
+            modes.append(stat.S_IMODE(os.stat(path).st_mode))
+            original_chmod(path, mode)
+
+        with patch('os.chmod', chmod):
+            thread = threading.Thread(
+                target=lambda: asyncio.run(server.serve(socket_path)))
+            thread.start()
+            self.assertTrue(server.ready.wait(10))
+        server.stop()
+        thread.join()
+        self.assertEqual(len(modes), 1)
+        self.assertEqual(modes[0] & 0o077, 0)
+
+    def test_errors(self):
+        with DmkClient(self.socket_path) as client:
+            with self.assertRaises(DmkServerError):
+                client._request({'op': 'get'})
+            with self.assertRaises(DmkServerError):
+                client._request({'op': 'unknown', 'name': 'abc'})
+            # the connection is still usable
+            client.ping()
+
+    def test_concurrent_clients(self):
+        reference = {name: gen_random_content(max_size=1024 * 8)
+                     for name in gen_random_names(6)}
+        with DmkClient(self.socket_path) as client:
+            for name, data in reference.items():
+                client.set_bytes(name, data)
+
+        def read_all(_):
+            with DmkClient(self.socket_path) as c:
+                return {name: c.get_bytes(name) for name in reference}
+
+        # while a lookup runs, the gets of the other clients wait for it
+        # and then go to the vault together
+        dmk_file = self.server.dmk_file
+        get_many_bytes = dmk_file.get_many_bytes
+
+        def slow_get_many_bytes(names):
+            time.sleep(0.02)
+            return get_many_bytes(names)
+
+        batches_before = self.server.get_batches
+        with patch.object(dmk_file, 'get_many_bytes', slow_get_many_bytes), \
+                ThreadPoolExecutor(max_workers=8) as executor:
+            for result in executor.map(read_all, range(16)):
+                self.assertEqual(result, reference)
+
+        gets_sent = 16 * len(reference)
+        batches = self.server.get_batches - batches_before
+        self.assertLess(batches, gets_sent / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
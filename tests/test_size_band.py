@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk._vault_file import DmkFile
+from dmk._vault_segments import SegmentedDmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.randoms import random_codename_fullsize
+from dmk.b_storage_file import SizeBand
+from dmk.c_namegroups._update import FakeDeltas
+from tests.common import gen_random_content, gen_random_names
+
+
+class TestFakeDeltas(unittest.TestCase):
+
+    def test_no_band(self):
+        deltas = FakeDeltas(1000, 1)
+        self.assertEqual((deltas.min_loss, deltas.min_add), (1, 1))
+        self.assertEqual(deltas.max_loss, 50)
+        self.assertGreaterEqual(deltas.max_add, deltas.max_loss)
+
+    def test_over_max(self):
+        deltas = FakeDeltas(1000, 2, SizeBand(max_blocks=900))
+        self.assertEqual(deltas.min_loss, deltas.max_loss)
+        self.assertEqual(deltas.max_loss, 103)
+        self.assertEqual((deltas.min_add, deltas.max_add), (1, 1))
+
+    def test_under_min(self):
+        deltas = FakeDeltas(100, 1, SizeBand(min_blocks=1000))
+        self.assertEqual(deltas.max_loss, 1)
+        self.assertEqual(deltas.min_add, deltas.max_add)
+        self.assertEqual(deltas.max_add, 100)
+
+        deltas = FakeDeltas(0, 1, SizeBand(min_blocks=1000))
+        self.assertGreaterEqual(deltas.min_add, 1)
+
+    def test_inside(self):
+        deltas = FakeDeltas(1000, 1, SizeBand(998, 1002))
+        # the vault stays in the band whatever the random choice
+        self.assertGreaterEqual(1000 - deltas.max_loss + 1 + deltas.min_add,
+                                998)
+        self.assertLessEqual(1000 - deltas.min_loss + 1 + deltas.max_add,
+                             1002)
+
+
+class TestSizeBand(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def _write_many(self, dmk_file, names, times: int):
+        for _ in range(times):
+            for name in names:
+                dmk_file.set_bytes(name, gen_random_content(0, 1000))
+
+    def test_shrinks_to_max(self):
+        for append_writes in [False, True]:
+            with self.subTest(f"append {append_writes}"), \
+                    TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, append_writes=append_writes,
+                                   compact_ratio=2)
+                names = gen_random_names(3)
+                self._write_many(dmk_file, names, 3)
+                dmk_file.add_fakes(random_codename_fullsize(), 10)
+                dmk_file.set_size_band(0, 30)
+                self.assertEqual(DmkFile(path).layout.max_blocks, 30)
+                self._write_many(dmk_file, names, 15)
+                self.assertLessEqual(dmk_file.blobs_len, 30)
+                for name in names:
+                    self.assertIsNotNone(DmkFile(path).get_bytes(name))
+
+    def test_grows_to_min(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, min_blocks=200)
+            self._write_many(dmk_file, ["abc"], 1)
+            self.assertEqual(dmk_file.layout.min_blocks, 200)
+            self._write_many(dmk_file, ["abc"], 15)
+            self.assertGreaterEqual(dmk_file.blobs_len, 200)
+
+            # inside the band, the number of blocks stays there
+            dmk_file.set_size_band(200, 300)
+            self._write_many(dmk_file, ["abc", "def"], 10)
+            self.assertGreaterEqual(dmk_file.blobs_len, 200)
+            self.assertLessEqual(dmk_file.blobs_len, 300)
+
+    def test_set_size_band_keeps_blocks(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path)
+            dmk_file.set_bytes("abc", b'value')
+            blocks = dmk_file.blobs_len
+            dmk_file.set_size_band(5, 10)
+            self.assertEqual(dmk_file.blobs_len, blocks)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), b'value')
+            dmk_file.set_size_band(0, 0)
+            self.assertEqual(dmk_file.layout.max_blocks, 0)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), b'value')
+            with self.assertRaises(ValueError):
+                dmk_file.set_size_band(10, 5)
+
+    def test_segmented(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault"
+            vault = SegmentedDmkFile(path, segments_num=4, max_blocks=100)
+            vault.set_bytes("abc", b'value')
+            self.assertEqual(vault.layout.max_blocks, 100)
+            self.assertEqual(vault.segments[0].layout.max_blocks, 25)
+            vault.set_size_band(40, 0)
+            self.assertEqual(SegmentedDmkFile(path).layout.min_blocks, 40)
+            self.assertEqual(vault.get_bytes("abc"), b'value')
+
+
+if __name__ == "__main__":
+    unittest.main()
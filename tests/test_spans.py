@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import json
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from click.testing import CliRunner
+
+from dmk import dmk_cli
+from dmk._vault_file import DmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils import spans
+
+
+class TestSpans(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def tearDown(self) -> None:
+        spans.disable()
+
+    def test_disabled(self):
+        self.assertIs(spans.span('a'), spans.span('b'))
+        with spans.span('a') as s:
+            s.add('blocks', 5)
+
+    def test_nested(self):
+        recorder = spans.enable()
+        with spans.span('outer') as outer:
+            outer.add('blocks', 2)
+            for _ in range(3):
+                with spans.span('inner') as inner:
+                    inner.add('blocks')
+        spans.disable()
+        with spans.span('ignored'):
+            pass
+
+        rows = recorder.summary()
+        self.assertEqual([r['name'] for r in rows], ['outer', 'inner'])
+        self.assertEqual(rows[0]['depth'], 0)
+        self.assertEqual(rows[0]['counts'], {'blocks': 2})
+        self.assertEqual(rows[1]['depth'], 1)
+        self.assertEqual(rows[1]['calls'], 3)
+        self.assertEqual(rows[1]['counts'], {'blocks': 3})
+        self.assertGreaterEqual(rows[0]['ms'], rows[1]['ms'])
+
+        self.assertIn('inner', recorder.format_table())
+        self.assertEqual(len(json.loads(recorder.format_json())['spans']), 4)
+
+    def test_vault_stages(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("a", b'1')
+
+            recorder = spans.enable()
+            DmkFile(path).set_bytes("a", b'2')
+            self.assertEqual(DmkFile(path).get_bytes("a"), b'2')
+            spans.disable()
+
+            names = set(s.name for s in recorder.spans)
+            self.assertTrue({'kdf', 'scan', 'namegroup', 'decrypt',
+                             'update', 'commit', 'shred'} <= names)
+            decrypt = next(s for s in recorder.spans if s.name == 'decrypt')
+            self.assertEqual(decrypt.counts['bytes_written'], 1)
+
+    def test_cli(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("abc", b'value')
+
+            result = CliRunner().invoke(
+                dmk_cli, ['-v', str(path), '--timings-json',
+                          'get', '-e', 'abc'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(result.stdout.strip(), 'value')
+            names = [s['name'] for s in json.loads(result.stderr)['spans']]
+            self.assertIn('decrypt', names)
+
+            result = CliRunner(env={spans.TIMINGS_ENVNAME: 'table'}).invoke(
+                dmk_cli, ['-v', str(path), 'get', '-e', 'abc'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('decrypt', result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import subprocess
+import sys
+import unittest
+
+HEAVY_MODULES = ['Crypto', 'argon2', 'click_shell']
+
+
+def imported_after(code: str):
+    """Runs the code in a new interpreter and returns the top-level names
+    of the imported modules."""
+    result = subprocess.run(
+        [sys.executable, '-c',
+         code + '\nimport sys\nprint(" ".join(sys.modules))'],
+        capture_output=True, text=True, check=True)
+    return set(name.split('.')[0] for name in result.stdout.split())
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_is_light(self):
+        modules = imported_after('import dmk')
+        for heavy in HEAVY_MODULES:
+            self.assertNotIn(heavy, modules)
+
+    def test_vault_command_is_light(self):
+        modules = imported_after(
+            'from click.testing import CliRunner\n'
+            'from dmk import dmk_cli\n'
+            'assert CliRunner().invoke(dmk_cli, ["vault"]).exit_code == 0')
+        for heavy in HEAVY_MODULES:
+            self.assertNotIn(heavy, modules)
+
+    def test_lazy_exports(self):
+        modules = imported_after('from dmk import DmkFile, get_text')
+        self.assertIn('Crypto', modules)
+        self.assertNotIn('click_shell', modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,10 +6,12 @@ import io
 import unittest
 from io import BytesIO
 
-from dmk._common import KEY_SALT_SIZE, CLUSTER_SIZE
+from dmk._common import KEY_SALT_SIZE, CLUSTER_SIZE, MAX_CLUSTER_SIZE, \
+    BLOCK_PREFIX_SIZE
 from dmk.a_utils.randoms import get_noncrypt_random_bytes
 from dmk.b_storage_file._30_storage_file import StorageFileWriter, \
-    StorageFileReader, version_to_bytes, bytes_to_version
+    StorageFileReader, version_to_bytes, bytes_to_version, \
+    BLOCKS_START_POS_V2, BAND_SIZE, Layout
 
 
 class TestContainerFile(unittest.TestCase):
@@ -52,9 +54,116 @@ class TestContainerFile(unittest.TestCase):
             self.assertEqual(reader.blobs.io(2).read(), c)
             self.assertEqual(reader.blobs.io(0).read(), a)
             self.assertEqual(reader.blobs.io(2).read(), c)
+            self.assertEqual(reader.version, 1)
+            self.assertEqual(reader.cluster_size, CLUSTER_SIZE)
 
         pass
 
+    def test_cluster_sizes(self):
+        salt = get_noncrypt_random_bytes(KEY_SALT_SIZE)
+
+        for cluster_size in [CLUSTER_SIZE * 2, 64 * 1024, MAX_CLUSTER_SIZE]:
+            with self.subTest(f"cluster {cluster_size}"), \
+                    BytesIO() as stream:
+                writer = StorageFileWriter(stream, salt, cluster_size)
+                self.assertEqual(writer.version, 2)
+
+                a = get_noncrypt_random_bytes(cluster_size)
+                b = get_noncrypt_random_bytes(cluster_size)
+                writer.blobs.write_bytes(a)
+                writer.blobs.write_bytes(b)
+                writer.blobs.write_tail()
+
+                stream.seek(0, io.SEEK_SET)
+                reader = StorageFileReader(stream)
+                self.assertEqual(reader.version, 2)
+                self.assertEqual(reader.cluster_size, cluster_size)
+                self.assertEqual(reader.salt, salt)
+                self.assertEqual(len(reader.blobs), 2)
+                self.assertEqual(reader.blobs.io(1).read(), b)
+                self.assertEqual(reader.blobs.io(0).read(), a)
+
+    def test_imprint_table(self):
+        salt = get_noncrypt_random_bytes(KEY_SALT_SIZE)
+
+        for cluster_size in [CLUSTER_SIZE, 64 * 1024]:
+            for blocks_num in [0, 1, 5]:
+                with self.subTest(f"cluster {cluster_size} "
+                                  f"blocks {blocks_num}"), \
+                        BytesIO() as stream:
+                    writer = StorageFileWriter(stream, salt, cluster_size,
+                                               imprint_table=True)
+                    self.assertEqual(writer.version, 2)
+                    blocks = [get_noncrypt_random_bytes(cluster_size)
+                              for _ in range(blocks_num)]
+                    for block in blocks:
+                        writer.blobs.write_bytes(block)
+                    writer.blobs.write_tail()
+
+                    # the prefixes are together after the bodies
+                    table = b''.join(block[:BLOCK_PREFIX_SIZE]
+                                     for block in blocks)
+                    table_pos = BLOCKS_START_POS_V2 + blocks_num * (
+                            cluster_size - BLOCK_PREFIX_SIZE)
+                    data = stream.getvalue()
+                    self.assertEqual(
+                        data[table_pos:table_pos + len(table)], table)
+
+                    for positional in [False, True]:
+                        stream.seek(0, io.SEEK_SET)
+                        reader = StorageFileReader(stream,
+                                                   positional=positional)
+                        self.assertTrue(reader.imprint_table)
+                        self.assertEqual(reader.cluster_size, cluster_size)
+                        self.assertEqual(reader.salt, salt)
+                        self.assertEqual(len(reader.blobs), blocks_num)
+                        for idx in reversed(range(blocks_num)):
+                            self.assertEqual(reader.blobs.io(idx).read(),
+                                             blocks[idx])
+                        self.assertEqual(
+                            list(reader.blobs.prefixes()),
+                            [block[:BLOCK_PREFIX_SIZE] for block in blocks])
+
+    def test_size_band(self):
+        salt = get_noncrypt_random_bytes(KEY_SALT_SIZE)
+        for min_blocks, max_blocks in [(0, 10), (5, 0), (5, 5),
+                                       (0xFFFFFFFF, 0xFFFFFFFF)]:
+            with self.subTest(f"{min_blocks} {max_blocks}"), \
+                    BytesIO() as stream:
+                writer = StorageFileWriter(stream, salt,
+                                           min_blocks=min_blocks,
+                                           max_blocks=max_blocks)
+                self.assertEqual(writer.version, 2)
+                block = get_noncrypt_random_bytes(CLUSTER_SIZE)
+                writer.blobs.write_bytes(block)
+                writer.blobs.write_tail()
+
+                data = stream.getvalue()
+                self.assertEqual(
+                    data[BLOCKS_START_POS_V2 + BAND_SIZE:][:CLUSTER_SIZE],
+                    block)
+                stream.seek(0, io.SEEK_SET)
+                reader = StorageFileReader(stream)
+                self.assertEqual(reader.layout,
+                                 Layout(min_blocks=min_blocks,
+                                        max_blocks=max_blocks))
+                self.assertEqual(reader.blobs.io(0).read(), block)
+
+        for min_blocks, max_blocks in [(10, 5), (-1, 0), (0, 0x100000000)]:
+            with self.subTest(f"wrong {min_blocks} {max_blocks}"):
+                with self.assertRaises(ValueError):
+                    StorageFileWriter(BytesIO(), salt,
+                                      min_blocks=min_blocks,
+                                      max_blocks=max_blocks)
+
+    def test_wrong_cluster_sizes(self):
+        salt = get_noncrypt_random_bytes(KEY_SALT_SIZE)
+        for cluster_size in [0, CLUSTER_SIZE // 2, CLUSTER_SIZE + 1,
+                             MAX_CLUSTER_SIZE * 2]:
+            with self.subTest(f"cluster {cluster_size}"):
+                with self.assertRaises(ValueError):
+                    StorageFileWriter(BytesIO(), salt, cluster_size)
+
 
 if __name__ == "__main__":
     unittest.main()
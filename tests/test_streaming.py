@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import io
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE
+from dmk._vault_file import DmkFile
+from dmk._vault_stream import StreamedVault
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.randoms import random_codename_fullsize
+from tests.common import gen_random_content, gen_random_names
+
+
+class NonSeekable(io.RawIOBase):
+    """Reads the bytes by small pieces, like a pipe, and cannot seek."""
+
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._data.read(min(len(buffer), 1000))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class TestStreaming(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_get_many(self):
+        for kwargs in [{}, {'keyed_placement': True},
+                       {'append_writes': True, 'delta_writes': True},
+                       {'cluster_size': 8192}]:
+            with self.subTest(str(kwargs)), TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, **kwargs)
+                dmk_file.add_fakes(random_codename_fullsize(), 10)
+                reference = {name: gen_random_content(
+                    0, MAX_CLUSTER_CONTENT_SIZE * 3)
+                    for name in gen_random_names(4)}
+                for name, data in reference.items():
+                    dmk_file.set_bytes(name, b'old')
+                    dmk_file.set_bytes(name, data)
+                names = list(reference.keys()) + ["missing"]
+
+                vault = StreamedVault(NonSeekable(path.read_bytes()))
+                self.assertEqual(vault.salt, dmk_file.salt)
+                self.assertEqual(vault.get_many_bytes(names),
+                                 list(reference.values()) + [None])
+                self.assertEqual(vault.metrics['blocks_scanned'],
+                                 dmk_file.blobs_len)
+                # the stream is read already
+                with self.assertRaises(ValueError):
+                    vault.get_bytes(names[0])
+
+    def test_imprint_table(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path, imprint_table=True).set_bytes("abc", b'value')
+            with self.assertRaises(ValueError):
+                StreamedVault(NonSeekable(path.read_bytes()))
+
+
+if __name__ == "__main__":
+    unittest.main()
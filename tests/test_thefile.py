@@ -2,13 +2,16 @@
 # SPDX-License-Identifier: MIT
 import random
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
+from dmk._common import MAX_CLUSTER_SIZE
 from dmk._vault_file import DmkFile
 from dmk.a_base._10_kdf import FasterKDF
 from dmk.a_utils.randoms import random_codename_fullsize
+from dmk.b_storage_file._30_storage_file import BLOCKS_START_POS_V2
 from tests.common import gen_random_content, gen_random_names
 
 
@@ -73,6 +76,86 @@ class TestTheFile(unittest.TestCase):
                 for name, data in names_and_datas:
                     self.assertEqual(crypto_dir_b.get_bytes(name), data)
 
+    def test_cluster_size(self):
+        for cluster_size in [64 * 1024, MAX_CLUSTER_SIZE]:
+            with self.subTest(f"cluster {cluster_size}"), \
+                    TemporaryDirectory() as tds:
+                file_path = Path(tds) / "file.dat"
+                the_file = DmkFile(file_path, cluster_size=cluster_size)
+                self.assertEqual(the_file.cluster_size, cluster_size)
+
+                small = gen_random_content(max_size=100)
+                large = bytes(cluster_size * 2 + 123)
+                the_file.set_bytes("small", small)
+                the_file.set_bytes("large", large)
+                the_file.add_fakes(random_codename_fullsize(), 3)
+
+                # the cluster size is read from the file
+                other = DmkFile(file_path)
+                self.assertEqual(other.cluster_size, cluster_size)
+                self.assertEqual(other.get_bytes("small"), small)
+                self.assertEqual(other.get_bytes("large"), large)
+                self.assertEqual(other.stats()['cluster_size'], cluster_size)
+                # the sets may also add some fakes
+                self.assertGreaterEqual(other.blobs_len, 1 + 3 + 3)
+                self.assertEqual(
+                    (file_path.stat().st_size - BLOCKS_START_POS_V2)
+                    // cluster_size, other.blobs_len)
+
+    def test_imprint_table(self):
+        with TemporaryDirectory() as tds:
+            file_path = Path(tds) / "file.dat"
+            the_file = DmkFile(file_path, imprint_table=True)
+            reference = {name: gen_random_content(max_size=1024 * 16)
+                         for name in gen_random_names(5)}
+            for name, data in reference.items():
+                the_file.set_bytes(name, data)
+            the_file.add_fakes(random_codename_fullsize(), 10)
+
+            # the layout is read from the file
+            other = DmkFile(file_path)
+            self.assertTrue(other.stats()['imprint_table'])
+            for name, data in reference.items():
+                self.assertEqual(other.get_bytes(name), data)
+            other.set_bytes("new", b"value")
+            self.assertTrue(DmkFile(file_path).stats()['imprint_table'])
+            self.assertEqual(DmkFile(file_path).get_bytes("new"), b"value")
+
+    def test_create(self):
+        with TemporaryDirectory() as tds:
+            file_path = Path(tds) / "file.dat"
+            DmkFile(file_path, cluster_size=64 * 1024).create()
+            the_file = DmkFile(file_path)
+            self.assertEqual(the_file.blobs_len, 0)
+            self.assertEqual(the_file.cluster_size, 64 * 1024)
+            self.assertIsNone(the_file.get_bytes("name"))
+            with self.assertRaises(FileExistsError):
+                the_file.create()
+
+    def test_concurrent_get(self):
+        for keep_open in [False, True]:
+            with self.subTest(f"keep_open {keep_open}"), \
+                    TemporaryDirectory() as tds:
+                file_path = Path(tds) / "file.dat"
+                # with `keep_open`, all the threads read through the same
+                # opened file (see `OpenedVault`)
+                the_file = DmkFile(file_path, keep_open=keep_open)
+
+                reference = {name: gen_random_content(max_size=1024 * 16)
+                             for name in gen_random_names(5)}
+                for name, data in reference.items():
+                    the_file.set_bytes(name, data)
+
+                names = list(reference.keys()) * 8
+                random.shuffle(names)
+
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    results = list(executor.map(the_file.get_bytes, names))
+
+                for name, result in zip(names, results):
+                    self.assertEqual(result, reference[name])
+                the_file.close()
+
 
 if __name__ == "__main__":
     unittest.main()
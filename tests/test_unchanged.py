@@ -0,0 +1,204 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import os
+import threading
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from dmk import _vault_file
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE
+from dmk._vault_file import DmkFile, DmkVersionError
+from dmk._vault_segments import SegmentedDmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.randoms import random_codename_fullsize
+from tests.common import gen_random_content, gen_random_names
+
+
+class TestUnchanged(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_same_content_skipped(self):
+        for kwargs in [{}, {'append_writes': True}, {'delta_writes': True},
+                       {'keyed_placement': True}]:
+            with self.subTest(str(kwargs)), TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, **kwargs)
+                dmk_file.add_fakes(random_codename_fullsize(), 10)
+                data = gen_random_content(0, MAX_CLUSTER_CONTENT_SIZE * 3)
+                dmk_file.set_bytes("abc", data)
+                old_bytes = path.read_bytes()
+
+                dmk_file.set_bytes("abc", data)
+                dmk_file.set_many_bytes({"abc": data})
+                self.assertEqual(dmk_file.metrics['writes_skipped'], 2)
+                self.assertEqual(path.read_bytes(), old_bytes)
+
+                changed = data + b'!'
+                dmk_file.set_bytes("abc", changed)
+                self.assertEqual(DmkFile(path).get_bytes("abc"), changed)
+
+    def test_same_crc(self):
+        # the same size and CRC-32, but different bytes
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path)
+            dmk_file.set_bytes("abc", bytes.fromhex('9c65a4472efc'))
+            dmk_file.set_bytes("abc", bytes.fromhex('48ef812d1714'))
+            self.assertEqual(dmk_file.metrics.snapshot()
+                             .get('writes_skipped', 0), 0)
+            self.assertEqual(DmkFile(path).get_bytes("abc"),
+                             bytes.fromhex('48ef812d1714'))
+
+    def test_set_many_partly_changed(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path)
+            reference = {name: gen_random_content()
+                         for name in gen_random_names(4)}
+            dmk_file.set_many_bytes(reference)
+            changed_name = next(iter(reference))
+            reference[changed_name] = b'changed'
+            dmk_file.set_many_bytes(reference)
+            self.assertEqual(dmk_file.metrics['writes_skipped'], 3)
+            self.assertEqual(DmkFile(path).get_many_bytes(
+                list(reference.keys())), list(reference.values()))
+
+    def test_set_if_version(self):
+        for kwargs in [{}, {'append_writes': True}]:
+            with self.subTest(str(kwargs)), TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                dmk_file = DmkFile(path, **kwargs)
+                self.assertEqual(dmk_file.get_bytes_and_version("abc"),
+                                 (None, None))
+                dmk_file.set_if_version("abc", b'first', None)
+                data, version = dmk_file.get_bytes_and_version("abc")
+                self.assertEqual(data, b'first')
+                self.assertIsNotNone(version)
+
+                # another writer
+                DmkFile(path).set_bytes("abc", b'other')
+                with self.assertRaises(DmkVersionError):
+                    dmk_file.set_if_version("abc", b'second', version)
+                with self.assertRaises(DmkVersionError):
+                    dmk_file.set_if_version("abc", b'second', None)
+                self.assertEqual(DmkFile(path).get_bytes("abc"), b'other')
+
+                _, version = dmk_file.get_bytes_and_version("abc")
+                dmk_file.set_if_version("abc", b'second', version)
+                self.assertEqual(DmkFile(path).get_bytes_and_version("abc"),
+                                 (b'second', dmk_file.get_bytes_and_version(
+                                     "abc")[1]))
+                self.assertNotEqual(
+                    dmk_file.get_bytes_and_version("abc")[1], version)
+
+    def test_racing_writers(self):
+        for kwargs in [{}, {'append_writes': True}]:
+            with self.subTest(str(kwargs)), TemporaryDirectory() as tds:
+                path = Path(tds) / "vault.dmk"
+                DmkFile(path).set_bytes("abc", b'first')
+                _, version = DmkFile(path).get_bytes_and_version("abc")
+
+                # each writer has its own object, as if in its own process
+                writers = [DmkFile(path, **kwargs) for _ in range(8)]
+                barrier = threading.Barrier(len(writers))
+                succeeded = []
+
+                def write(idx: int):
+                    barrier.wait()
+                    try:
+                        writers[idx].set_if_version(
+                            "abc", f'writer {idx}'.encode(), version)
+                        succeeded.append(idx)
+                    except DmkVersionError:
+                        pass
+
+                def slow(func):
+                    # the writers check the version before this
+                    def wrapper(*args, **kwargs):
+                        time.sleep(0.05)
+                        return func(*args, **kwargs)
+
+                    return wrapper
+
+                threads = [threading.Thread(target=write, args=(idx,))
+                           for idx in range(len(writers))]
+                with patch.object(_vault_file, 'update_namegroup_b',
+                                  slow(_vault_file.update_namegroup_b)), \
+                        patch.object(_vault_file, 'append_namegroups_b',
+                                     slow(_vault_file.append_namegroups_b)):
+                    for t in threads:
+                        t.start()
+                    for t in threads:
+                        t.join()
+                self.assertEqual(len(succeeded), 1)
+                self.assertEqual(DmkFile(path).get_bytes("abc"),
+                                 f'writer {succeeded[0]}'.encode())
+
+    def test_changed_during_write(self):
+        # by a writer that does not lock the vault
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            other_path = Path(tds) / "other.dmk"
+            dmk_file = DmkFile(path)
+            dmk_file.set_bytes("abc", b'first')
+            _, version = dmk_file.get_bytes_and_version("abc")
+            other_path.write_bytes(path.read_bytes())
+            DmkFile(other_path).set_bytes("abc", b'other')
+
+            original = _vault_file.update_namegroup_b
+
+            def another_writer(*args, **kwargs):
+                os.replace(other_path, path)
+                return original(*args, **kwargs)
+
+            with patch.object(_vault_file, 'update_namegroup_b',
+                              another_writer):
+                with self.assertRaises(DmkVersionError):
+                    dmk_file.set_if_version("abc", b'second', version)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), b'other')
+            self.assertEqual(sorted(p.name for p in Path(tds).iterdir()),
+                             ["other.dmk.lock", "vault.dmk",
+                              "vault.dmk.lock"])
+
+    def test_version_with_manifest(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            dmk_file = DmkFile(path, delta_writes=True)
+            data = gen_random_content(MAX_CLUSTER_CONTENT_SIZE * 3,
+                                      MAX_CLUSTER_CONTENT_SIZE * 3)
+            dmk_file.set_bytes("abc", data)
+            _, old_version = dmk_file.get_bytes_and_version("abc")
+            dmk_file.set_bytes("abc", data + b'!')
+            self.assertGreater(dmk_file.metrics['parts_reused'], 0)
+            _, version = dmk_file.get_bytes_and_version("abc")
+            self.assertGreater(version, old_version)
+            dmk_file.set_if_version("abc", b'new', version)
+            self.assertEqual(DmkFile(path).get_bytes("abc"), b'new')
+
+    def test_segmented(self):
+        with TemporaryDirectory() as tds:
+            vault = SegmentedDmkFile(Path(tds) / "vault", segments_num=3)
+            vault.set_if_version("abc", b'first', None)
+            _, version = vault.get_bytes_and_version("abc")
+            vault.set_if_version("abc", b'second', version)
+            with self.assertRaises(DmkVersionError):
+                vault.set_if_version("abc", b'third', version)
+            self.assertEqual(vault.get_bytes("abc"), b'second')
+
+
+if __name__ == "__main__":
+    unittest.main()
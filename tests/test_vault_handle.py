@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from dmk._vault_file import DmkFile
+from dmk._vault_handle import VaultHandle
+from dmk.a_base._10_kdf import FasterKDF, CodenameKey
+from dmk.a_utils.randoms import random_codename_fullsize
+
+
+class TestVaultHandle(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_missing_file(self):
+        with TemporaryDirectory() as tds:
+            handle = VaultHandle(Path(tds) / "vault.dmk")
+            with handle.opened() as vault:
+                self.assertIsNone(vault)
+
+    def test_scan_results_are_cached(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("abc", b'value')
+
+            handle = VaultHandle(path)
+            with handle.opened() as vault:
+                assert vault is not None
+                ck = CodenameKey("abc", vault.reader.salt)
+                ng = vault.name_group(ck)
+                self.assertEqual(len(ng.fresh_content_dios), 1)
+                self.assertIn(ck.as_bytes, vault.groups)
+                cached = vault.groups[ck.as_bytes]
+                self.assertEqual(len(cached.fresh_indices), 1)
+
+            # the file is closed, but the scan result is still known
+            with handle.opened() as vault:
+                assert vault is not None
+                self.assertIs(vault.groups[ck.as_bytes], cached)
+                ng = vault.name_group(ck, fresh_only=True)
+                self.assertEqual([item.idx for item in ng.items],
+                                 list(cached.fresh_indices))
+                self.assertEqual(ng.fresh_content_dios[0].read_data(),
+                                 b'value')
+
+            # after the file changes, the results are forgotten
+            DmkFile(path).set_bytes("abc", b'other')
+            with handle.opened() as vault:
+                assert vault is not None
+                self.assertNotIn(ck.as_bytes, vault.groups)
+
+    def test_keep_open(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("abc", b'value')
+
+            handle = VaultHandle(path, keep_open=True)
+            with handle.opened() as vault_a:
+                pass
+            with handle.opened() as vault_b:
+                pass
+            self.assertIs(vault_a, vault_b)
+            assert vault_a is not None
+            self.assertFalse(vault_a.file.closed)
+            handle.close()
+            self.assertTrue(vault_a.file.closed)
+
+    def test_dmk_file_sees_external_changes(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            with DmkFile(path) as reader:
+                DmkFile(path).set_bytes("abc", b'one')
+                self.assertEqual(reader.get_bytes("abc"), b'one')
+                self.assertEqual(reader.get_bytes("abc"), b'one')
+
+                DmkFile(path).set_bytes("abc", b'two')
+                self.assertEqual(reader.get_bytes("abc"), b'two')
+
+                reader.set_bytes("abc", b'three')
+                self.assertEqual(reader.get_bytes("abc"), b'three')
+                self.assertEqual(DmkFile(path).get_bytes("abc"), b'three')
+
+    def test_prefetch(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            writer = DmkFile(path)
+            writer.add_fakes(random_codename_fullsize(), 20)
+            writer.set_bytes("abc", b'value')
+            blocks = writer.blobs_len
+
+            # the key takes a while, so the prefetch reads all the blocks
+            original = CodenameKey.__init__
+
+            def slow_init(*args, **kwargs):
+                time.sleep(0.3)
+                original(*args, **kwargs)
+
+            dmk_file = DmkFile(path)
+            with patch.object(CodenameKey, '__init__', slow_init):
+                self.assertEqual(dmk_file.get_bytes("abc"), b'value')
+                self.assertEqual(dmk_file.metrics['blocks_prefetched'],
+                                 blocks)
+                self.assertEqual(dmk_file.metrics['scans'], 1)
+
+                # the names are known now, there is nothing to prefetch
+                self.assertEqual(dmk_file.get_bytes("abc"), b'value')
+                self.assertEqual(dmk_file.metrics['blocks_prefetched'],
+                                 blocks)
+                self.assertIsNone(dmk_file.get_bytes("missing"))
+                self.assertEqual(dmk_file.metrics['scans'], 2)
+                self.assertEqual(dmk_file.metrics['blocks_prefetched'],
+                                 blocks)
+
+            # the prefetch of an outdated file is not used
+            handle = VaultHandle(path)
+            handle.prefetch()
+            writer.set_bytes("abc", b'other')
+            with handle.opened() as vault:
+                assert vault is not None
+                ck = CodenameKey("abc", vault.reader.salt)
+                self.assertEqual(vault.name_group(ck, fresh_only=True)
+                                 .fresh_content_dios[0].read_data(),
+                                 b'other')
+            handle.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: (c) 2021-2023 Artёm IG <github.com/rtmigo>
+# SPDX-License-Identifier: MIT
+
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dmk._common import MAX_CLUSTER_CONTENT_SIZE
+from dmk._vault_file import DmkFile
+from dmk._vault_memory import MemoryDmkFile
+from dmk.a_base._10_kdf import FasterKDF
+from dmk.a_utils.randoms import random_codename_fullsize
+from tests.common import gen_random_content, gen_random_names
+
+
+class TestMemoryDmkFile(unittest.TestCase):
+    faster: FasterKDF
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.faster = FasterKDF()
+        cls.faster.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.faster.end()
+
+    def test_set_get(self):
+        for kwargs in [{}, {'keyed_placement': True},
+                       {'imprint_table': True}, {'delta_writes': True},
+                       {'cluster_size': 8192, 'min_blocks': 20}]:
+            with self.subTest(str(kwargs)):
+                vault = MemoryDmkFile(**kwargs)
+                self.assertIsNone(vault.data)
+                self.assertIsNone(vault.get_bytes("abc"))
+                vault.add_fakes(random_codename_fullsize(), 10)
+                reference = dict()
+                for _ in range(3):
+                    for name in gen_random_names(3) + ["abc"]:
+                        reference[name] = gen_random_content(
+                            0, MAX_CLUSTER_CONTENT_SIZE * 3)
+                        vault.set_bytes(name, reference[name])
+                names = list(reference.keys())
+                self.assertEqual(vault.get_many_bytes(names),
+                                 list(reference.values()))
+
+                # the same vault, read from the bytes
+                data = vault.data
+                assert data is not None
+                other = MemoryDmkFile(data)
+                self.assertEqual(other.layout, vault.layout)
+                self.assertEqual(other.get_many_bytes(names),
+                                 list(reference.values()))
+                result = other.set_many_bytes({"abc": b'changed',
+                                               "new": b'new'})
+                self.assertEqual(result.added, ["new"])
+                self.assertEqual(result.changed, ["abc"])
+                self.assertEqual(other.get_bytes("abc"), b'changed')
+                self.assertEqual(other.get_bytes("new"), b'new')
+                # the old bytes did not change
+                self.assertEqual(MemoryDmkFile(data).get_bytes("abc"),
+                                 reference["abc"])
+
+    def test_same_as_file(self):
+        with TemporaryDirectory() as tds:
+            path = Path(tds) / "vault.dmk"
+            DmkFile(path).set_bytes("abc", b'from file')
+            vault = MemoryDmkFile(path.read_bytes())
+            self.assertEqual(vault.get_bytes("abc"), b'from file')
+            vault.set_bytes("def", b'from memory')
+            assert vault.data is not None
+            path.write_bytes(vault.data)
+            self.assertEqual(DmkFile(path).get_many_bytes(["abc", "def"]),
+                             [b'from file', b'from memory'])
+
+    def test_cached_and_unchanged(self):
+        vault = MemoryDmkFile()
+        vault.set_bytes("abc", b'value')
+        data = vault.data
+        vault.get_bytes("abc")
+        vault.get_bytes("abc")
+        self.assertEqual(vault.metrics['scans'], 1)
+        vault.set_bytes("abc", b'value')
+        self.assertIs(vault.data, data)
+        self.assertEqual(vault.metrics['writes_skipped'], 1)
+        self.assertEqual(vault.stats()['vault_size'], len(data))
+
+
+if __name__ == "__main__":
+    unittest.main()